@@ -6,11 +6,44 @@ The init file with instructions for how to use the library
 
 import sys
 from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parents[0])) 
+if str(Path(__file__).resolve().parents[0]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[0]))
 
 from include.mkdocs_build import *
 from include.vmdoc import VmDocsGenerator, update_nav_section
+from include.vmdoc_watch import SourceWatcher, watch_and_regenerate
+from include.file_sync import sync_directory
+from include import tracing
 import shutil
+import threading
+import hashlib
+import json
+import importlib
+from typing import List
+
+# Written into a sub-project's site/ after a successful build, holds the hash of the shared theme
+PROJECT_BUILD_STAMP_FILE_NAME = ".vmdoc_build_stamp"
+
+# Optional parts, only imported when they are used so importing the library stays fast (e.g. tarfile for the build cache)
+_LAZY_ATTRIBUTES = {
+    "start_build_daemon": "include.build_daemon",
+    "daemon_build": "include.build_daemon",
+    "daemon_generate": "include.build_daemon",
+    "generate_vmdoc_shard": "include.vmdoc_shard",
+    "merge_vmdoc_shards": "include.vmdoc_shard",
+    "generate_sharded_locally": "include.vmdoc_shard",
+    "export_build_cache": "include.build_cache",
+    "import_build_cache": "include.build_cache",
+    "get_build_cache_key": "include.build_cache",
+    "has_build_state": "include.build_cache",
+    "check_site_links": "include.link_check",
+}
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
 
 
 
@@ -75,24 +108,213 @@ gitignore_content = \"""
 
 vicmil_generate_project_documentation(docs_dir, src_dir, gitignore_content)
 ```
+
+[OPTIONAL]: Extract tags and write the generated files in parallel, jobs=0 uses all cores
+The generated nav and overview are the same as for a serial run
+
+```
+vmdoc_generate(docs_dir, src_dir, jobs=0)
+```
+
+[OPTIONAL]: Only update docs/vmdoc and mkdocs.yml, without building the site
+
+```
+vmdoc_generate(docs_dir, src_dir, build=False)
+```
+
+[OPTIONAL]: Publish the raw sources once per content hash in docs/vmdoc/raw/, instead of one .txt per file
+Raw sources are never decoded, they are reflinked or copied in the kernel where the filesystem supports it
+
+```
+vmdoc_generate(docs_dir, src_dir, raw_store=True)
+```
+The raw store can also write a gzipped .txt.gz next to every source for servers that send precompressed files
+(the pages still link to the .txt), and cut sources larger
+than raw_max_size bytes with a note that they were truncated. Every run prints the deploy and disk size of docs/vmdoc
+
+```
+vmdoc_generate(docs_dir, src_dir, raw_store=True, raw_compress=True, raw_max_size=256 * 1024)
+```
+
+[OPTIONAL]: Trace where the time goes, prints a report of nested timings and counters
+and writes it to the given directory, as JSON, as a Chrome trace (open in https://ui.perfetto.dev)
+and as Prometheus metrics. compile_mkdocs and VmDocsMonoRepoGenerator.generate take the same argument
+
+```
+vmdoc_generate(docs_dir, src_dir, trace=get_directory_path(__file__) + "/trace")
+```
+
+[OPTIONAL]: Only render the pages that changed since the previous build, the rest of site/ is reused
+A full build is still done when the config, the theme, the list of pages or a page title changes
+
+```
+vmdoc_generate(docs_dir, src_dir, incremental=True)
+```
+
+[OPTIONAL]: Generate and build in a long-lived build daemon, which keeps mkdocs, the theme and its compiled
+templates loaded, and skips projects that did not change. Without a running daemon this builds locally
+Start the daemon once with `python include/build_daemon.py`, or from python
+
+```
+start_build_daemon()
+vmdoc_generate(docs_dir, src_dir, use_daemon=True)
+```
+compile_mkdocs takes the same use_daemon argument
+
+[OPTIONAL]: List the source files with git instead of walking src_dir, .gitignore is respected and only the files
+changed since the commit of the previous run are checked again. Walks src_dir if it is not in a git repository
+
+```
+vmdoc_generate(docs_dir, src_dir, use_git=True)
+```
+
+[OPTIONAL]: Minify the HTML, CSS and JSON of the built site and write precompressed .gz files next to the text files
+(.br and .zst too if brotli or zstandard is installed), so a static server can send them directly.
+Files that did not change since the previous build are skipped. compile_mkdocs takes the same argument
+
+```
+vmdoc_generate(docs_dir, src_dir, optimize_assets=True)
+```
+
+[OPTIONAL]: Split the generation over several CI jobs or hosts. Every shard generates a fixed slice of the files
+into its own directory, then the shard directories are collected in one place and merged into docs/vmdoc,
+which also writes the overview and nav. Build the site after the merge as usual
+
+```
+# In CI job i of 4
+generate_vmdoc_shard(shard_dir, src_dir, shard_index=i, shard_count=4)
+
+# Once every shard is done
+merge_vmdoc_shards(docs_dir, [shard_dir_0, shard_dir_1, shard_dir_2, shard_dir_3])
+compile_mkdocs(docs_dir)
+```
+generate_sharded_locally(docs_dir, src_dir, shard_count=4) runs every shard in its own process and merges them
+
+[OPTIONAL]: Keep the build state in one archive between CI runs, e.g. with actions/cache. A runner without
+a previous build restores the archive first, and writes it again after the build, so only what changed
+since the cached run is generated and rendered. The archive is only used if it was made by the same
+version of this package and the same mkdocs.yml (commit docs_dir/mkdocs.yml, a new default project
+gets a random site name). VmDocsMonoRepoGenerator.generate takes the same argument
+
+```
+vmdoc_generate(docs_dir, src_dir, incremental=True, use_git=True, build_cache=".cache/vmdoc_build.tar.gz")
+```
+`python include/build_cache.py key --docs DOCS_DIR --src SRC_DIR` prints a cache key for the CI cache,
+and `python include/build_cache.py export|import --docs DOCS_DIR --src SRC_DIR ARCHIVE` do each step on its own
+
+[OPTIONAL]: Check every internal link and anchor of the built site, between the vmdoc pages, the overview pages
+and the projects of a monorepo, and print the broken ones. Pages are read in parallel and only the pages
+a build wrote again are read next time. compile_mkdocs and VmDocsMonoRepoGenerator.generate take the same argument
+
+```
+vmdoc_generate(docs_dir, src_dir, check_links=True)
+```
+`python include/link_check.py SITE_DIR` does the same for any built site, and exits with 1 if a link is broken
+[vmdoc:end]
+"""
+def vmdoc_generate(docs_dir: str, src_dir: str, show_in_browser: bool = True, gitignore_content: str = None, jobs: int = 1, build: bool = True, *, raw_store: bool = False, trace: str = None, incremental: bool = False, use_daemon: bool = False, use_git: bool = False, optimize_assets: bool = False, raw_compress: bool = False, raw_max_size: int = None, build_cache: str = None, check_links: bool = False) -> None:
+    if use_daemon and build and not trace and not build_cache:
+        from include.build_daemon import daemon_generate
+        if daemon_generate(docs_dir, src_dir, gitignore_content, jobs, incremental, use_git=use_git, optimize_assets=optimize_assets,
+                           raw_store=raw_store, raw_compress=raw_compress, raw_max_size=raw_max_size) is not None:
+            if check_links:
+                check_built_site_links(docs_dir)
+            if show_in_browser:
+                serve_built_site(docs_dir, open_in_browser=True)
+            return
+        print("No build daemon running, building locally")
+
+    with tracing.tracing_session(trace):
+        # Ensure the mkdocs project is setup in the docs folder
+        if not os.path.exists(docs_dir):
+            mkdocs_default_project(docs_dir)
+
+        # A fresh checkout continues from the archived build state
+        if build_cache:
+            from include.build_cache import export_build_cache, import_build_cache, has_build_state
+            if not has_build_state(docs_dir):
+                import_build_cache(docs_dir, build_cache, src_dir)
+
+        # Build mkdocs files based on vmdoc documentation
+        vmdoc_generator = VmDocsGenerator(docs_dir)
+
+        if gitignore_content:
+            vmdoc_generator.set_pattern(gitignore_content)
+
+        vmdoc_generator.set_raw_source_options(use_store=raw_store, compress=raw_compress, max_size=raw_max_size)
+        if use_git:
+            vmdoc_generator.add_files_from_git(src_dir)
+        else:
+            vmdoc_generator.add_files_in_dir(src_dir)
+        vmdoc_generator.generate(jobs=jobs)
+
+        if build:
+            # Compile project, the trace ends before serving
+            compile_mkdocs(docs_dir, show_in_browser=False, incremental=incremental, optimize_assets=optimize_assets, check_links=check_links)
+
+        if build_cache:
+            export_build_cache(docs_dir, build_cache, [src_dir])
+
+    if not build:
+        return
+
+    # Show the result in the browser, the site is served as built
+    if show_in_browser:
+        serve_built_site(docs_dir, open_in_browser=True)
+
+
+"""
+[vmdoc:start]
+## vmdoc_watch
+
+Generate the documentation, then keep watching the source files
+When files are saved, only the changed files are extracted again and only their .md and .txt files are rewritten,
+so only those pages are built again and reloaded in the browser
+
+```
+def vmdoc_watch(docs_dir: str, src_dir: str, gitignore_content: str = None, serve: bool = True, jobs: int = 1, debounce: float = 0.3) -> None
+```
+
+Example
+```
+from vicmil_pip.packages.pyMkDocs import *
+
+docs_dir = get_directory_path(__file__) + "/docs"
+src_dir = get_directory_path(__file__, 2)
+
+vmdoc_watch(docs_dir, src_dir)
+```
 [vmdoc:end]
 """
-def vmdoc_generate(docs_dir: str, src_dir: str, show_in_browser: bool = True, gitignore_content: str = None) -> None:
-    # Ensure the mkdocs project is setup in the docs folder
+def vmdoc_watch(docs_dir: str, src_dir: str, gitignore_content: str = None, serve: bool = True, jobs: int = 1, debounce: float = 0.3) -> None:
     if not os.path.exists(docs_dir):
         mkdocs_default_project(docs_dir)
 
-    # Build mkdocs files based on vmdoc documentation
     vmdoc_generator = VmDocsGenerator(docs_dir)
-    
+
     if gitignore_content:
         vmdoc_generator.set_pattern(gitignore_content)
 
     vmdoc_generator.add_files_in_dir(src_dir)
-    vmdoc_generator.generate()
+    vmdoc_generator.generate(jobs=jobs)
+
+    # Changes in the docs directory are written by us or mkdocs, never watch them
+    watcher = SourceWatcher(src_dir, vmdoc_generator.pattern_matcher, exclude_dirs=[docs_dir], debounce=debounce)
+    print(f"Watching {src_dir} for changes")
+
+    if not serve:
+        try:
+            watch_and_regenerate(vmdoc_generator, src_dir, watcher, jobs)
+        except KeyboardInterrupt:
+            print("\nStopped watching.")
+        watcher.close()
+        return
 
-    # Compile project and show the result in the browser
-    compile_mkdocs(docs_dir, show_in_browser=show_in_browser)
+    # The server watches docs_dir, the pages we rewrite are built again incrementally and reloaded in the browser
+    watch_thread = threading.Thread(target=watch_and_regenerate, args=(vmdoc_generator, src_dir, watcher, jobs), daemon=True)
+    watch_thread.start()
+
+    serve_built_site(docs_dir, open_in_browser=True, build=True)
 
 
 """
@@ -112,7 +334,7 @@ class VmDocsMonoRepoGenerator:
         self._added_projects.append((doc_path, project_name))
     
 
-    def update_nav(self):
+    def update_nav(self, assembled: bool = False):
         # Update nav/projects with new data
         project_entries = list()
 
@@ -123,24 +345,122 @@ class VmDocsMonoRepoGenerator:
 
         projects = list_mkdocs_projects(projects_dir)
         for project_name in projects:
-            project_entries.append((project_name, f"!include ./projects/{project_name}/mkdocs.yml"))
+            if assembled:
+                # Link to the separately built sub-site
+                project_entries.append((project_name, f"projects/{project_name}/"))
+            else:
+                project_entries.append((project_name, f"!include ./projects/{project_name}/mkdocs.yml"))
 
         print(project_entries)
 
         update_nav_section(f"{self.docs_dir}/mkdocs.yml", "projects", project_entries)
-    
 
-    def generate(self, show_in_browser: bool = True):
-        if not os.path.exists(self.docs_dir):
-            mkdocs_monorepo_project(self.docs_dir)
 
-        # Copy all the repos to the target
-        for path, project_name in self._added_projects:
-            output_path = self.docs_dir + "/projects/" + project_name
-            print(f"copy {path} to {output_path}")
-            safe_copy_directory_with_ignore(path, output_path, "site/*")
+    def _build_assembled_site(self, changed_projects: List[str], jobs: int):
+        """
+        Build the top-level site and every sub-project in its own process at the same time,
+        then place each sub-project's site in site/projects/<name> and merge their search indexes
+        """
+        import concurrent.futures
+
+        projects_dir = f"{self.docs_dir}/projects"
+        projects = list_mkdocs_projects(projects_dir)
 
-        self.update_nav()
-        compile_mkdocs(self.docs_dir, show_in_browser=show_in_browser)
+        theme_config = load_mkdocs_yml(f"{self.docs_dir}/mkdocs.yml").get("theme")
+        if isinstance(theme_config, dict) and "custom_dir" in theme_config:
+            theme_config = dict(theme_config)
+            theme_config["custom_dir"] = os.path.abspath(os.path.join(self.docs_dir, theme_config["custom_dir"]))
+        build_stamp = hashlib.sha256(json.dumps(theme_config, sort_keys=True).encode('utf-8')).hexdigest()
 
-        
+        # Skip projects that did not change since their last build with the same theme
+        projects_to_build = list()
+        for project_name in projects:
+            stamp_path = f"{projects_dir}/{project_name}/site/{PROJECT_BUILD_STAMP_FILE_NAME}"
+            if project_name not in changed_projects and os.path.exists(stamp_path):
+                with open(stamp_path, 'r') as f:
+                    if f.read() == build_stamp:
+                        print(f"Project {project_name} unchanged, reusing its site")
+                        continue
+            projects_to_build.append(project_name)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs if jobs > 0 else None) as executor:
+            root_future = executor.submit(build_mkdocs_documentation, self.docs_dir)
+            project_futures = [(project_name, executor.submit(build_mkdocs_subsite, f"{projects_dir}/{project_name}", theme_config))
+                               for project_name in projects_to_build]
+
+            for project_name, future in project_futures:
+                if future.result():
+                    with open(f"{projects_dir}/{project_name}/site/{PROJECT_BUILD_STAMP_FILE_NAME}", 'w') as f:
+                        f.write(build_stamp)
+                else:
+                    print(f"Failed to build project {project_name}")
+            root_future.result()
+
+        for project_name in projects:
+            sync_stats = sync_directory(f"{projects_dir}/{project_name}/site", f"{self.docs_dir}/site/projects/{project_name}", PROJECT_BUILD_STAMP_FILE_NAME)
+            print(f"assemble {project_name}: {sync_stats}")
+
+        # The top-level build only indexed its own pages, add the indexes the sub-project builds made
+        with tracing.span("merge_search_indexes"):
+            added_entries = merge_search_indexes(f"{self.docs_dir}/site", [(f"projects/{project_name}/", f"{self.docs_dir}/site/projects/{project_name}")
+                                                                          for project_name in projects])
+        print(f"Merged {added_entries} search entries of {len(projects)} projects into the site search index")
+
+
+    def generate(self, show_in_browser: bool = True, parallel_build: bool = False, jobs: int = 0, trace: str = None, build_cache: str = None,
+                 check_links: bool = False):
+        """
+        Args:
+            parallel_build: Build every sub-project in its own process and assemble the sites,
+                            instead of one mkdocs build over all projects
+            jobs: Number of build processes for parallel_build, 0 uses all cores
+            trace: Directory to write a timing trace to, see tracing_session.
+                   With parallel_build the builds in the worker processes show up as one span
+            build_cache: Archive of the build state, restored first on a runner without a previous build
+                         and written again after the build, see export_build_cache
+            check_links: Check the internal links and anchors of the assembled site, see include/link_check.py
+        """
+        with tracing.tracing_session(trace):
+            if not os.path.exists(self.docs_dir):
+                mkdocs_monorepo_project(self.docs_dir)
+
+            if build_cache:
+                from include.build_cache import export_build_cache, import_build_cache, has_build_state
+                if not has_build_state(self.docs_dir):
+                    import_build_cache(self.docs_dir, build_cache)
+
+            # Sync all the repos to the target, only changed files are copied.
+            # Never hardlinked, a write to the copy would change the upstream project
+            changed_projects = list()
+            for path, project_name in self._added_projects:
+                output_path = self.docs_dir + "/projects/" + project_name
+                with tracing.span("sync", project=project_name):
+                    sync_stats = sync_directory(path, output_path, "/site/", link_mode="reflink")
+                print(f"sync {path} to {output_path}: {sync_stats}")
+                tracing.count("bytes_written", sync_stats.bytes_copied)
+                tracing.count("files_skipped", sync_stats.files_skipped)
+                if sync_stats.files_copied + sync_stats.files_linked + sync_stats.files_deleted > 0:
+                    changed_projects.append(project_name)
+
+            with tracing.span("nav"):
+                self.update_nav(assembled=parallel_build)
+
+            if not parallel_build:
+                compile_mkdocs(self.docs_dir, show_in_browser=False, check_links=check_links)
+            else:
+                with tracing.span("build_assembled_site", jobs=jobs):
+                    self._build_assembled_site(changed_projects, jobs)
+                # Only the assembled site has the links into projects/
+                if check_links:
+                    check_built_site_links(self.docs_dir)
+
+            if build_cache:
+                export_build_cache(self.docs_dir, build_cache, [path for path, _ in self._added_projects])
+
+        if not show_in_browser:
+            return
+
+        if parallel_build:
+            serve_site_directory(f"{self.docs_dir}/site", open_in_browser=True)
+        else:
+            serve_built_site(self.docs_dir, open_in_browser=True)
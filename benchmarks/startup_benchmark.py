@@ -0,0 +1,107 @@
+"""
+[vmdoc:description]
+Startup benchmark, checks that importing the package plus a no-op vmdoc_generate stays under a time budget
+[vmdoc:enddescription]
+
+Usage:
+    python benchmarks/startup_benchmark.py --budget-ms 500
+
+Each sample runs in a fresh python process: import the package, then run vmdoc_generate
+with build=False on a small source tree that was already generated, so nothing changed.
+Exits with status 1 if the median time is over the budget.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+
+_CHILD_CODE = """
+import sys, time, json
+start = time.perf_counter()
+import importlib
+package = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+package.vmdoc_generate(sys.argv[2], sys.argv[3], show_in_browser=False, build=False)
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "generate_ms": (done - imported) * 1000}))
+"""
+
+
+def _find_vizpip_env_parent() -> str:
+    for parent in Path(__file__).resolve().parents:
+        if (parent / "vizpip_env").is_dir():
+            return str(parent)
+    return ""
+
+
+def _create_source_tree(src_dir: str, file_count: int):
+    for i in range(file_count):
+        dir_path = os.path.join(src_dir, f"dir{i % 10}")
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, f"file{i}.py"), 'w') as f:
+            f.write("x = 1\n" * 20)
+            if i % 10 == 0:
+                f.write('"""\n[vmdoc:start ]\n## Docs\n[vmdoc:end ]\n"""\n'.replace(" ]", "]"))
+
+
+def _create_docs_project(docs_dir: str):
+    # Minimal project, so vmdoc_generate does not need mkdocs to create one
+    os.makedirs(os.path.join(docs_dir, "docs"), exist_ok=True)
+    with open(os.path.join(docs_dir, "mkdocs.yml"), 'w') as f:
+        f.write("site_name: Startup benchmark\nnav:\n  - vmdoc: vmdoc/vmdocs.md\n")
+
+
+def run_startup_benchmark(module: str, python_path: str, repeat: int, file_count: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, "src")
+        docs_dir = os.path.join(tmp_dir, "docs")
+        _create_source_tree(src_dir, file_count)
+        _create_docs_project(docs_dir)
+
+        env = dict(os.environ)
+        if python_path:
+            env["PYTHONPATH"] = os.pathsep.join(filter(None, [python_path, env.get("PYTHONPATH")]))
+
+        samples = list()
+        # The first run generates everything, the following runs are no-ops
+        for i in range(repeat + 1):
+            result = subprocess.run([sys.executable, "-c", _CHILD_CODE, module, docs_dir, src_dir],
+                                    env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Benchmark process failed:\n{result.stderr}")
+            if i > 0:
+                samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    return {
+        "import_ms": statistics.median(sample["import_ms"] for sample in samples),
+        "generate_ms": statistics.median(sample["generate_ms"] for sample in samples),
+        "total_ms": statistics.median(sample["import_ms"] + sample["generate_ms"] for sample in samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import plus no-op vmdoc_generate time")
+    parser.add_argument("--module", default="vizpip_env.lib.pyMkDocs", help="Module name of the package")
+    parser.add_argument("--python-path", default=_find_vizpip_env_parent(), help="Directory to put on PYTHONPATH")
+    parser.add_argument("--budget-ms", type=float, default=500.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--files", type=int, default=200, help="Number of files in the source tree")
+    args = parser.parse_args()
+
+    result = run_startup_benchmark(args.module, args.python_path, args.repeat, args.files)
+    print(json.dumps(result, indent=2))
+
+    if result["total_ms"] > args.budget_ms:
+        print(f"Startup took {result['total_ms']:.1f}ms, over the budget of {args.budget_ms:.1f}ms")
+        sys.exit(1)
+    print(f"Startup took {result['total_ms']:.1f}ms, within the budget of {args.budget_ms:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
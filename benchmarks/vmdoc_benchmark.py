@@ -0,0 +1,240 @@
+"""
+[vmdoc:description]
+Benchmark of the vmdoc pipeline on synthetic source trees, times every phase and compares against a baseline
+[vmdoc:enddescription]
+
+Usage:
+    python benchmarks/vmdoc_benchmark.py --sizes 1000,10000 --output results.json
+    python benchmarks/vmdoc_benchmark.py --sizes 1000,10000 --baseline results.json --threshold 0.25
+
+For every size a synthetic source tree is generated, then these phases are timed (median of --repeat runs):
+    walk      VmDocsGenerator.add_files_in_dir
+    extract   scan_vmdoc_file on every walked file
+    write     VmDocsGenerator.generate into an empty docs/vmdoc
+    noop      VmDocsGenerator.generate again, nothing changed
+    nav       update_nav_section with one entry per tagged file, then again without changes
+    build     mkdocs build of the generated project, skipped if mkdocs is not installed
+
+Runs offline, the mkdocs project uses the built-in mkdocs theme and nothing is installed.
+Exits with status 1 if a phase is slower than the baseline by more than the threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import importlib
+import importlib.util
+import statistics
+from pathlib import Path
+
+
+PHASES = ["walk", "extract", "write", "noop", "nav", "build"]
+
+
+def _find_vizpip_env_parent() -> str:
+    for parent in Path(__file__).resolve().parents:
+        if (parent / "vizpip_env").is_dir():
+            return str(parent)
+    return ""
+
+
+def create_synthetic_tree(src_dir: str, file_count: int, tag_density: float, file_size: int,
+                          excluded_files: int, seed: int = 0) -> int:
+    """
+    Create file_count source files spread over nested directories, plus excluded_files files
+    in node_modules/ and venv/ that the default pattern excludes.
+
+    Args:
+        tag_density: Fraction of the files that have vmdoc tags
+        file_size: Approximate size of every file in bytes
+    Returns the number of tagged files
+    """
+    rng = random.Random(seed)
+    extensions = [".py", ".cpp", ".h", ".js", ".java", ".txt"]
+    filler = "value = compute(value) + 1  # filler line\n"
+    start_tag, end_tag = "[vmdoc:start ]".replace(" ", ""), "[vmdoc:end ]".replace(" ", "")
+    description_tag, end_description_tag = "[vmdoc:description ]".replace(" ", ""), "[vmdoc:enddescription ]".replace(" ", "")
+
+    tagged_count = 0
+    for i in range(file_count):
+        dir_path = os.path.join(src_dir, f"pkg{i % 32}", f"mod{(i // 32) % 16}")
+        os.makedirs(dir_path, exist_ok=True)
+
+        content = ""
+        if rng.random() < tag_density:
+            tagged_count += 1
+            content += (f'"""\n{description_tag}\nSynthetic file {i}\n{end_description_tag}\n"""\n'
+                        f'"""\n{start_tag}\n## File {i}\n\nSome documentation for file {i}\n{end_tag}\n"""\n')
+        content += filler * max(1, (file_size - len(content)) // len(filler))
+
+        with open(os.path.join(dir_path, f"file{i}{rng.choice(extensions)}"), 'w') as f:
+            f.write(content)
+
+    for i in range(excluded_files):
+        dir_path = os.path.join(src_dir, ["node_modules", "venv"][i % 2], f"dep{i % 64}")
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, f"dep{i}.js"), 'w') as f:
+            f.write(filler * 4)
+
+    return tagged_count
+
+
+def _create_docs_project(docs_dir: str):
+    os.makedirs(os.path.join(docs_dir, "docs"), exist_ok=True)
+    with open(os.path.join(docs_dir, "docs", "index.md"), 'w') as f:
+        f.write("# Benchmark\n")
+    with open(os.path.join(docs_dir, "mkdocs.yml"), 'w') as f:
+        f.write("site_name: vmdoc benchmark\ntheme:\n  name: mkdocs\nnav:\n  - Home: index.md\n  - vmdoc: vmdoc/vmdocs.md\n")
+
+
+def _time_ms(function) -> float:
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+def _mkdocs_available() -> bool:
+    return importlib.util.find_spec("mkdocs") is not None
+
+
+def _build_site(docs_dir: str):
+    # mkdocs is called directly, build_mkdocs_documentation would check for missing pip packages first
+    from mkdocs.config import load_config
+    from mkdocs.commands.build import build
+    build(load_config(os.path.join(docs_dir, "mkdocs.yml"), site_dir=os.path.join(docs_dir, "site")))
+
+
+def run_vmdoc_benchmark(package, file_count: int, tag_density: float, file_size: int,
+                        excluded_files: int, repeat: int, jobs: int, skip_build: bool = False) -> dict:
+    from include.vmdoc import scan_vmdoc_file
+
+    samples = {phase: list() for phase in PHASES}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src_dir = os.path.join(tmp_dir, "src")
+        docs_dir = os.path.join(tmp_dir, "docs")
+        tagged_count = create_synthetic_tree(src_dir, file_count, tag_density, file_size, excluded_files)
+        _create_docs_project(docs_dir)
+
+        for _ in range(repeat):
+            shutil.rmtree(os.path.join(docs_dir, "docs", "vmdoc"), ignore_errors=True)
+
+            generator = package.VmDocsGenerator(docs_dir)
+            samples["walk"].append(_time_ms(lambda: generator.add_files_in_dir(src_dir)))
+
+            file_paths = [file_path for file_path, _ in generator.files]
+            samples["extract"].append(_time_ms(lambda: [scan_vmdoc_file(file_path) for file_path in file_paths]))
+
+            samples["write"].append(_time_ms(lambda: generator.generate(jobs=jobs)))
+            samples["noop"].append(_time_ms(lambda: generator.generate(jobs=jobs)))
+
+            nav_entries = [(relative_path, f"vmdoc/{generator._get_file_base_name_with_hash(relative_path)}.md")
+                           for _, relative_path, _ in generator.iter_documented_files()]
+            mkdocs_yml_path = os.path.join(docs_dir, "mkdocs.yml")
+            samples["nav"].append(_time_ms(lambda: (package.update_nav_section(mkdocs_yml_path, "files", nav_entries),
+                                                    package.update_nav_section(mkdocs_yml_path, "files", nav_entries))))
+            package.update_nav_section(mkdocs_yml_path, "files", None)
+
+            if not skip_build and _mkdocs_available():
+                samples["build"].append(_time_ms(lambda: _build_site(docs_dir)))
+
+    result = {"files": file_count, "tagged_files": tagged_count}
+    for phase in PHASES:
+        if samples[phase]:
+            result[f"{phase}_ms"] = statistics.median(samples[phase])
+    return result
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float, min_ms: float) -> list:
+    """
+    Returns a list of regression messages. A phase regressed if it is slower than the baseline
+    by more than threshold (relative) and min_ms (absolute, ignores noise in fast phases)
+    """
+    regressions = list()
+    for size, result in results["results"].items():
+        baseline_result = baseline.get("results", {}).get(size)
+        if baseline_result is None:
+            continue
+
+        for phase in PHASES:
+            key = f"{phase}_ms"
+            if key not in result or key not in baseline_result:
+                continue
+
+            current_ms, baseline_ms = result[key], baseline_result[key]
+            if current_ms > baseline_ms * (1 + threshold) and current_ms - baseline_ms > min_ms:
+                regressions.append(f"{size} files, {phase}: {current_ms:.1f}ms, baseline {baseline_ms:.1f}ms")
+    return regressions
+
+
+def _print_table(results: dict):
+    print(f"{'files':>8} " + " ".join(f"{phase + ' ms':>11}" for phase in PHASES))
+    for size, result in results["results"].items():
+        columns = [f"{result[f'{phase}_ms']:11.1f}" if f"{phase}_ms" in result else f"{'-':>11}" for phase in PHASES]
+        print(f"{size:>8} " + " ".join(columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the phases of the vmdoc pipeline on synthetic source trees")
+    parser.add_argument("--module", default="vizpip_env.lib.pyMkDocs", help="Module name of the package")
+    parser.add_argument("--python-path", default=_find_vizpip_env_parent(), help="Directory to put on sys.path")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated number of source files, e.g. 1000,10000,100000")
+    parser.add_argument("--tag-density", type=float, default=0.2, help="Fraction of the files with vmdoc tags")
+    parser.add_argument("--file-size", type=int, default=2048, help="Approximate size of a source file in bytes")
+    parser.add_argument("--excluded-files", type=int, default=0, help="Number of files in excluded directories")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=1, help="Workers used by generate, 0 uses all cores")
+    parser.add_argument("--skip-build", action="store_true", help="Do not time the mkdocs build")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown relative to the baseline")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="Slowdowns below this many ms are never regressions")
+    args = parser.parse_args()
+
+    if args.python_path and args.python_path not in sys.path:
+        sys.path.insert(0, args.python_path)
+    package = importlib.import_module(args.module)
+
+    results = {
+        "config": {
+            "tag_density": args.tag_density,
+            "file_size": args.file_size,
+            "excluded_files": args.excluded_files,
+            "repeat": args.repeat,
+            "jobs": args.jobs,
+        },
+        "results": {},
+    }
+    for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+        results["results"][str(size)] = run_vmdoc_benchmark(package, size, args.tag_density, args.file_size,
+                                                            args.excluded_files, args.repeat, args.jobs, args.skip_build)
+
+    _print_table(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        if baseline.get("config") != results["config"]:
+            print("Warning: the baseline was measured with a different configuration")
+
+        regressions = compare_with_baseline(results, baseline, args.threshold, args.min_ms)
+        if regressions:
+            print("Regressions compared to the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions compared to the baseline")
+
+
+if __name__ == "__main__":
+    main()
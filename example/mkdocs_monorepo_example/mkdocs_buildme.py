@@ -21,15 +21,13 @@ if not os.path.exists(project1):
 if not os.path.exists(project2):
     mkdocs_default_project(project2, site_name="Project2")
 
-compile_mkdocs(project1, show_in_browser=False)
-compile_mkdocs(project2, show_in_browser=False)
-
 mono_repo = base_docs + "/docs_mono"
 mono_repo_generator = VmDocsMonoRepoGenerator(mono_repo)
 mono_repo_generator.add_project(project1, "project1")
 mono_repo_generator.add_project(project2, "project2")
 
-mono_repo_generator.generate()
+# Each project is built in its own process, then the sites are assembled into one
+mono_repo_generator.generate(parallel_build=True)
 
 
 
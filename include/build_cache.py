@@ -0,0 +1,278 @@
+"""
+[vmdoc:description]
+Portable archive of the incremental build state, so a fresh CI runner only rebuilds what changed since the cached run
+[vmdoc:enddescription]
+
+The archive holds docs/vmdoc with its manifest, site/, .vmdoc_cache/ and the projects/ copies of a monorepo,
+with a small header that says what it was built with:
+
+    package_version     Hash of this package's own code and the mkdocs version
+    config_hash         Hash of mkdocs.yml without its nav, which every run writes again
+    source_fingerprint  The git commit of the sources, or a hash of their paths and sizes
+
+An archive built by another package version or config is not restored, everything is built from scratch.
+The sources may differ: the manifest, the incremental build cache and the sync of the projects
+then find the files that changed since the cached run, with use_git from the git diff to the cached commit.
+
+    python include/build_cache.py key --docs DOCS_DIR --src SRC_DIR
+    python include/build_cache.py export --docs DOCS_DIR --src SRC_DIR ARCHIVE
+    python include/build_cache.py import --docs DOCS_DIR --src SRC_DIR ARCHIVE
+
+`key` prints a cache key for e.g. actions/cache, use everything before the source fingerprint as restore key
+"""
+
+import sys
+from pathlib import Path
+if str(Path(__file__).resolve().parents[1]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import os
+import io
+import json
+import time
+import shutil
+import tarfile
+import hashlib
+from typing import List, Optional
+
+from include.vmdoc_git import get_head_commit, get_changed_files
+from include.vmdoc_manifest import VmDocManifest, MANIFEST_FILE_NAME
+from include import tracing
+
+
+BUILD_CACHE_INFO_FILE_NAME = ".vmdoc_build_cache.json"
+
+# Paths in the docs directory that are archived, those that do not exist are left out
+CACHED_PATHS = ["docs/vmdoc", "site", ".vmdoc_cache", "projects"]
+
+# Bump when archives of an older version can not be restored
+BUILD_CACHE_VERSION = 1
+
+
+def get_package_version() -> str:
+    """Hash of the code of this package and the mkdocs version, any change can change the outputs"""
+    import mkdocs
+
+    package_dir = Path(__file__).resolve().parents[1]
+    sha = hashlib.sha256(mkdocs.__version__.encode('utf-8'))
+    for file_path in sorted([package_dir / "__init__.py"] + list((package_dir / "include").glob("*.py"))):
+        sha.update(f"\n{file_path.name}\n".encode('utf-8'))
+        sha.update(file_path.read_bytes())
+    return sha.hexdigest()[:16]
+
+
+def get_config_hash(docs_dir: str) -> str:
+    """Hash of mkdocs.yml without the nav, vmdoc and the monorepo rewrite the nav on every run"""
+    from include.mkdocs_build import load_mkdocs_yml
+
+    config = load_mkdocs_yml(os.path.join(docs_dir, "mkdocs.yml"))
+    config.pop("nav", None)
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def get_source_fingerprint(src_dirs: List[str]) -> str:
+    """
+    The git commit of every source directory, with "-dirty" if there are local changes.
+    Directories outside git are hashed by the paths and sizes of their files, mtimes differ on every checkout
+    """
+    sha = hashlib.sha256()
+    for src_dir in src_dirs:
+        commit = get_head_commit(src_dir)
+        if commit is not None:
+            changed_files = get_changed_files(src_dir, commit)
+            sha.update(f"{commit}{'-dirty' if changed_files else ''}\n".encode('utf-8'))
+            continue
+
+        for dir_path, dir_names, file_names in os.walk(src_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                file_path = os.path.join(dir_path, file_name)
+                relative_path = os.path.relpath(file_path, src_dir).replace(os.sep, "/")
+                sha.update(f"{relative_path}:{os.path.getsize(file_path)}\n".encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+def get_build_cache_key(docs_dir: str, src_dirs: List[str]) -> str:
+    """Cache key for a CI cache, an older archive of the same package version and config is still useful"""
+    return f"vmdoc-{get_package_version()}-{get_config_hash(docs_dir)}-{get_source_fingerprint(src_dirs)}"
+
+
+def _get_info(docs_dir: str, src_dirs: List[str]) -> dict:
+    return {
+        "version": BUILD_CACHE_VERSION,
+        "package_version": get_package_version(),
+        "config_hash": get_config_hash(docs_dir),
+        "source_fingerprint": get_source_fingerprint(src_dirs),
+        "docs_dir": os.path.abspath(docs_dir),
+        "src_dirs": [os.path.abspath(src_dir) for src_dir in src_dirs],
+        "created": int(time.time()),
+    }
+
+
+def _skip_links(tar_info: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+    # Hard links between archived files are kept, symlinks could point anywhere on the restoring host
+    return None if tar_info.issym() else tar_info
+
+
+def export_build_cache(docs_dir: str, archive_path: str, src_dirs: List[str]) -> dict:
+    """
+    Write the build state of docs_dir to a .tar.gz archive, returns the info stored in its header
+
+    Args:
+        src_dirs: The source directories of the build, for the source fingerprint
+    """
+    with tracing.span("export_build_cache"):
+        info = _get_info(docs_dir, src_dirs)
+        info_data = json.dumps(info, sort_keys=True).encode('utf-8')
+
+        os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+        tmp_path = f"{archive_path}.tmp{os.getpid()}"
+        with tarfile.open(tmp_path, "w:gz", compresslevel=6) as tar:
+            # The header goes first, so import can check it without decompressing the rest
+            tar_info = tarfile.TarInfo(BUILD_CACHE_INFO_FILE_NAME)
+            tar_info.size = len(info_data)
+            tar_info.mtime = info["created"]
+            tar.addfile(tar_info, io.BytesIO(info_data))
+
+            for cached_path in CACHED_PATHS:
+                if os.path.exists(os.path.join(docs_dir, cached_path)):
+                    tar.add(os.path.join(docs_dir, cached_path), arcname=cached_path, filter=_skip_links)
+        os.replace(tmp_path, archive_path)
+
+    archive_size = os.path.getsize(archive_path)
+    tracing.count("build_cache_bytes", archive_size)
+    print(f"Exported build cache {archive_path}: {archive_size / (1024 * 1024):.1f} MiB, source {info['source_fingerprint']}")
+    return info
+
+
+def _is_safe_member(tar_info: tarfile.TarInfo) -> bool:
+    """Only regular files and directories under CACHED_PATHS, and hard links between them"""
+    def is_cached_path(name: str) -> bool:
+        parts = name.split("/")
+        if name.startswith("/") or ".." in parts or "\\" in name:
+            return False
+        return any(name == cached_path or name.startswith(cached_path + "/") for cached_path in CACHED_PATHS)
+
+    if tar_info.islnk():
+        return is_cached_path(tar_info.name) and is_cached_path(tar_info.linkname)
+    return (tar_info.isfile() or tar_info.isdir()) and is_cached_path(tar_info.name)
+
+
+def _relocate(docs_dir: str, src_dir: Optional[str], info: dict):
+    """Point the caches that store absolute paths at the directories of this host"""
+    from include import site_assets
+    from include import mkdocs_incremental
+    from include import link_check
+
+    site_dir = os.path.abspath(os.path.join(docs_dir, "site"))
+    cache_dir = os.path.join(docs_dir, ".vmdoc_cache")
+    site_assets.relocate_cache(cache_dir, site_dir)
+    mkdocs_incremental.relocate_cache(docs_dir, site_dir)
+    link_check.relocate_cache(cache_dir, site_dir)
+
+    # With use_git the manifest records the cached commit by source directory
+    manifest_path = os.path.join(docs_dir, "docs", "vmdoc", MANIFEST_FILE_NAME)
+    if src_dir is None or len(info["src_dirs"]) != 1 or not os.path.exists(manifest_path):
+        return
+    manifest = VmDocManifest(manifest_path)
+    manifest.load()
+    for dir_path in list(manifest.git_sources.keys()):
+        if os.path.isabs(dir_path) and dir_path == info["src_dirs"][0] and dir_path != os.path.abspath(src_dir):
+            manifest.set_git_source(os.path.abspath(src_dir), manifest.get_git_source(dir_path))
+            manifest.set_git_source(dir_path, None)
+    if manifest.changed:
+        # Keep the save time of the cached run, sources are only trusted by stat if they are older
+        manifest.saved_ns_limit = manifest.saved_ns
+        manifest.save()
+
+
+def import_build_cache(docs_dir: str, archive_path: str, src_dir: str = None) -> bool:
+    """
+    Restore the build state of an archive into docs_dir, replacing the cached paths it contains.
+    Returns False, and leaves docs_dir as it is, if the archive is missing, unreadable, or was built
+    with another package version or mkdocs.yml
+
+    Args:
+        src_dir: The source directory of vmdoc_generate, the manifest is moved to it if it was built elsewhere
+    """
+    if not os.path.isfile(archive_path):
+        print(f"No build cache at {archive_path}")
+        return False
+
+    tmp_dir = os.path.join(docs_dir, f".vmdoc_build_cache.tmp{os.getpid()}")
+    try:
+        with tracing.span("import_build_cache"), tarfile.open(archive_path, "r:gz") as tar:
+            info_member = tar.next()
+            if info_member is None or info_member.name != BUILD_CACHE_INFO_FILE_NAME:
+                print(f"Ignoring build cache {archive_path}: no build cache header")
+                return False
+            info = json.load(tar.extractfile(info_member))
+
+            if info.get("version") != BUILD_CACHE_VERSION or info.get("package_version") != get_package_version():
+                print(f"Ignoring build cache {archive_path}: built by another version")
+                return False
+            if info.get("config_hash") != get_config_hash(docs_dir):
+                print(f"Ignoring build cache {archive_path}: mkdocs.yml changed")
+                return False
+
+            members = list()
+            for tar_info in tar:
+                if tar_info is info_member:
+                    continue
+                if not _is_safe_member(tar_info):
+                    raise ValueError(f"Unexpected archive member {tar_info.name}")
+                members.append(tar_info)
+            extract_args = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+            tar.extractall(tmp_dir, members=members, **extract_args)
+    except (OSError, ValueError, tarfile.TarError) as e:
+        print(f"Ignoring build cache {archive_path}: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+
+    for cached_path in CACHED_PATHS:
+        restored_path = os.path.join(tmp_dir, cached_path)
+        if not os.path.exists(restored_path):
+            continue
+        target_path = os.path.join(docs_dir, cached_path)
+        if os.path.exists(target_path):
+            shutil.rmtree(target_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(restored_path, target_path)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _relocate(docs_dir, src_dir, info)
+    print(f"Restored build cache {archive_path}, built from source {info['source_fingerprint']}")
+    return True
+
+
+def has_build_state(docs_dir: str) -> bool:
+    """True if docs_dir already has the state of a previous build, which is at least as new as any archive"""
+    return (os.path.exists(os.path.join(docs_dir, "docs", "vmdoc", MANIFEST_FILE_NAME))
+            or os.path.exists(os.path.join(docs_dir, "site"))
+            or os.path.exists(os.path.join(docs_dir, ".vmdoc_cache")))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Export or import the build state of a docs directory")
+    parser.add_argument("command", choices=["key", "export", "import"])
+    parser.add_argument("archive", nargs="?", help="The .tar.gz archive, not needed for key")
+    parser.add_argument("--docs", required=True, help="The mkdocs project directory")
+    parser.add_argument("--src", action="append", default=[], help="A source directory, can be given more than once")
+    args = parser.parse_args()
+
+    if args.command == "key":
+        print(get_build_cache_key(args.docs, args.src))
+        return
+    if args.archive is None:
+        parser.error(f"{args.command} needs the archive path")
+
+    if args.command == "export":
+        export_build_cache(args.docs, args.archive, args.src)
+    else:
+        # A cache miss is not an error, the build then starts from scratch
+        import_build_cache(args.docs, args.archive, args.src[0] if len(args.src) == 1 else None)
+
+
+if __name__ == "__main__":
+    main()
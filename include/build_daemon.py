@@ -0,0 +1,399 @@
+"""
+[vmdoc:description]
+Long-lived build server on a Unix socket that keeps mkdocs, the themes and compiled templates loaded between builds
+[vmdoc:enddescription]
+
+Start it with
+    python include/build_daemon.py [--socket PATH]
+
+Protocol: one JSON object per line in both directions.
+    {"command": "ping"}
+    {"command": "build", "docs_path": "...", "incremental": false, "force": false, "optimize_assets": false}
+    {"command": "generate", "docs_dir": "...", "src_dir": "...", "gitignore_content": null, "jobs": 1, "incremental": false, "use_git": false,
+     "optimize_assets": false, "raw_store": false, "raw_compress": false, "raw_max_size": null}
+    {"command": "shutdown"}
+Every response has "ok", plus "skipped", "duration_ms" and "log" (the printed output of the build) for builds,
+or "error" if the request failed.
+"""
+
+import sys
+from pathlib import Path
+if str(Path(__file__).resolve().parents[1]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import os
+import io
+import re
+import glob
+import json
+import time
+import socket
+import hashlib
+import tempfile
+import threading
+import contextlib
+import subprocess
+from typing import Dict, Optional
+
+
+# Overrides the default socket path
+SOCKET_PATH_ENV = "PYMKDOCS_DAEMON_SOCKET"
+
+
+def get_default_socket_path() -> str:
+    if os.environ.get(SOCKET_PATH_ENV):
+        return os.environ[SOCKET_PATH_ENV]
+    user_id = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(tempfile.gettempdir(), f"pymkdocs-build-{user_id}.sock")
+
+
+# Sub-projects of the monorepo plugin, e.g. "!include ./projects/name/mkdocs.yml" in the nav
+_INCLUDE_RE = re.compile(rb"!include\s+[\"']?([^\s\"'#]+)")
+
+
+def _hash_path(sha, path: str):
+    """Name, size and mtime of a file, or of every file in a directory"""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+        return
+
+    sha.update(f"{path}/\n".encode('utf-8'))
+    for current_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(current_path, file_name)
+            stat = os.stat(file_path)
+            sha.update(f"{os.path.relpath(file_path, path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+
+
+def _hash_config(sha, config_file: str, seen: set):
+    from include.mkdocs_build import load_mkdocs_yml
+
+    config_file = os.path.abspath(config_file)
+    if config_file in seen:
+        return
+    seen.add(config_file)
+
+    with open(config_file, 'rb') as f:
+        content = f.read()
+    sha.update(f"{config_file}\n".encode('utf-8'))
+    sha.update(content)
+
+    config_dir = os.path.dirname(config_file)
+    config = load_mkdocs_yml(config_file)
+    theme = config.get("theme")
+    paths = [config.get("docs_dir") or "docs"] + list(config.get("watch") or [])
+    if isinstance(theme, dict) and theme.get("custom_dir"):
+        paths.append(theme["custom_dir"])
+    for path in paths:
+        _hash_path(sha, os.path.join(config_dir, path))
+
+    if config.get("INHERIT"):
+        _hash_config(sha, os.path.join(config_dir, config["INHERIT"]), seen)
+    for match in _INCLUDE_RE.finditer(content):
+        include_pattern = os.path.join(config_dir, match.group(1).decode('utf-8'))
+        for include_file in sorted(glob.glob(include_pattern)):
+            _hash_config(sha, include_file, seen)
+
+
+def get_project_fingerprint(docs_path: str) -> str:
+    """
+    Hash of mkdocs.yml and of the name, size and mtime of every file the build reads: the docs directory,
+    theme.custom_dir, the watch paths, and the same for the INHERIT config and every sub-project pulled in
+    with !include. Equal fingerprints mean the project did not change, the files are never read.
+    Files other plugins read from elsewhere are not seen, build with force to pick them up
+    """
+    sha = hashlib.sha256()
+    _hash_config(sha, os.path.join(docs_path, "mkdocs.yml"), set())
+    return sha.hexdigest()
+
+
+class _SharedBytecodeCache:
+    """
+    Jinja bytecode cache shared by every build, so the theme templates are compiled once per daemon.
+    Entries are keyed by template name and checked against the template source by jinja
+    """
+    def __init__(self):
+        import jinja2
+        cache = dict()
+
+        class MemoryBytecodeCache(jinja2.BytecodeCache):
+            def load_bytecode(self, bucket):
+                if bucket.key in cache:
+                    bucket.bytecode_from_string(cache[bucket.key])
+
+            def dump_bytecode(self, bucket):
+                cache[bucket.key] = bucket.bytecode_to_string()
+
+        self.bytecode_cache = MemoryBytecodeCache()
+
+
+    def install(self, config):
+        """Make every jinja environment created for this config use the shared cache"""
+        theme = config.theme
+        create_env = theme.get_env
+
+        def get_env():
+            env = create_env()
+            env.bytecode_cache = self.bytecode_cache
+            return env
+
+        theme.get_env = get_env
+
+
+def _cache_entry_point_lookups():
+    """
+    Look up the installed plugins and themes once per daemon, load_config otherwise reads the entry points
+    of every installed package on each build. Restart the daemon after installing a plugin or theme
+    """
+    import functools
+    import mkdocs.plugins
+    import mkdocs.utils
+
+    mkdocs.plugins.get_plugins = functools.lru_cache(maxsize=None)(mkdocs.plugins.get_plugins)
+    mkdocs.utils.get_theme_dir = functools.lru_cache(maxsize=None)(mkdocs.utils.get_theme_dir)
+    theme_names = tuple(mkdocs.utils.get_theme_names())
+    mkdocs.utils.get_theme_names = lambda: theme_names
+
+
+class BuildDaemon:
+    """
+    Serves build requests one at a time. Projects whose fingerprint did not change since their
+    last successful build in this daemon are skipped. The config is loaded again for every build, like
+    mkdocs serve does, the plugins rewrite it in on_config.
+    """
+    def __init__(self, socket_path: str = None):
+        self.socket_path = socket_path or get_default_socket_path()
+        self._fingerprints: Dict[str, str] = dict()
+        self._build_lock = threading.Lock()
+        self._server = None
+        self._bytecode_cache = None
+
+
+    def _warm_up(self):
+        # Import everything a build needs once, instead of once per build
+        from include import mkdocs_build
+        mkdocs_build.ensure_dependencies()
+        import mkdocs.commands.build
+        import mkdocs.config
+        self._bytecode_cache = _SharedBytecodeCache()
+        _cache_entry_point_lookups()
+
+
+    def _build(self, docs_path: str, incremental: bool, force: bool, optimize_assets: bool = False) -> dict:
+        from include.mkdocs_build import build_mkdocs_documentation
+
+        docs_path = os.path.abspath(docs_path)
+        fingerprint = f"{get_project_fingerprint(docs_path)}:{optimize_assets}"
+        site_exists = os.path.isdir(os.path.join(docs_path, "site"))
+        if not force and site_exists and self._fingerprints.get(docs_path) == fingerprint:
+            return {"ok": True, "skipped": True}
+
+        # Forgotten first, a build that raises leaves a half written site
+        self._fingerprints.pop(docs_path, None)
+        ok = build_mkdocs_documentation(docs_path, incremental=incremental, config_hook=self._bytecode_cache.install,
+                                        optimize_assets=optimize_assets)
+        if ok:
+            # Files changed during the build are picked up next time
+            self._fingerprints[docs_path] = fingerprint
+        return {"ok": ok, "skipped": False}
+
+
+    def _generate(self, request: dict) -> dict:
+        from include.vmdoc import VmDocsGenerator
+        from include.mkdocs_build import mkdocs_default_project
+
+        docs_dir = os.path.abspath(request["docs_dir"])
+        if not os.path.exists(docs_dir):
+            mkdocs_default_project(docs_dir)
+
+        generator = VmDocsGenerator(docs_dir)
+        if request.get("gitignore_content"):
+            generator.set_pattern(request["gitignore_content"])
+        generator.set_raw_source_options(use_store=request.get("raw_store", False), compress=request.get("raw_compress", False),
+                                         max_size=request.get("raw_max_size"))
+        if request.get("use_git", False):
+            generator.add_files_from_git(request["src_dir"])
+        else:
+            generator.add_files_in_dir(request["src_dir"])
+        generator.generate(jobs=request.get("jobs", 1))
+        return self._build(docs_dir, request.get("incremental", False), False, request.get("optimize_assets", False))
+
+
+    def handle_request(self, request: dict) -> dict:
+        command = request.get("command")
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid()}
+
+        if command == "shutdown":
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+            return {"ok": True}
+
+        if command not in ("build", "generate"):
+            return {"ok": False, "error": f"Unknown command: {command}"}
+
+        with self._build_lock:
+            log = io.StringIO()
+            start = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(log):
+                    if command == "build":
+                        response = self._build(request["docs_path"], request.get("incremental", False), request.get("force", False),
+                                               request.get("optimize_assets", False))
+                    else:
+                        response = self._generate(request)
+            except (Exception, SystemExit) as e:
+                # Plugins call sys.exit on invalid configs, which must not stop the daemon
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            response["duration_ms"] = (time.perf_counter() - start) * 1000
+            response["log"] = log.getvalue()
+            return response
+
+
+    def serve_forever(self):
+        import socketserver
+
+        if is_daemon_running(self.socket_path):
+            print(f"A build daemon is already listening on {self.socket_path}")
+            return
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path) # Left by a daemon that did not shut down cleanly
+
+        self._warm_up()
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        response = daemon.handle_request(json.loads(line))
+                    except ValueError as e:
+                        response = {"ok": False, "error": f"Invalid request: {e}"}
+                    self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        # Only the current user may connect, every request runs a build as this user
+        old_umask = os.umask(0o177)
+        try:
+            self._server = Server(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+
+        print(f"Build daemon listening on {self.socket_path}")
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nBuild daemon stopped.")
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def send_request(request: dict, socket_path: str = None, timeout: Optional[float] = None) -> Optional[dict]:
+    """Send one request to the daemon, returns None if no daemon is listening"""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path or get_default_socket_path())
+            client.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            with client.makefile('rb') as f:
+                line = f.readline()
+    except OSError:
+        return None
+
+    return json.loads(line) if line else None
+
+
+def is_daemon_running(socket_path: str = None) -> bool:
+    response = send_request({"command": "ping"}, socket_path, timeout=2.0)
+    return response is not None and response.get("ok", False)
+
+
+def start_build_daemon(socket_path: str = None, wait: float = 30.0) -> bool:
+    """
+    Start the daemon in a background process, unless one is already listening.
+    Returns True once the daemon answers
+    """
+    socket_path = socket_path or get_default_socket_path()
+    if is_daemon_running(socket_path):
+        return True
+
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), "--socket", socket_path],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if is_daemon_running(socket_path):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def _print_response(response: dict):
+    if response.get("log"):
+        print(response["log"], end="")
+    if "error" in response:
+        print(f"Build daemon error: {response['error']}")
+    elif response.get("skipped"):
+        print(f"Unchanged, build skipped by the daemon ({response['duration_ms']:.0f}ms)")
+
+
+def daemon_build(docs_path: str, incremental: bool = False, socket_path: str = None, optimize_assets: bool = False) -> Optional[bool]:
+    """
+    Build through the daemon. Returns None if no daemon is running, so the caller can build locally
+    """
+    response = send_request({"command": "build", "docs_path": os.path.abspath(docs_path), "incremental": incremental,
+                             "optimize_assets": optimize_assets}, socket_path)
+    if response is None:
+        return None
+    _print_response(response)
+    return response.get("ok", False)
+
+
+def daemon_generate(docs_dir: str, src_dir: str, gitignore_content: str = None, jobs: int = 1,
+                    incremental: bool = False, socket_path: str = None, use_git: bool = False,
+                    optimize_assets: bool = False, raw_store: bool = False, raw_compress: bool = False,
+                    raw_max_size: int = None) -> Optional[bool]:
+    """
+    Generate docs/vmdoc and build through the daemon. Returns None if no daemon is running
+    """
+    response = send_request({
+        "command": "generate",
+        "docs_dir": os.path.abspath(docs_dir),
+        "src_dir": os.path.abspath(src_dir),
+        "gitignore_content": gitignore_content,
+        "jobs": jobs,
+        "incremental": incremental,
+        "use_git": use_git,
+        "optimize_assets": optimize_assets,
+        "raw_store": raw_store,
+        "raw_compress": raw_compress,
+        "raw_max_size": raw_max_size,
+    }, socket_path)
+    if response is None:
+        return None
+    _print_response(response)
+    return response.get("ok", False)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Build server that keeps mkdocs loaded between builds")
+    parser.add_argument("--socket", default=get_default_socket_path(), help="Path of the Unix socket")
+    args = parser.parse_args()
+    BuildDaemon(args.socket).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+[vmdoc:description]
+rsync-like directory sync that only copies changed files, using reflinks or hardlinks when possible
+[vmdoc:enddescription]
+"""
+
+import os
+import errno
+import shutil
+import hashlib
+from typing import Optional
+
+from include.vmdoc_walk import CompiledPatternMatcher, walk_matching_files
+
+
+# ioctl request number of FICLONE, makes dst share the data blocks of src (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+# (method, src device, dst device) combinations that are not supported, not tried again
+_unsupported_methods = set()
+
+# Errors that mean a method is not supported between two filesystems, any other error is not remembered.
+# ENOTTY is what the FICLONE ioctl returns on filesystems that do not know it
+_UNSUPPORTED_ERRNOS = set(code for code in (errno.EOPNOTSUPP, getattr(errno, "ENOTSUP", None), errno.EXDEV, errno.EINVAL,
+                                            errno.ENOSYS, errno.ENOTTY)
+                          if code is not None)
+
+
+class SyncStats:
+    """Counters reported by sync_directory"""
+    __slots__ = ("files_copied", "files_linked", "files_skipped", "files_deleted", "bytes_copied", "bytes_skipped")
+
+    def __init__(self):
+        self.files_copied = 0
+        self.files_linked = 0
+        self.files_skipped = 0
+        self.files_deleted = 0
+        self.bytes_copied = 0
+        self.bytes_skipped = 0
+
+
+    def __str__(self):
+        return (f"{self.bytes_copied} bytes copied ({self.files_copied} files copied, {self.files_linked} linked), "
+                f"{self.bytes_skipped} bytes skipped ({self.files_skipped} files), {self.files_deleted} files deleted")
+
+
+def _hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _reflink(src_path: str, dst_path: str):
+    import fcntl
+    with open(src_path, 'rb') as src_file, open(dst_path, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+
+
+def _copy_file_range(src_path: str, dst_path: str):
+    """
+    Copy the data inside the kernel, without passing it through user space.
+    Depending on the filesystem this also shares blocks or copies server-side (NFS 4.2)
+    """
+    with open(src_path, 'rb') as src_file, open(dst_path, 'wb') as dst_file:
+        remaining = os.fstat(src_file.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src_file.fileno(), dst_file.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def _remove_tmp_file(tmp_path: str):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def clone_file(src_path: str, dst_path: str, link_mode: str = "auto") -> str:
+    """
+    Make dst_path a copy of src_path, replacing dst_path atomically.
+
+    Args:
+        link_mode:
+            "auto" tries a reflink, then a hardlink, then a copy,
+            "reflink" never hardlinks (dst can be modified without touching src),
+            "copy" always copies the data
+    Copies use copy_file_range, or shutil.copyfile (sendfile on Linux) where it is not supported.
+    Returns the method used, "reflink", "hardlink" or "copy"
+    """
+    dst_dir = os.path.dirname(dst_path)
+    os.makedirs(dst_dir, exist_ok=True)
+
+    devices = (os.stat(src_path).st_dev, os.stat(dst_dir).st_dev)
+    tmp_path = f"{dst_path}.tmp{os.getpid()}"
+
+    methods = {"auto": ["reflink", "hardlink"], "reflink": ["reflink"], "copy": []}[link_mode] + ["copy_file_range"]
+    try:
+        for method in methods:
+            if (method, devices) in _unsupported_methods:
+                continue
+            if method == "hardlink" and devices[0] != devices[1]:
+                continue
+
+            for attempt in range(2):
+                try:
+                    if method == "reflink":
+                        _reflink(src_path, tmp_path)
+                    elif method == "hardlink":
+                        os.link(src_path, tmp_path)
+                    else:
+                        _copy_file_range(src_path, tmp_path)
+                    os.replace(tmp_path, dst_path)
+                    return "copy" if method == "copy_file_range" else method
+                except (ImportError, AttributeError):
+                    _unsupported_methods.add((method, devices))
+                    break
+                except OSError as e:
+                    _remove_tmp_file(tmp_path)
+                    if e.errno in _UNSUPPORTED_ERRNOS:
+                        _unsupported_methods.add((method, devices))
+                        break
+                    if e.errno == errno.EEXIST and attempt == 0:
+                        continue # A tmp file left by an interrupted run, removed above
+                    if method == "hardlink" and e.errno in (errno.EMLINK, errno.EPERM):
+                        break # Too many links to src, or links not allowed for it, other files may still be linked
+                    raise # E.g. ENOSPC or EACCES, copying would fail the same way
+
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+        return "copy"
+    finally:
+        _remove_tmp_file(tmp_path)
+
+
+def sync_directory(src_dir: str, dst_dir: str, ignore_pattern: Optional[str] = None,
+                   link_mode: str = "auto", stats: Optional[SyncStats] = None) -> SyncStats:
+    """
+    Make dst_dir mirror src_dir, copying only the files that changed.
+
+    Files are compared by size and mtime, and by content hash if only the mtime differs.
+    Files removed from src_dir are deleted from dst_dir. Paths matched by ignore_pattern
+    (.gitignore-like, e.g. "/site/") are neither copied nor deleted.
+    """
+    if stats is None:
+        stats = SyncStats()
+
+    matcher = CompiledPatternMatcher()
+    if ignore_pattern:
+        matcher.add_pattern_str(ignore_pattern)
+
+    src_relative_paths = set()
+    for src_path in walk_matching_files(src_dir, matcher):
+        if not os.path.isfile(src_path):
+            continue
+
+        relative_path = os.path.relpath(src_path, src_dir)
+        src_relative_paths.add(relative_path)
+        dst_path = os.path.join(dst_dir, relative_path)
+
+        src_stat = os.stat(src_path)
+        try:
+            dst_stat = os.stat(dst_path)
+        except FileNotFoundError:
+            dst_stat = None
+
+        if dst_stat is not None and src_stat.st_size == dst_stat.st_size:
+            same_file = (src_stat.st_ino == dst_stat.st_ino and src_stat.st_dev == dst_stat.st_dev)
+            if same_file or src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+                stats.files_skipped += 1
+                stats.bytes_skipped += src_stat.st_size
+                continue
+
+            if _hash_file(src_path) == _hash_file(dst_path):
+                # Only touched, take over the mtime so the file is skipped by stat next time
+                os.utime(dst_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+                stats.files_skipped += 1
+                stats.bytes_skipped += src_stat.st_size
+                continue
+
+        method = clone_file(src_path, dst_path, link_mode)
+        if method == "copy":
+            stats.files_copied += 1
+            stats.bytes_copied += src_stat.st_size
+        else:
+            stats.files_linked += 1
+
+        if method != "hardlink":
+            os.utime(dst_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+    # Delete files that were removed upstream
+    if os.path.isdir(dst_dir):
+        for dst_path in walk_matching_files(dst_dir, matcher):
+            if os.path.relpath(dst_path, dst_dir) not in src_relative_paths:
+                os.remove(dst_path)
+                stats.files_deleted += 1
+
+        # Remove directories left empty, deepest first
+        dir_paths = list()
+        for dir_path, dir_names, _ in os.walk(dst_dir):
+            relative_path = os.path.relpath(dir_path, dst_dir).replace(os.sep, "/")
+            prefix = "" if relative_path == "." else relative_path + "/"
+            dir_names[:] = [name for name in dir_names if not matcher.is_pruned_dir(prefix + name)]
+            if dir_path != dst_dir:
+                dir_paths.append(dir_path)
+
+        for dir_path in reversed(dir_paths):
+            if len(os.listdir(dir_path)) == 0:
+                os.rmdir(dir_path)
+
+    return stats
@@ -0,0 +1,24 @@
+"""
+[vmdoc:description]
+Makes vizpip_env importable without pushing every parent directory onto sys.path
+[vmdoc:enddescription]
+"""
+
+import sys
+import importlib.util
+from pathlib import Path
+
+
+def add_vizpip_env_path():
+    """
+    Add the directory that contains vizpip_env to sys.path, unless vizpip_env can already be imported.
+    Only that one directory is added, and only once
+    """
+    if "vizpip_env" in sys.modules or importlib.util.find_spec("vizpip_env") is not None:
+        return
+
+    for parent in Path(__file__).resolve().parents:
+        if (parent / "vizpip_env").is_dir():
+            if str(parent) not in sys.path:
+                sys.path.append(str(parent))
+            return
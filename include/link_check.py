@@ -0,0 +1,293 @@
+"""
+[vmdoc:description]
+Fast check of the internal links and anchors of a built site, e.g. between vmdoc pages, vmdocs.md and projects/<name>
+[vmdoc:enddescription]
+
+Every HTML page of site/ is read in a process pool for its ids and its href/src links, which are resolved
+to paths in the site right away. mkdocs writes well-formed HTML, so tags and attributes are read with
+regular expressions, many times faster than html.parser. The result of every page is cached by size and mtime
+in .vmdoc_cache/link_check.json, so only the pages a build wrote again are read. Checking the links against
+the index of files and anchors happens once per distinct target, the nav links of every page only cost one lookup.
+
+    python include/link_check.py SITE_DIR [--cache-dir DIR] [--jobs N]
+
+exits with 1 if a link is broken.
+"""
+
+import sys
+from pathlib import Path
+if str(Path(__file__).resolve().parents[1]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import os
+import re
+import json
+import html
+import posixpath
+from urllib.parse import unquote
+from typing import Dict, List, Optional, Set, Tuple
+
+from include import tracing
+
+
+CACHE_DIR_NAME = ".vmdoc_cache"
+CACHE_FILE_NAME = "link_check.json"
+
+# Bump when the cached page results change
+CACHE_VERSION = 1
+
+# Script and style bodies and comments can contain text that looks like tags, the opening tags are kept.
+# "<" is the literal prefix of every branch, so the regex engine only stops at tags
+_SKIPPED_RE = re.compile(rb"<(?:!--.*?-->|(script\b[^>]*>).*?</script\s*>|(style\b[^>]*>).*?</style\s*>)", re.DOTALL | re.IGNORECASE)
+# Only tags with one of the attributes, most tags of a page are spans of highlighted code.
+# Templates and markdown escape ">" in attribute values, so a tag ends at the first ">"
+_TAG_RE = re.compile(rb"<([a-zA-Z][a-zA-Z0-9-]*)((?:\s[^>]*)?\s(?:id|href|src|name)\s*=[^>]*)>", re.IGNORECASE)
+_ATTRIBUTE_RE = re.compile(rb"(?<![^\s])(id|href|src|name)\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+))", re.IGNORECASE)
+_SCHEME_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+# Fragments every page has, see the HTML spec on scrolling to a fragment
+_IMPLICIT_ANCHORS = ("", "top")
+
+# Served for any missing URL, its relative links only work from the URL it is served at
+_ERROR_PAGE_NAME = "404.html"
+
+
+class BrokenLink:
+    __slots__ = ("page", "target", "reason")
+
+    def __init__(self, page: str, target: str, reason: str):
+        self.page = page # The page with the link, relative to the site directory
+        self.target = target # The resolved link target, relative to the site directory
+        self.reason = reason
+
+
+    def __str__(self) -> str:
+        return f"{self.page}: {self.target} ({self.reason})"
+
+
+def resolve_link(page: str, href: str) -> Optional[str]:
+    """
+    Resolve a link of a page to "<path relative to the site>[#fragment]", or None if it is not internal.
+    Paths leaving the site start with "../"
+
+    Args:
+        page: Path of the page relative to the site directory, e.g. "vmdoc/overview/src/index.html"
+    """
+    href = href.strip()
+    if href == "" or href == "#" or href.startswith("//") or _SCHEME_RE.match(href):
+        return None
+
+    path, _, fragment = href.partition("#")
+    path = path.partition("?")[0]
+    fragment = "#" + unquote(fragment) if fragment else ""
+    if path == "":
+        return page + fragment
+
+    path = unquote(path)
+    if path.startswith("/"):
+        path = posixpath.normpath(path.lstrip("/") or ".")
+    else:
+        path = posixpath.normpath(posixpath.join(posixpath.dirname(page), path))
+    if path == ".":
+        path = "index.html"
+    return path + fragment
+
+
+def _keep_opening_tag(match) -> bytes:
+    opening_tag = match.group(1) or match.group(2)
+    return b"<" + opening_tag if opening_tag else b""
+
+
+def _read_page(file_path: str, page: str) -> Tuple[List[str], List[str]]:
+    """The ids of a page and its resolved internal links"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    data = _SKIPPED_RE.sub(_keep_opening_tag, data)
+
+    anchors = set()
+    targets = set()
+    for tag_match in _TAG_RE.finditer(data):
+        tag_name = tag_match.group(1).lower()
+        for attribute_match in _ATTRIBUTE_RE.finditer(tag_match.group(2)):
+            name = attribute_match.group(1).lower()
+            raw_value = attribute_match.group(2) or attribute_match.group(3) or attribute_match.group(4) or b""
+            value = html.unescape(raw_value.decode('utf-8', errors='replace'))
+            if name == b"id" or (name == b"name" and tag_name == b"a"):
+                anchors.add(value)
+            elif name != b"name":
+                target = resolve_link(page, value)
+                if target is not None:
+                    targets.add(target)
+    return sorted(anchors), sorted(targets)
+
+
+def _read_pages(tasks: List[Tuple[str, str]]) -> list:
+    return [_read_page(file_path, page) for file_path, page in tasks]
+
+
+def _load_cache(cache_path: str, site_dir: str) -> dict:
+    """The cached pages as {page: [size, mtime_ns, anchors, targets]}"""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CACHE_VERSION or cache.get("site_dir") != site_dir:
+        return {}
+
+    # Targets are stored once, most pages link to the same nav pages
+    all_targets = cache["targets"]
+    return {page: [size, mtime_ns, anchors, [all_targets[index] for index in target_indexes]]
+            for page, (size, mtime_ns, anchors, target_indexes) in cache["pages"].items()}
+
+
+def _save_cache(cache_path: str, site_dir: str, pages: dict):
+    target_indexes: Dict[str, int] = dict()
+    stored_pages = dict()
+    for page, (size, mtime_ns, anchors, targets) in pages.items():
+        stored_pages[page] = [size, mtime_ns, anchors, [target_indexes.setdefault(target, len(target_indexes)) for target in targets]]
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": CACHE_VERSION, "site_dir": site_dir, "targets": list(target_indexes), "pages": stored_pages},
+                  f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+
+def relocate_cache(cache_dir: str, site_dir: str):
+    """
+    Take over a page cache restored together with its site from another host, e.g. from a build cache archive.
+    Like site_assets.relocate_cache, pages get the restored mtime of their file
+    """
+    cache_path = os.path.join(cache_dir, CACHE_FILE_NAME)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return
+    if cache.get("version") != CACHE_VERSION:
+        return
+
+    site_dir = os.path.abspath(site_dir)
+    for page, entry in cache["pages"].items():
+        try:
+            stat = os.stat(os.path.join(site_dir, page))
+        except OSError:
+            continue
+        if entry[0] == stat.st_size and abs(entry[1] - stat.st_mtime_ns) < 1000:
+            entry[1] = stat.st_mtime_ns
+    cache["site_dir"] = site_dir
+
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+
+def check_site_links(site_dir: str, cache_dir: str = None, jobs: int = 0, max_reported: int = 50) -> List[BrokenLink]:
+    """
+    Check every internal link and anchor of a built site, prints and returns the broken links.
+    Links to other hosts are not checked
+
+    Args:
+        site_dir: The built site, e.g. docs_path/site
+        cache_dir: Directory of the page cache, e.g. docs_path/.vmdoc_cache, None reads every page
+        jobs: Number of worker processes, 0 uses all cores
+        max_reported: How many broken links are printed, all of them are returned
+    """
+    site_dir = os.path.abspath(site_dir)
+    cache_path = os.path.join(cache_dir, CACHE_FILE_NAME) if cache_dir else None
+    cache = _load_cache(cache_path, site_dir) if cache_path else {}
+
+    files: Set[str] = set()
+    pages = dict()
+    tasks = list()
+    with tracing.span("link_check_index"):
+        for dir_path, dir_names, file_names in os.walk(site_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                file_path = os.path.join(dir_path, file_name)
+                page = os.path.relpath(file_path, site_dir).replace(os.sep, "/")
+                files.add(page)
+                if not file_name.endswith(".html"):
+                    continue
+
+                stat = os.stat(file_path)
+                entry = cache.get(page)
+                if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                    pages[page] = entry
+                else:
+                    pages[page] = [stat.st_size, stat.st_mtime_ns, None, None]
+                    tasks.append((file_path, page))
+
+    with tracing.span("link_check_read", pages=len(tasks)):
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        if jobs == 1 or len(tasks) <= 1:
+            results = _read_pages(tasks)
+        else:
+            import concurrent.futures
+            chunk_size = max(1, min(64, len(tasks) // (jobs * 4)))
+            chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = [result for chunk_results in executor.map(_read_pages, chunks) for result in chunk_results]
+        for (_, page), (anchors, targets) in zip(tasks, results):
+            pages[page][2] = anchors
+            pages[page][3] = targets
+    tracing.count("link_check_pages_read", len(tasks))
+
+    anchor_sets: Dict[str, Set[str]] = dict()
+    reasons: Dict[str, Optional[str]] = dict()
+
+    def get_reason(target: str) -> Optional[str]:
+        path, _, fragment = target.partition("#")
+        if path == ".." or path.startswith("../"):
+            return "outside the site"
+        if path not in files:
+            if path + "/index.html" not in files:
+                return "missing file"
+            path = path + "/index.html"
+        if fragment in _IMPLICIT_ANCHORS or path not in pages:
+            return None
+        if path not in anchor_sets:
+            anchor_sets[path] = set(pages[path][2])
+        return None if fragment in anchor_sets[path] else "missing anchor"
+
+    broken_links = list()
+    with tracing.span("link_check_resolve"):
+        for page, (_, _, _, targets) in sorted(pages.items()):
+            if posixpath.basename(page) == _ERROR_PAGE_NAME:
+                continue
+            for target in targets:
+                if target not in reasons:
+                    reasons[target] = get_reason(target)
+                if reasons[target] is not None:
+                    broken_links.append(BrokenLink(page, target, reasons[target]))
+    tracing.count("link_check_broken", len(broken_links))
+
+    if cache_path:
+        _save_cache(cache_path, site_dir, pages)
+
+    print(f"Link check: {len(pages)} pages, {len(tasks)} read, {len(reasons)} distinct targets, {len(broken_links)} broken links")
+    for broken_link in broken_links[:max_reported]:
+        print(f"  {broken_link}")
+    if len(broken_links) > max_reported:
+        print(f"  ... and {len(broken_links) - max_reported} more")
+    return broken_links
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Check the internal links and anchors of a built site")
+    parser.add_argument("site_dir")
+    parser.add_argument("--cache-dir", help="Directory of the page cache, e.g. DOCS_DIR/.vmdoc_cache")
+    parser.add_argument("--jobs", type=int, default=0)
+    args = parser.parse_args()
+
+    if check_site_links(args.site_dir, args.cache_dir, args.jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
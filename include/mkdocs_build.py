@@ -1,19 +1,53 @@
 import sys
 from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parents[0]))
-sys.path.append(str(Path(__file__).resolve().parents[1]))
-sys.path.append(str(Path(__file__).resolve().parents[2]))
-sys.path.append(str(Path(__file__).resolve().parents[3]))
-sys.path.append(str(Path(__file__).resolve().parents[4]))
-sys.path.append(str(Path(__file__).resolve().parents[5]))
+if str(Path(__file__).resolve().parents[1]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from include.import_paths import add_vizpip_env_path
+add_vizpip_env_path()
 
 from vizpip_env.lib.pyUtil import *
+import json
+import hashlib
+from typing import List
+from include import tracing
+from include.output_writer import write_file_if_changed
+
+_pip_packages = ["mkdocs", "mkdocs-material", "pymdown-extensions", "PyYAML"]
 
 pip_manager = PipManager()
 pip_manager.venv_path = get_directory_path(__file__) + "/venv"
-pip_manager.add_pip_package("mkdocs")
-pip_manager.add_pip_package("mkdocs-material")
-pip_manager.add_pip_package("pymdown-extensions")
+for _package in _pip_packages:
+    pip_manager.add_pip_package(_package)
+
+# Requirement sets already checked by this process
+_checked_requirements = set()
+
+
+def ensure_dependencies(extra_pip_packages: List[str] = []):
+    """
+    Install missing pip packages, checked only once per venv.
+    The result is remembered in a stamp file in the venv keyed by the requirements,
+    delete the stamp file to force a new check
+    """
+    for package in extra_pip_packages:
+        if package not in _pip_packages:
+            _pip_packages.append(package)
+            pip_manager.add_pip_package(package)
+
+    requirements = "\n".join(sorted(_pip_packages) + [sys.version, str(pip_manager.venv_path)])
+    requirements_hash = hashlib.sha256(requirements.encode('utf-8')).hexdigest()[:16]
+    if requirements_hash in _checked_requirements:
+        return
+
+    stamp_path = f"{pip_manager.venv_path}/.pymkdocs_dependencies_{requirements_hash}"
+    if not os.path.exists(stamp_path):
+        pip_manager.install_missing_modules()
+        os.makedirs(pip_manager.venv_path, exist_ok=True)
+        with open(stamp_path, 'w') as f:
+            f.write(requirements)
+
+    _checked_requirements.add(requirements_hash)
 
 
 def is_mkdocs_project(path):
@@ -33,8 +67,32 @@ def list_mkdocs_projects(dir_path: str):
     return mkdocs_projects
 
 
+def load_mkdocs_yml(mkdocs_yml_path: str) -> dict:
+    """
+    Read mkdocs.yml as plain data. Tags like !include, !ENV or !!python/name are kept
+    as their raw values instead of failing like yaml.safe_load does
+    """
+    import yaml
+
+    class _RawTagLoader(yaml.SafeLoader):
+        pass
+
+    def construct_raw(loader, tag_suffix, node):
+        if isinstance(node, yaml.ScalarNode):
+            return loader.construct_scalar(node)
+        if isinstance(node, yaml.SequenceNode):
+            return loader.construct_sequence(node)
+        return loader.construct_mapping(node)
+
+    _RawTagLoader.add_multi_constructor("!", construct_raw)
+    _RawTagLoader.add_multi_constructor("tag:yaml.org,2002:python/", construct_raw)
+
+    with open(mkdocs_yml_path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=_RawTagLoader) or {}
+
+
 def mkdocs_default_project(docs_path: str, site_name: str = "My Docs " + generate_random_numbers(6)):
-    pip_manager.install_missing_modules()
+    ensure_dependencies()
 
     import mkdocs
     import mkdocs.utils
@@ -88,8 +146,7 @@ markdown_extensions:
 
 # Combine multiple mkdocs projects into one
 def mkdocs_monorepo_project(docs_path: str):
-    pip_manager.add_pip_package("mkdocs-monorepo-plugin")
-    pip_manager.install_missing_modules()
+    ensure_dependencies(["mkdocs-monorepo-plugin"])
 
     import mkdocs
     import mkdocs.utils
@@ -159,29 +216,112 @@ nav:
     print(f"New MkDocs project created in: {docs_path}")
 
 
-def serve_mkdocs_project(docs_path, host="127.0.0.1", port=8000):
+def serve_mkdocs_project(docs_path, host="127.0.0.1", port=8000, open_in_browser: bool = False):
     """
-    Serve an MkDocs project locally.
+    Serve an MkDocs project locally. The mkdocs dev server builds the whole site into a temp directory first,
+    to serve an already built site use serve_built_site
 
     Args:
         config_file (str): Path to the mkdocs.yml configuration file.
         host (str): Host address to bind the server (default: 127.0.0.1).
         port (int): Port number to serve the site (default: 8000).
+        open_in_browser (bool): Open the site in a browser once the server is listening.
     """
-    pip_manager.install_missing_modules()
+    ensure_dependencies()
     config_file = docs_path + "/mkdocs.yml"
     import mkdocs
     import mkdocs.commands.serve
     try:
         # Start the MkDocs development server directly with the configuration file
         print(f"Serving MkDocs at http://{host}:{port}")
-        mkdocs.commands.serve.serve(config_file, host=host, port=port, livereload=True, watch_theme=True)
+        mkdocs.commands.serve.serve(config_file, host=host, port=port, livereload=True, watch_theme=True, open_in_browser=open_in_browser)
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+
+
+def open_webbrowser_when_listening(url: str, host: str, port: int, timeout: float = 60.0):
+    """Open url in a browser from a background thread, as soon as a server accepts connections on host:port"""
+    import socket
+    import threading
+    import time
+
+    def wait_and_open():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection((host, port), timeout=0.5):
+                    break
+            except OSError:
+                time.sleep(0.05)
+        else:
+            print(f"Nothing listening on {host}:{port} after {timeout} seconds, not opening {url}")
+            return
+        open_webbrowser(url)
+
+    threading.Thread(target=wait_and_open, daemon=True).start()
+
+
+def serve_built_site(docs_path: str, host="127.0.0.1", port=8000, open_in_browser: bool = False, build: bool = False):
+    """
+    Serve the already built docs_path/site with live reload. When the docs, mkdocs.yml or the theme change,
+    the site is rebuilt incrementally, so only the changed pages are rendered again before the browser reloads.
+    Unlike serve_mkdocs_project nothing is built before serving, unless build is set or there is no site yet
+
+    Args:
+        open_in_browser: Open the site in a browser once the server is listening
+        build: Bring the site up to date with an incremental build before serving, e.g. after the docs changed
+    """
+    ensure_dependencies()
+    from urllib.parse import urlsplit
+    from mkdocs.config import load_config
+    from mkdocs.livereload import LiveReloadServer
+
+    config_file = docs_path + "/mkdocs.yml"
+    site_dir = os.path.abspath(docs_path + "/site")
+    if build or not os.path.isdir(site_dir):
+        build_mkdocs_documentation(docs_path, incremental=True)
+
+    # Only used for the paths to watch, every rebuild loads the config again
+    config = load_config(config_file, site_dir=site_dir)
+    config.plugins.on_startup(command="serve", dirty=True)
+
+    def builder(config=None):
+        build_mkdocs_documentation(docs_path, incremental=True)
+
+    server = LiveReloadServer(builder=builder, host=host, port=port, root=site_dir,
+                              mount_path=urlsplit(config.site_url or "/").path)
+
+    def error_handler(code):
+        error_page = os.path.join(site_dir, f"{code}.html")
+        if code in (404, 500) and os.path.isfile(error_page):
+            with open(error_page, 'rb') as f:
+                return f.read()
+        return None
+
+    server.error_handler = error_handler
+
+    for path in [config.docs_dir, config_file] + list(config.theme.dirs):
+        if os.path.exists(path):
+            server.watch(path)
+    server = config.plugins.on_serve(server, config=config, builder=builder)
+    for path in config.watch:
+        server.watch(path)
+
+    if open_in_browser:
+        open_webbrowser_when_listening(server.url, host, port)
+    try:
+        print(f"Serving {site_dir} at {server.url}")
+        server.serve()
     except KeyboardInterrupt:
         print("\nServer stopped.")
+    finally:
+        server.shutdown()
+        config.plugins.on_shutdown()
 
 
-def build_mkdocs_documentation(docs_path):
-    pip_manager.install_missing_modules()
+def build_mkdocs_documentation(docs_path, site_dir: str = None, config_overrides: dict = None, incremental: bool = False, config_hook=None,
+                               optimize_assets: bool = False, check_links: bool = False) -> bool:
+    ensure_dependencies()
     import mkdocs
     from mkdocs.config import load_config
     from mkdocs.commands.build import build
@@ -189,31 +329,161 @@ def build_mkdocs_documentation(docs_path):
     Build MkDocs documentation into a static site.
 
     Args:
-        config_file (str): Path to the mkdocs.yml configuration file.
-        output_dir (str): Optional. Path to the output directory for the built site.
+        docs_path (str): Path to the mkdocs project, containing mkdocs.yml
+        site_dir (str): Optional. Path to the output directory, defaults to docs_path/site
+        config_overrides (dict): Optional. mkdocs.yml settings to override, e.g. {"theme": {...}}
+        incremental (bool): Optional. Only render the pages whose markdown changed since the previous
+                            incremental build, see include/mkdocs_incremental.py
+        config_hook (callable): Optional. Called with the loaded config before building
+        optimize_assets (bool): Optional. Minify the built site and write precompressed files next to it,
+                                see include/site_assets.py
+        check_links (bool): Optional. Check the internal links and anchors of the built site and print the
+                            broken ones, see include/link_check.py
+    Returns True if the build succeeded
     """
     config_file = docs_path + "/mkdocs.yml"
-    output_dir = docs_path + "/site"
+    output_dir = site_dir or docs_path + "/site"
     # Load the MkDocs configuration
-    config = load_config(config_file)
+    with tracing.span("mkdocs_load_config"):
+        config = load_config(config_file, **(config_overrides or {}))
     
     # Set a custom output directory if provided
     if output_dir:
         config['site_dir'] = os.path.abspath(output_dir)
+
+    if config_hook is not None:
+        config_hook(config)
     
     try:
         print(f"Building documentation using config: {config_file}")
-        build(config)
+        with tracing.span("mkdocs_build", config=config_file, incremental=incremental):
+            if incremental:
+                from include.mkdocs_incremental import incremental_build
+                incremental_build(config, docs_path, config_file, config_overrides)
+            else:
+                build(config)
         print(f"Documentation successfully built in: {config['site_dir']}")
+
+        if optimize_assets:
+            from include.site_assets import optimize_site_assets, CACHE_DIR_NAME
+            with tracing.span("optimize_site_assets"):
+                optimize_site_assets(config['site_dir'], os.path.join(docs_path, CACHE_DIR_NAME))
+
+        if check_links:
+            check_built_site_links(docs_path, config['site_dir'])
+        return True
     except Exception as e:
         print(f"Error while building documentation: {e}")
+        return False
+
 
+def check_built_site_links(docs_path: str, site_dir: str = None) -> list:
+    """Check the links of a built site with the page cache in docs_path/.vmdoc_cache, returns the broken links"""
+    from include.link_check import check_site_links, CACHE_DIR_NAME
+    with tracing.span("check_links"):
+        return check_site_links(site_dir or docs_path + "/site", os.path.join(docs_path, CACHE_DIR_NAME))
 
-def compile_mkdocs(docs_path: str, show_in_browser: bool = True):
-    if not os.path.exists(docs_path):
-        mkdocs_default_project(docs_path)
-    build_mkdocs_documentation(docs_path)
 
+def build_mkdocs_subsite(docs_path: str, theme_config=None, homepage: str = "../../") -> bool:
+    """
+    Build a project that is served below another site, e.g. projects/<name>/ of a monorepo site.
+    The project is built with the theme of the parent site, and the logo links to the parent home page
+    """
+    extra = dict(load_mkdocs_yml(docs_path + "/mkdocs.yml").get("extra") or {})
+    extra["homepage"] = homepage
+
+    config_overrides = {"extra": extra}
+    if theme_config:
+        config_overrides["theme"] = theme_config
+
+    return build_mkdocs_documentation(docs_path, config_overrides=config_overrides)
+
+
+def merge_search_indexes(site_dir: str, project_site_dirs: List[tuple]) -> int:
+    """
+    Add the search entries of separately built sub-sites to site_dir/search/search_index.json,
+    so searching the top-level site also finds the pages of every sub-project.
+    The sub-sites' own search_index.json files are reused, no page is tokenized again.
+
+    Args:
+        project_site_dirs: List of (url prefix, site dir) tuples, e.g. ("projects/name/", ".../site/projects/name")
+    Returns the number of entries added
+    """
+    index_path = os.path.join(site_dir, "search", "search_index.json")
+    if not os.path.exists(index_path):
+        print(f"No search index at {index_path}, not merging")
+        return 0
+
+    with open(index_path, 'r', encoding='utf-8') as f:
+        search_index = json.load(f)
+
+    # Drop entries of an earlier merge, so merging twice does not duplicate them
+    prefixes = tuple(prefix for prefix, _ in project_site_dirs)
+    docs = [entry for entry in search_index.get("docs", []) if not entry.get("location", "").startswith(prefixes)]
+
+    added = 0
+    for prefix, project_site_dir in project_site_dirs:
+        project_index_path = os.path.join(project_site_dir, "search", "search_index.json")
+        if not os.path.exists(project_index_path):
+            continue
+        with open(project_index_path, 'r', encoding='utf-8') as f:
+            project_docs = json.load(f).get("docs", [])
+
+        for entry in project_docs:
+            entry["location"] = prefix + entry.get("location", "")
+        docs.extend(project_docs)
+        added += len(project_docs)
+
+    search_index["docs"] = docs
+    # A prebuilt lunr index only covers the top-level pages, the browser builds the index from docs instead
+    search_index.pop("index", None)
+
+    data = json.dumps(search_index, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    write_file_if_changed(index_path, data)
+    return added
+
+
+def serve_site_directory(site_dir: str, host="127.0.0.1", port=8000, open_in_browser: bool = False):
+    """
+    Serve an already built site as static files, e.g. a site assembled from several mkdocs builds
+    """
+    import functools
+    import http.server
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=site_dir)
+    with http.server.ThreadingHTTPServer((host, port), handler) as server:
+        # The server is listening once created
+        if open_in_browser:
+            open_webbrowser(f"http://{host}:{port}")
+        try:
+            print(f"Serving {site_dir} at http://{host}:{port}")
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+
+
+def compile_mkdocs(docs_path: str, show_in_browser: bool = True, trace: str = None, incremental: bool = False, use_daemon: bool = False,
+                   optimize_assets: bool = False, check_links: bool = False):
+    """
+    Args:
+        trace: Directory to write a timing trace of the build to, see tracing_session
+        incremental: Only render the pages that changed since the previous incremental build
+        use_daemon: Build in the running build daemon (see include/build_daemon.py), builds locally if none is running
+        optimize_assets: Minify the built site and write precompressed .gz files, see include/site_assets.py
+        check_links: Check the internal links and anchors of the built site, see include/link_check.py
+    """
+    with tracing.tracing_session(trace):
+        if not os.path.exists(docs_path):
+            mkdocs_default_project(docs_path)
+        with tracing.span("compile_mkdocs"):
+            built_by_daemon = False
+            if use_daemon:
+                from include.build_daemon import daemon_build
+                built_by_daemon = daemon_build(docs_path, incremental=incremental, optimize_assets=optimize_assets) is not None
+                if built_by_daemon and check_links:
+                    check_built_site_links(docs_path)
+            if not built_by_daemon:
+                build_mkdocs_documentation(docs_path, incremental=incremental, optimize_assets=optimize_assets, check_links=check_links)
+
+    # The site was just built, only pages changed from now on are built again
     if show_in_browser:
-        open_webbrowser("http://127.0.0.1:8000")
-        serve_mkdocs_project(docs_path)
\ No newline at end of file
+        serve_built_site(docs_path, open_in_browser=True)
\ No newline at end of file
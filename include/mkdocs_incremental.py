@@ -0,0 +1,269 @@
+"""
+[vmdoc:description]
+Incremental mkdocs build, only pages whose markdown changed are rendered again
+[vmdoc:enddescription]
+"""
+
+import os
+import re
+import json
+import logging
+import hashlib
+from typing import Dict, Optional
+
+import mkdocs
+import mkdocs.utils
+from mkdocs.plugins import BasePlugin, event_priority
+from mkdocs.commands.build import build
+
+
+CACHE_DIR_NAME = ".vmdoc_cache"
+CACHE_FILE_NAME = "incremental_build.json"
+
+# Bump when the cache format changes
+CACHE_VERSION = 1
+
+_FRONT_MATTER_TITLE_RE = re.compile(rb"\A---\r?\n(?:.*?\r?\n)??title:[ \t]*(.*?)[ \t]*\r?\n(?:.*?\r?\n)??---\r?\n", re.DOTALL)
+_HEADING_TITLE_RE = re.compile(rb"^#[ \t]+(.+?)[ \t#]*\r?$", re.MULTILINE)
+
+
+def get_title_hint(markdown: bytes) -> str:
+    """
+    The title a page will most likely get, from the front matter or the first heading.
+    Only used to notice title changes, the rendered title is taken from mkdocs
+    """
+    match = _FRONT_MATTER_TITLE_RE.match(markdown) or _HEADING_TITLE_RE.search(markdown)
+    return match.group(1).decode('utf-8', errors='replace') if match else ""
+
+
+def _get_theme_version(theme_name: Optional[str]) -> str:
+    if not theme_name:
+        return ""
+    from importlib.metadata import entry_points
+    for entry_point in entry_points(group="mkdocs.themes"):
+        if entry_point.name == theme_name and entry_point.dist is not None:
+            return f"{entry_point.dist.name}=={entry_point.dist.version}"
+    return theme_name
+
+
+def _hash_directory_files(dir_path: Optional[str]) -> str:
+    """
+    Hash of the relative paths and content of every file in dir_path, e.g. theme overrides.
+    Not of their mtimes, so a fresh checkout with a restored build cache does not rebuild everything
+    """
+    sha = hashlib.sha256()
+    if dir_path and os.path.isdir(dir_path):
+        for current_path, dir_names, file_names in os.walk(dir_path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                file_path = os.path.join(current_path, file_name)
+                with open(file_path, 'rb') as f:
+                    content_hash = hashlib.sha256(f.read()).hexdigest()
+                sha.update(f"{os.path.relpath(file_path, dir_path).replace(os.sep, '/')}:{content_hash}\n".encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_config_hash(config_file: str, config_overrides: Optional[dict]) -> str:
+    """Hash of everything outside docs_dir that changes every page: the config, mkdocs and theme version"""
+    sha = hashlib.sha256()
+    with open(config_file, 'rb') as f:
+        sha.update(f.read())
+    sha.update(json.dumps(config_overrides or {}, sort_keys=True, default=str).encode('utf-8'))
+    sha.update(mkdocs.__version__.encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _get_search_entries(search_plugin) -> Optional[list]:
+    """The list of search entries, of the built-in search plugin or of material/search"""
+    search_index = getattr(search_plugin, "search_index", None)
+    if search_index is None:
+        return None
+    if isinstance(getattr(search_index, "entries", None), list):
+        return search_index.entries
+    return getattr(search_index, "_entries", None)
+
+
+class IncrementalBuildPlugin(BasePlugin):
+    """
+    Added to the config by incremental_build, never listed in mkdocs.yml.
+
+    Before any page is read (on_files) every documentation page is hashed, and a nav signature is
+    computed from the config hash, the theme version, the list of files and the title of every page.
+    Every page lists the whole nav and its neighbours, so if the signature changed the site directory is
+    cleaned and everything is built. Otherwise File.is_modified is replaced, so only pages whose markdown
+    changed are read and rendered. Unchanged pages get their cached title for the nav, and their cached
+    search entries are merged into the search index.
+    """
+    def __init__(self, config_hash: str, cache: Optional[dict]):
+        super().__init__()
+        self.config_hash = config_hash
+        self.cache = cache # The cache of the previous build, None for a full build
+        self.pages: Dict[str, dict] = dict() # The cache entries of this build, by src_uri
+        self.full_build = cache is None
+        self.rendered_pages = 0
+        self._files = None
+        self._search_entries = None
+        self._search_length = 0
+        self._rendered_search: Dict[str, list] = dict() # Search entries of the rendered pages, by src_uri
+
+
+    def _get_signature(self, files, config) -> str:
+        sha = hashlib.sha256()
+        sha.update(f"{CACHE_VERSION}\n{self.config_hash}\n".encode('utf-8'))
+        sha.update(_get_theme_version(config.theme.name).encode('utf-8'))
+        sha.update(_hash_directory_files(getattr(config.theme, "_custom_dir", None)).encode('utf-8'))
+        for file in sorted(files, key=lambda file: file.src_uri):
+            title_hint = self.pages[file.src_uri]["title_hint"] if file.src_uri in self.pages else ""
+            sha.update(f"\n{file.src_uri}\t{title_hint}".encode('utf-8'))
+        return sha.hexdigest()
+
+
+    @event_priority(-100)
+    def on_files(self, files, config, **kwargs):
+        self._files = files
+        for file in files.documentation_pages():
+            if file.abs_src_path is None or not os.path.isfile(file.abs_src_path):
+                continue # Generated by a plugin, always rendered
+            with open(file.abs_src_path, 'rb') as f:
+                markdown = f.read()
+            self.pages[file.src_uri] = {"sha256": hashlib.sha256(markdown).hexdigest(), "title_hint": get_title_hint(markdown)}
+
+        self.signature = self._get_signature(files, config)
+        if self.full_build:
+            return files
+
+        if self.cache.get("signature") != self.signature:
+            print("Nav signature changed, building all pages")
+            mkdocs.utils.clean_directory(config.site_dir)
+            self.full_build = True
+            return files
+
+        cached_pages = self.cache.get("pages", {})
+        for file in files.documentation_pages():
+            cached_page = cached_pages.get(file.src_uri)
+            page = self.pages.get(file.src_uri)
+            modified = (page is None or cached_page is None or cached_page["sha256"] != page["sha256"]
+                        or not os.path.isfile(file.abs_dest_path))
+            if not modified:
+                page.update(title=cached_page["title"], search=cached_page["search"])
+            file.is_modified = (lambda modified: lambda: modified)(modified)
+        return files
+
+
+    @event_priority(-100)
+    def on_nav(self, nav, config, files, **kwargs):
+        if self.full_build:
+            return nav
+
+        # Unchanged pages are never read, give them the title they had for the nav of the rendered pages
+        for file in files.documentation_pages():
+            if file.page is not None and not file.is_modified():
+                file.page.title = self.pages[file.src_uri]["title"]
+        return nav
+
+
+    @event_priority(-100)
+    def on_page_context(self, context, page, config, nav, **kwargs):
+        # Runs after the search plugin added the entries of this page
+        if self._search_entries is None:
+            for plugin in config.plugins.values():
+                self._search_entries = _get_search_entries(plugin)
+                if self._search_entries is not None:
+                    break
+
+        search = list()
+        if self._search_entries is not None:
+            search = self._search_entries[self._search_length:]
+            self._search_length = len(self._search_entries)
+
+        self.rendered_pages += 1
+        self._rendered_search[page.file.src_uri] = search
+        if page.file.src_uri in self.pages:
+            self.pages[page.file.src_uri].update(title=page.title, search=search)
+        return context
+
+
+    @event_priority(100)
+    def on_post_build(self, config, **kwargs):
+        # Runs before the search plugin writes search_index.json, add the entries of the pages not rendered
+        if self.full_build or self._search_entries is None:
+            return
+
+        # Rebuilt in documentation page order, the same order as a full build whichever pages changed
+        self._search_entries.clear()
+        for file in self._files.documentation_pages():
+            page = self.pages.get(file.src_uri)
+            if file.src_uri in self._rendered_search:
+                self._search_entries.extend(self._rendered_search[file.src_uri])
+            elif page is not None and not file.is_modified():
+                self._search_entries.extend(page["search"])
+
+
+class _DirtyBuildWarningFilter(logging.Filter):
+    """Drop the warning mkdocs prints for every dirty build, the nav is kept correct by IncrementalBuildPlugin"""
+    def filter(self, record):
+        return "'dirty' build" not in record.getMessage()
+
+
+def _load_cache(cache_path: str, site_dir: str) -> Optional[dict]:
+    if not os.path.exists(cache_path) or not os.path.isdir(site_dir):
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable build cache {cache_path}: {e}")
+        return None
+
+    if cache.get("version") != CACHE_VERSION or cache.get("site_dir") != site_dir:
+        return None
+    return cache
+
+
+def _save_cache(cache_path: str, cache: dict):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+
+def relocate_cache(docs_path: str, site_dir: str):
+    """Point a page cache restored from another host, e.g. from a build cache archive, at site_dir"""
+    cache_path = os.path.join(docs_path, CACHE_DIR_NAME, CACHE_FILE_NAME)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return
+    if cache.get("version") == CACHE_VERSION and cache.get("site_dir") != os.path.abspath(site_dir):
+        cache["site_dir"] = os.path.abspath(site_dir)
+        _save_cache(cache_path, cache)
+
+
+def incremental_build(config, docs_path: str, config_file: str, config_overrides: Optional[dict] = None):
+    """
+    Build a loaded mkdocs config, rendering only the pages that changed since the previous incremental build.
+    The page cache is kept in <docs_path>/.vmdoc_cache/, delete it to force a full build
+    """
+    cache_path = os.path.join(docs_path, CACHE_DIR_NAME, CACHE_FILE_NAME)
+    site_dir = os.path.abspath(config['site_dir'])
+    cache = _load_cache(cache_path, site_dir)
+
+    plugin = IncrementalBuildPlugin(get_config_hash(config_file, config_overrides), cache)
+    config.plugins["vmdoc/incremental"] = plugin
+
+    # Without a cache there is nothing to reuse, a normal build cleans the site directory
+    build_logger = logging.getLogger("mkdocs.commands.build")
+    warning_filter = _DirtyBuildWarningFilter()
+    build_logger.addFilter(warning_filter)
+    try:
+        build(config, dirty=cache is not None)
+    finally:
+        build_logger.removeFilter(warning_filter)
+
+    pages = {src_uri: page for src_uri, page in plugin.pages.items() if "title" in page}
+    _save_cache(cache_path, {"version": CACHE_VERSION, "signature": plugin.signature, "site_dir": site_dir, "pages": pages})
+
+    total_pages = len(plugin._files.documentation_pages()) if plugin._files is not None else 0
+    print(f"{'Full' if plugin.full_build else 'Incremental'} build: {plugin.rendered_pages} of {total_pages} pages rendered")
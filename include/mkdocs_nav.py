@@ -0,0 +1,179 @@
+"""
+[vmdoc:description]
+Edit the nav section of mkdocs.yml in place, keeping the formatting and comments of the rest of the file
+[vmdoc:enddescription]
+"""
+
+import os
+import re
+from typing import List, Optional, Tuple, Union
+
+from include.output_writer import write_file_if_changed
+
+
+# A nav entry is (title, target), where target is a path/url or a list of nested entries
+NavEntries = List[Tuple[str, Union[str, list]]]
+
+_PLAIN_SCALAR_RE = re.compile(r"[A-Za-z0-9_/.()][A-Za-z0-9_/.() \-]*")
+_RESERVED_SCALARS = {"true", "false", "yes", "no", "on", "off", "null", "~"}
+
+
+def _yaml_scalar(value: str) -> str:
+    """Plain scalar when that is safe, otherwise single quoted (like yaml.dump)"""
+    value = str(value)
+    is_number = re.fullmatch(r"[-+]?[0-9._]+([eE][-+]?[0-9]+)?", value) is not None
+    if (_PLAIN_SCALAR_RE.fullmatch(value) and not value.endswith(" ") and
+            value.lower() not in _RESERVED_SCALARS and not is_number):
+        return value
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _render_entries(entries: NavEntries, indent: int, child_offset: int = 4) -> List[str]:
+    lines = list()
+    for title, target in entries:
+        if isinstance(target, list):
+            if len(target) == 0:
+                lines.append(f"{' ' * indent}- {_yaml_scalar(title)}: []\n")
+            else:
+                lines.append(f"{' ' * indent}- {_yaml_scalar(title)}:\n")
+                lines.extend(_render_entries(target, indent + child_offset, child_offset))
+        else:
+            lines.append(f"{' ' * indent}- {_yaml_scalar(title)}: {_yaml_scalar(target)}\n")
+    return lines
+
+
+def _indent_of(line: str) -> int:
+    return len(line) - len(line.lstrip(" "))
+
+
+def _is_blank_or_comment(line: str) -> bool:
+    stripped = line.strip()
+    return stripped == "" or stripped.startswith("#")
+
+
+def _find_nav_block(lines: List[str]) -> Tuple[int, int]:
+    """
+    Returns (index of the nav: line, index after the last nav item line), or (-1, -1) if there is no nav
+    """
+    nav_index = -1
+    for i, line in enumerate(lines):
+        if re.match(r"nav\s*:\s*(#.*)?$", line.rstrip("\n")):
+            nav_index = i
+            break
+
+    if nav_index == -1:
+        return -1, -1
+
+    end_index = nav_index + 1
+    for i in range(nav_index + 1, len(lines)):
+        line = lines[i]
+        if _is_blank_or_comment(line):
+            continue
+        if _indent_of(line) == 0 and not line.startswith("-"):
+            break
+        end_index = i + 1
+
+    return nav_index, end_index
+
+
+def _find_section(lines: List[str], start: int, end: int, section_name: str) -> Tuple[int, int, int, int]:
+    """
+    Find the `- section_name:` item in lines[start:end].
+    Returns (first line, line after the item, item indent, indent of its children relative to the item),
+    first line is -1 if not found
+    """
+    item_indent = None
+    for i in range(start, end):
+        if not _is_blank_or_comment(lines[i]) and lines[i].lstrip(" ").startswith("-"):
+            item_indent = _indent_of(lines[i])
+            break
+
+    if item_indent is None:
+        return -1, -1, 2, 4
+
+    section_re = re.compile(r"- *(['\"]?)" + re.escape(section_name) + r"\1 *:")
+    for i in range(start, end):
+        line = lines[i]
+        if _indent_of(line) != item_indent or not section_re.match(line.lstrip(" ")):
+            continue
+
+        section_end = i + 1
+        child_offset = 4
+        for j in range(i + 1, end):
+            if _is_blank_or_comment(lines[j]):
+                continue
+            if _indent_of(lines[j]) <= item_indent:
+                break
+            if section_end == i + 1:
+                # Keep the indentation style of the existing section
+                child_offset = _indent_of(lines[j]) - item_indent
+            section_end = j + 1
+        return i, section_end, item_indent, child_offset
+
+    return -1, -1, item_indent, 4
+
+
+def edit_nav_text(text: str, section_name: str, section_entries: Optional[NavEntries]) -> str:
+    """
+    Replace the `section_name` item of nav with section_entries, append it if it is missing,
+    or remove it if section_entries is None. All other lines are kept as they are.
+    """
+    lines = text.splitlines(keepends=True)
+    if len(lines) != 0 and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
+    nav_index, nav_end = _find_nav_block(lines)
+    if nav_index == -1:
+        if section_entries is None:
+            return text
+        lines.append("nav:\n")
+        nav_index, nav_end = len(lines) - 1, len(lines)
+
+    section_start, section_end, item_indent, child_offset = _find_section(lines, nav_index + 1, nav_end, section_name)
+
+    new_lines = list()
+    if section_entries is not None:
+        new_lines = _render_entries([(section_name, section_entries)], item_indent, child_offset)
+
+    if section_start == -1:
+        if section_entries is None:
+            return text
+        lines[nav_end:nav_end] = new_lines
+    else:
+        lines[section_start:section_end] = new_lines
+
+    return "".join(lines)
+
+
+def update_nav_section(mkdocs_yml_path: str, nav_section_name: str, section_entries: Optional[NavEntries]) -> bool:
+    """
+    Updates the mkdocs.yml file by replacing or inserting a section under 'nav'.
+    Formatting and comments are kept, and the file is only written (atomically) if the nav changed,
+    so mkdocs serve does not do a full rebuild for nothing.
+
+    Args:
+        mkdocs_yml_path: Path to the mkdocs.yml file.
+        nav_section_name: The name of the section to update (e.g., 'files').
+        section_entries: List of (title, target) tuples, a target can be a list of nested entries.
+                         Example: [('file1.py', 'vmdoc/file1_hash.txt'), ...]
+                         None removes the section.
+    Returns True if mkdocs.yml was changed
+    """
+    if not os.path.exists(mkdocs_yml_path):
+        print(f"mkdocs.yml not found at: {mkdocs_yml_path}")
+        return False
+
+    with open(mkdocs_yml_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    new_text = edit_nav_text(text, nav_section_name, section_entries)
+    if new_text == text:
+        return False
+
+    write_file_if_changed(mkdocs_yml_path, new_text.encode('utf-8'))
+    print(f"Updated '{nav_section_name}' section in mkdocs.yml.")
+    return True
+
+
+def remove_nav_section(mkdocs_yml_path: str, nav_section_name: str) -> bool:
+    return update_nav_section(mkdocs_yml_path, nav_section_name, None)
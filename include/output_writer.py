@@ -0,0 +1,222 @@
+"""
+[vmdoc:description]
+Atomic file writes that leave files untouched when their content is unchanged
+[vmdoc:enddescription]
+"""
+
+import os
+import filecmp
+
+from include.file_sync import clone_file
+
+
+def write_file_if_changed(file_path: str, data: bytes) -> bool:
+    """
+    Write data to file_path through a temp file and rename, so readers never see a partial file.
+    Nothing is written, and the mtime is kept, if the file already has this content.
+    Returns True if the file was written
+    """
+    try:
+        if os.path.getsize(file_path) == len(data):
+            with open(file_path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+
+    tmp_path = f"{file_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+    return True
+
+
+def copy_file_if_changed(src_path: str, dst_path: str, link_mode: str = "copy") -> bool:
+    """
+    Atomically copy src_path to dst_path, unless dst_path already has the same content.
+    The data is never read into python, see clone_file for link_mode.
+    Returns True if the file was written
+    """
+    try:
+        if os.path.samefile(src_path, dst_path):
+            return False
+        if os.path.getsize(src_path) == os.path.getsize(dst_path) and filecmp.cmp(src_path, dst_path, shallow=False):
+            return False
+    except OSError:
+        pass
+
+    clone_file(src_path, dst_path, link_mode)
+    return True
+
+
+class StreamingFileWriter:
+    """
+    Writes a file in chunks through a temp file, comparing every chunk with the existing file on the way,
+    so large generated files are never held in memory. close() keeps the existing file, and its mtime,
+    if the content is unchanged.
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.written = False
+        self._tmp_path = f"{file_path}.tmp{os.getpid()}"
+        self._tmp_file = open(self._tmp_path, 'wb')
+        try:
+            self._old_file = open(file_path, 'rb')
+        except OSError:
+            self._old_file = None
+        self._changed = self._old_file is None
+
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        self._tmp_file.write(data)
+        if not self._changed and self._old_file.read(len(data)) != data:
+            self._changed = True
+
+
+    def _close_files(self):
+        self._tmp_file.close()
+        if self._old_file is not None:
+            if not self._changed and self._old_file.read(1):
+                self._changed = True # The existing file is longer
+            self._old_file.close()
+
+
+    def close(self) -> bool:
+        """Returns True if the file was written"""
+        self._close_files()
+        if self._changed:
+            os.replace(self._tmp_path, self.file_path)
+        else:
+            os.remove(self._tmp_path)
+        self.written = self._changed
+        return self.written
+
+
+    def abort(self):
+        self._close_files()
+        os.remove(self._tmp_path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class OutputStats:
+    """Per-run counters of an OutputWriter"""
+    __slots__ = ("written", "unchanged", "deleted", "total_bytes", "disk_bytes")
+
+    def __init__(self):
+        self.written = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.total_bytes = 0 # Size of the files kept by prune(), what gets deployed
+        self.disk_bytes = 0 # Allocated size of those files, less where blocks are shared or sparse
+
+
+    def __str__(self):
+        return f"{self.written} files written, {self.unchanged} unchanged, {self.deleted} deleted"
+
+
+class OutputWriter:
+    """
+    Writes the generated files of a directory. Files are compared before writing and replaced
+    atomically, so unchanged files keep their mtime. Every file written, or kept with keep(),
+    counts as produced, prune() deletes everything else in the directory.
+    """
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.stats = OutputStats()
+        self._output_dir_prefix = os.path.join(os.path.abspath(output_dir), "")
+        self._produced = set() # Paths relative to output_dir, or absolute for files outside of it
+
+
+    def _add_produced(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        if file_path.startswith(self._output_dir_prefix):
+            file_path = file_path[len(self._output_dir_prefix):]
+        self._produced.add(file_path)
+
+
+    def write_bytes(self, file_path: str, data: bytes) -> bool:
+        self._add_produced(file_path)
+        written = write_file_if_changed(file_path, data)
+        self.stats.written += written
+        return written
+
+
+    def write_text(self, file_path: str, text: str) -> bool:
+        return self.write_bytes(file_path, text.encode('utf-8'))
+
+
+    def open_stream(self, file_path: str) -> "OutputStreamWriter":
+        """
+        Write a large file in chunks, use as a context manager. The file is replaced when the block
+        ends, if its content changed, and is not replaced at all if the block raises
+        """
+        return OutputStreamWriter(self, file_path)
+
+
+    def copy_file(self, src_path: str, file_path: str, link_mode: str = "copy") -> bool:
+        self._add_produced(file_path)
+        written = copy_file_if_changed(src_path, file_path, link_mode)
+        self.stats.written += written
+        return written
+
+
+    def keep(self, file_path: str, written: bool = False):
+        """Mark a file as produced, e.g. when it was written by a worker process"""
+        self._add_produced(file_path)
+        self.stats.written += written
+
+
+    def remove(self, file_path: str):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            self.stats.deleted += 1
+
+
+    def prune(self):
+        """
+        Delete the files in output_dir that were not produced in this run, and directories left empty.
+        Dot-files (like the manifest) are never deleted. Also sums up the size of the remaining files.
+        """
+        for dir_path, dir_names, file_names in os.walk(self.output_dir, topdown=False):
+            for file_name in file_names:
+                file_path = os.path.abspath(os.path.join(dir_path, file_name))
+                if file_name.startswith("."):
+                    continue
+                if file_path[len(self._output_dir_prefix):] not in self._produced:
+                    os.remove(file_path)
+                    self.stats.deleted += 1
+                    continue
+
+                stat = os.stat(file_path)
+                self.stats.total_bytes += stat.st_size
+                self.stats.disk_bytes += getattr(stat, "st_blocks", 0) * 512 or stat.st_size
+
+            if dir_path != self.output_dir and len(os.listdir(dir_path)) == 0:
+                os.rmdir(dir_path)
+
+        self.stats.unchanged = len(self._produced) - self.stats.written
+
+
+class OutputStreamWriter(StreamingFileWriter):
+    """StreamingFileWriter that counts the file as produced by its OutputWriter"""
+    def __init__(self, output_writer: OutputWriter, file_path: str):
+        super().__init__(file_path)
+        self._output_writer = output_writer
+
+
+    def close(self) -> bool:
+        written = super().close()
+        self._output_writer.keep(self.file_path, written)
+        return written
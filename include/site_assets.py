@@ -0,0 +1,312 @@
+"""
+[vmdoc:description]
+Post-build minification of the built site, with precompressed .gz (and .br/.zst if available) files next to the originals
+[vmdoc:enddescription]
+
+Static servers can send the precompressed files directly, e.g. nginx `gzip_static on;`.
+HTML, CSS and JSON are minified without changing what they mean: whitespace is collapsed and comments
+are removed, <pre>, <textarea>, <script> and <style> are kept as they are, JavaScript is not minified.
+Only the standard library is needed, brotli and zstandard are used if they are installed.
+"""
+
+import os
+import re
+import json
+import gzip
+import hashlib
+
+from include.file_sync import clone_file
+from typing import Dict, List, Optional, Tuple
+
+
+CACHE_DIR_NAME = ".vmdoc_cache"
+CACHE_FILE_NAME = "site_assets.json"
+
+# Directory in the cache directory with the compressed files by content hash, a clean build deletes site/
+# but the compressed files of unchanged content are copied back from here instead of compressed again
+STORE_DIR_NAME = "site_assets"
+
+# Bump when the minified or compressed output changes
+CACHE_VERSION = 1
+
+MINIFIED_EXTENSIONS = {".html", ".css", ".json"}
+COMPRESSED_EXTENSIONS = {".html", ".css", ".js", ".json", ".txt", ".xml", ".svg", ".map"}
+
+# Smaller files gain nothing from compression
+MIN_COMPRESS_SIZE = 256
+
+# Compressed files that are not at least this much smaller than the original are not kept
+MAX_COMPRESS_RATIO = 0.9
+
+_HTML_PRESERVED_RE = re.compile(r"(<(pre|textarea|script|style)\b.*?</\2\s*>)", re.DOTALL | re.IGNORECASE)
+_HTML_COMMENT_RE = re.compile(r"<!--(?!\[if|<!|>).*?-->", re.DOTALL)
+_HTML_NEWLINE_RE = re.compile(r"[ \t\r\f\v]*\n\s*")
+_CSS_TOKEN_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/|\s+""", re.DOTALL)
+_CSS_PUNCTUATION_RE = re.compile(r" ?([{};,]) ?")
+
+
+def minify_html(text: str) -> str:
+    """Remove comments and collapse whitespace containing a newline into a single newline"""
+    parts = _HTML_PRESERVED_RE.split(text)
+    result = list()
+    # split() returns text, preserved element, tag name, text, ...
+    for i in range(0, len(parts), 3):
+        result.append(_HTML_NEWLINE_RE.sub("\n", _HTML_COMMENT_RE.sub("", parts[i])))
+        if i + 1 < len(parts):
+            result.append(parts[i + 1])
+    return "".join(result).strip() + "\n"
+
+
+def minify_css(text: str) -> str:
+    """Remove comments and collapse whitespace, strings are kept as they are"""
+    def replace_token(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        return " " # Comments separate tokens like whitespace does
+
+    tokens = _CSS_TOKEN_RE.sub(replace_token, text)
+    # Spaces around { } ; , never matter outside of strings, and strings were kept
+    minified = list()
+    for i, part in enumerate(re.split(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""", tokens)):
+        if i % 2 == 0:
+            part = _CSS_PUNCTUATION_RE.sub(r"\1", re.sub(" {2,}", " ", part)).replace(";}", "}")
+        minified.append(part)
+    return "".join(minified).strip()
+
+
+def minify_json(text: str) -> str:
+    return json.dumps(json.loads(text), separators=(',', ':'), ensure_ascii=False)
+
+
+_MINIFIERS = {".html": minify_html, ".css": minify_css, ".json": minify_json}
+
+
+def get_compressors() -> Dict[str, object]:
+    """File suffix -> compress(bytes) function, gzip always, brotli and zstandard if they are installed"""
+    compressors = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        compressors[".zst"] = lambda data: zstandard.ZstdCompressor(level=19).compress(data)
+    except ImportError:
+        pass
+    return compressors
+
+
+# Suffixes of every codec that may be used, so precompressed files are never processed themselves
+ALL_COMPRESSED_SUFFIXES = (".gz", ".br", ".zst")
+
+
+def get_store_path(store_dir: str, sha256: str, suffix: str) -> str:
+    return os.path.join(store_dir, sha256[:2], sha256 + suffix)
+
+
+class AssetTask:
+    __slots__ = ("file_path", "relative_path", "entry", "minify", "compress", "store_dir")
+
+    def __init__(self, file_path: str, relative_path: str, entry: Optional[dict], minify: bool, compress: bool, store_dir: str):
+        self.file_path = file_path
+        self.relative_path = relative_path
+        self.entry = entry # The cache entry of the previous run, None if the file is new
+        self.minify = minify
+        self.compress = compress
+        self.store_dir = store_dir
+
+
+def _write_file(file_path: str, data: bytes):
+    tmp_path = f"{file_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def _process_asset(task: AssetTask) -> Tuple[Optional[dict], int, int, int]:
+    """
+    Minify and compress one file.
+    Returns (cache entry, bytes saved by minifying, number of files compressed, 1 if the file was unchanged)
+    """
+    with open(task.file_path, 'rb') as f:
+        data = f.read()
+
+    extension = os.path.splitext(task.file_path)[1].lower()
+    output = data
+    if task.minify and extension in _MINIFIERS:
+        try:
+            output = _MINIFIERS[extension](data.decode('utf-8')).encode('utf-8')
+        except ValueError as e: # Also UnicodeDecodeError and json errors
+            print(f"Not minifying {task.file_path}: {e}")
+
+    if output != data:
+        _write_file(task.file_path, output)
+
+    sha256 = hashlib.sha256(output).hexdigest()
+    entry = task.entry
+    unchanged = (entry is not None and entry["sha256"] == sha256 and
+                 all(os.path.exists(get_store_path(task.store_dir, sha256, suffix)) for suffix in entry["compressed"]))
+    if unchanged:
+        # mkdocs wrote the same content again, reuse the compressed files of the previous run
+        compressed = entry["compressed"]
+        for suffix in compressed:
+            if not os.path.exists(task.file_path + suffix):
+                clone_file(get_store_path(task.store_dir, sha256, suffix), task.file_path + suffix, "reflink")
+    else:
+        compressed = list()
+        if task.compress and len(output) >= MIN_COMPRESS_SIZE:
+            for suffix, compress in get_compressors().items():
+                compressed_data = compress(output)
+                if len(compressed_data) <= len(output) * MAX_COMPRESS_RATIO:
+                    store_path = get_store_path(task.store_dir, sha256, suffix)
+                    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+                    _write_file(store_path, compressed_data)
+                    clone_file(store_path, task.file_path + suffix, "reflink")
+                    compressed.append(suffix)
+
+    # Compressed files of the previous run that are no longer worth it, or of a codec no longer installed.
+    # Others are kept, e.g. mkdocs writes sitemap.xml.gz itself
+    for suffix in (entry["compressed"] if entry is not None else ()):
+        if suffix not in compressed and os.path.exists(task.file_path + suffix):
+            os.remove(task.file_path + suffix)
+
+    stat = os.stat(task.file_path)
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256, "compressed": compressed}
+    return entry, len(data) - len(output), 0 if unchanged else len(compressed), int(unchanged)
+
+
+def _process_assets(tasks: List[AssetTask]) -> list:
+    return [_process_asset(task) for task in tasks]
+
+
+def _load_cache(cache_path: str, site_dir: str) -> dict:
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CACHE_VERSION or cache.get("site_dir") != site_dir:
+        return {}
+    return cache.get("files", {})
+
+
+def _save_cache(cache_path: str, site_dir: str, files: dict):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": CACHE_VERSION, "site_dir": site_dir, "files": files}, f, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+
+def relocate_cache(cache_dir: str, site_dir: str):
+    """
+    Take over a cache restored together with its site from another host, e.g. from a build cache archive.
+    The cache is pointed at site_dir, and entries get the restored mtime of their file, which the archive
+    only kept to the microsecond, so the restored files are skipped by stat again
+    """
+    cache_path = os.path.join(cache_dir, CACHE_FILE_NAME)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return
+    if cache.get("version") != CACHE_VERSION:
+        return
+
+    site_dir = os.path.abspath(site_dir)
+    files = cache.get("files", {})
+    for relative_path, entry in files.items():
+        try:
+            stat = os.stat(os.path.join(site_dir, relative_path))
+        except OSError:
+            continue
+        if entry["size"] == stat.st_size and abs(entry["mtime_ns"] - stat.st_mtime_ns) < 1000:
+            entry["mtime_ns"] = stat.st_mtime_ns
+    _save_cache(cache_path, site_dir, files)
+
+
+def _prune_store(store_dir: str, entries):
+    """Delete the compressed files no entry refers to"""
+    used = set(entry["sha256"] + suffix for entry in entries for suffix in entry["compressed"])
+    for dir_path, dir_names, file_names in os.walk(store_dir, topdown=False):
+        for file_name in file_names:
+            if file_name not in used:
+                os.remove(os.path.join(dir_path, file_name))
+        if dir_path != store_dir and len(os.listdir(dir_path)) == 0:
+            os.rmdir(dir_path)
+
+
+def optimize_site_assets(site_dir: str, cache_dir: str, minify: bool = True, compress: bool = True, jobs: int = 0) -> dict:
+    """
+    Minify the HTML, CSS and JSON files of a built site and write precompressed files next to the text files.
+    Files whose size and mtime did not change since the last run are skipped without being read, and files
+    mkdocs wrote again with the same content are only minified, their compressed files are copied from the
+    previous run, also after a clean build.
+
+    Args:
+        site_dir: The built site, e.g. docs_path/site
+        cache_dir: Directory of the hash cache, e.g. docs_path/.vmdoc_cache
+        jobs: Number of worker processes, 0 uses all cores
+    Returns counters of what was done
+    """
+    site_dir = os.path.abspath(site_dir)
+    cache_path = os.path.join(cache_dir, CACHE_FILE_NAME)
+    cache = _load_cache(cache_path, site_dir)
+    store_dir = os.path.join(cache_dir, STORE_DIR_NAME)
+    new_cache = dict()
+    stats = {"files": 0, "unchanged": 0, "minified_bytes_saved": 0, "compressed_files": 0, "removed_files": 0}
+
+    tasks = list()
+    for dir_path, dir_names, file_names in os.walk(site_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            base_path, extension = os.path.splitext(file_path)
+            if extension in ALL_COMPRESSED_SUFFIXES:
+                # Written by us for an original that was deleted since, e.g. by a dirty build.
+                # Other compressed files are site content, like gzipped raw sources
+                base_entry = cache.get(os.path.relpath(base_path, site_dir).replace(os.sep, "/"))
+                if base_entry is not None and extension in base_entry["compressed"] and not os.path.exists(base_path):
+                    os.remove(file_path)
+                    stats["removed_files"] += 1
+                continue
+
+            extension = extension.lower()
+            if not ((minify and extension in MINIFIED_EXTENSIONS) or (compress and extension in COMPRESSED_EXTENSIONS)):
+                continue
+
+            stats["files"] += 1
+            relative_path = os.path.relpath(file_path, site_dir).replace(os.sep, "/")
+            entry = cache.get(relative_path)
+            if entry is not None:
+                stat = os.stat(file_path)
+                if (entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+                        and all(os.path.exists(file_path + suffix) for suffix in entry["compressed"])):
+                    new_cache[relative_path] = entry
+                    stats["unchanged"] += 1
+                    continue
+            tasks.append(AssetTask(file_path, relative_path, entry, minify, compress, store_dir))
+
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(tasks) <= 1:
+        results = _process_assets(tasks)
+    else:
+        import concurrent.futures
+        chunk_size = max(1, min(64, len(tasks) // (jobs * 4)))
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = [result for chunk_results in executor.map(_process_assets, chunks) for result in chunk_results]
+
+    for task, (entry, saved_bytes, compressed_files, unchanged) in zip(tasks, results):
+        new_cache[task.relative_path] = entry
+        stats["minified_bytes_saved"] += saved_bytes
+        stats["compressed_files"] += compressed_files
+        stats["unchanged"] += unchanged
+
+    _save_cache(cache_path, site_dir, new_cache)
+    _prune_store(store_dir, new_cache.values())
+    print(f"Site assets: {stats['files']} files, {stats['unchanged']} unchanged, {stats['compressed_files']} compressed files written, "
+          f"{stats['minified_bytes_saved']} bytes saved by minifying")
+    return stats
@@ -0,0 +1,212 @@
+"""
+[vmdoc:description]
+Nested timing spans and counters for the docs pipeline, written as a report, a Chrome trace and Prometheus metrics
+[vmdoc:enddescription]
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+TRACE_REPORT_FILE_NAME = "vmdoc_trace_report.json"
+TRACE_CHROME_FILE_NAME = "vmdoc_trace.chrome.json"
+TRACE_PROMETHEUS_FILE_NAME = "vmdoc_metrics.prom"
+
+
+class TraceSpan:
+    """A finished span, start and end are time.perf_counter_ns() values"""
+    __slots__ = ("name", "path", "start_ns", "end_ns", "thread_id", "args")
+
+    def __init__(self, name, path, start_ns, end_ns, thread_id, args):
+        self.name = name
+        self.path = path # Names of the enclosing spans and this span, joined with /
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.thread_id = thread_id
+        self.args = args
+
+
+class Tracer:
+    """
+    Records nested spans and counters. Spans nest per thread, counters are shared.
+
+    Example
+        tracer = Tracer()
+        with tracer.span("walk"):
+            tracer.count("files_matched", 10)
+        print(tracer.format_report())
+    """
+    def __init__(self):
+        self.spans: List[TraceSpan] = list()
+        self.counters: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start_ns = time.perf_counter_ns()
+
+
+    def _get_stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = list()
+        return stack
+
+
+    @contextmanager
+    def span(self, name: str, **args):
+        stack = self._get_stack()
+        stack.append(name)
+        path = "/".join(stack)
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end_ns = time.perf_counter_ns()
+            stack.pop()
+            with self._lock:
+                self.spans.append(TraceSpan(name, path, start_ns, end_ns, threading.get_ident(), args))
+
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def report(self) -> dict:
+        """Spans as a tree ordered by start time, with the counters"""
+        root = {"name": "total", "duration_ms": (time.perf_counter_ns() - self._start_ns) / 1e6, "children": []}
+        open_nodes = {"": root}
+        for span in sorted(self.spans, key=lambda span: (span.start_ns, -span.end_ns)):
+            node = {"name": span.name, "duration_ms": (span.end_ns - span.start_ns) / 1e6, "children": []}
+            if span.args:
+                node["args"] = span.args
+            parent_path = span.path.rpartition("/")[0]
+            open_nodes.get(parent_path, root)["children"].append(node)
+            open_nodes[span.path] = node
+        return {"spans": root, "counters": dict(sorted(self.counters.items()))}
+
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = list()
+
+        def add_node(node, depth):
+            lines.append(f"{'  ' * depth}{node['name']:<{40 - 2 * depth}} {node['duration_ms']:10.1f} ms")
+            for child in node["children"]:
+                add_node(child, depth + 1)
+
+        add_node(report["spans"], 0)
+        for name, value in report["counters"].items():
+            lines.append(f"{name:<40} {value:10}")
+        return "\n".join(lines)
+
+
+    def write_chrome_trace(self, file_path: str):
+        """Write the spans in the Trace Event Format, open it in chrome://tracing or https://ui.perfetto.dev"""
+        pid = os.getpid()
+        events = list()
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start_ns - self._start_ns) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": span.args,
+            })
+
+        end_us = (time.perf_counter_ns() - self._start_ns) / 1000
+        for name, value in sorted(self.counters.items()):
+            events.append({"name": name, "ph": "C", "ts": end_us, "pid": pid, "args": {name: value}})
+
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+    def write_prometheus(self, file_path: str, prefix: str = "vmdoc"):
+        """Write the counters, and the total seconds spent per span path, in the Prometheus text format"""
+        lines = list()
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        span_seconds = dict()
+        for span in self.spans:
+            span_seconds[span.path] = span_seconds.get(span.path, 0) + (span.end_ns - span.start_ns) / 1e9
+
+        lines.append(f"# TYPE {prefix}_span_seconds gauge")
+        for path, seconds in sorted(span_seconds.items()):
+            lines.append(f'{prefix}_span_seconds{{span="{path}"}} {seconds:.6f}')
+
+        # Written through a temp file, node_exporter's textfile collector may read it at any time
+        tmp_path = f"{file_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, file_path)
+
+
+    def write_outputs(self, trace_dir: str):
+        os.makedirs(trace_dir, exist_ok=True)
+        with open(os.path.join(trace_dir, TRACE_REPORT_FILE_NAME), 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+        self.write_chrome_trace(os.path.join(trace_dir, TRACE_CHROME_FILE_NAME))
+        self.write_prometheus(os.path.join(trace_dir, TRACE_PROMETHEUS_FILE_NAME))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+# The tracer of the active tracing session, None when tracing is off
+_active_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _active_tracer
+
+
+def span(name: str, **args):
+    """Time a block in the active tracing session, does nothing when tracing is off"""
+    if _active_tracer is None:
+        return _NULL_SPAN
+    return _active_tracer.span(name, **args)
+
+
+def count(name: str, value: int = 1):
+    """Add to a counter in the active tracing session, does nothing when tracing is off"""
+    if _active_tracer is not None:
+        _active_tracer.count(name, value)
+
+
+@contextmanager
+def tracing_session(trace_dir: Optional[str]):
+    """
+    Trace the block if trace_dir is set, then print the report and write it to trace_dir as
+    vmdoc_trace_report.json, vmdoc_trace.chrome.json and vmdoc_metrics.prom.
+    Inside an active session this does nothing, the outer session writes everything.
+    """
+    global _active_tracer
+    if not trace_dir or _active_tracer is not None:
+        yield _active_tracer
+        return
+
+    tracer = Tracer()
+    _active_tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _active_tracer = None
+        print(tracer.format_report())
+        tracer.write_outputs(trace_dir)
+        print(f"Trace written to {trace_dir}")
@@ -6,64 +6,33 @@ Automatically generate .md files using tags inside of files
 
 import sys
 from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parents[0]))
-sys.path.append(str(Path(__file__).resolve().parents[1]))
-sys.path.append(str(Path(__file__).resolve().parents[2]))
-sys.path.append(str(Path(__file__).resolve().parents[3]))
-sys.path.append(str(Path(__file__).resolve().parents[4]))
-sys.path.append(str(Path(__file__).resolve().parents[5]))
+if str(Path(__file__).resolve().parents[1]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from include.import_paths import add_vizpip_env_path
+add_vizpip_env_path()
 
 from vizpip_env.lib.pyUtil import *
+from include.mkdocs_nav import update_nav_section, remove_nav_section
+from include.vmdoc_walk import CompiledPatternMatcher, WalkStats, SourceFileSet, walk_matching_files
+from include.vmdoc_manifest import VmDocManifest, ManifestEntry, MANIFEST_FILE_NAME, hash_file_content, make_manifest_entry
+from include.output_writer import OutputWriter, write_file_if_changed, copy_file_if_changed
+from include.vmdoc_git import list_git_files, get_git_source_state
+from include.vmdoc_overview import (OverviewTree, get_overview_dir, get_overview_page, iter_parent_dirs,
+                                    render_overview_header, render_overview_file_line, get_overview_nav)
+from include.file_sync import clone_file
+from include import tracing
+import re
+import gzip
+import mmap
 import hashlib
-from typing import List, Optional, Tuple
-
-
-def update_nav_section(mkdocs_yml_path: str, nav_section_name: str, section_entries: List[Tuple[str, str]]):
-    """
-    Updates the mkdocs.yml file by replacing or inserting a section under 'nav'.
-
-    Args:
-        mkdocs_yml_path: Path to the mkdocs.yml file.
-        nav_section_name: The name of the section to update (e.g., 'files').
-        section_entries: List of (source_filename, target_path) tuples.
-                         Example: [('file1.py', 'vmdoc/file1_hash.txt'), ...]
-    """
-    pip_manager = PipManager()
-    pip_manager.add_pip_package("PyYAML")
-    pip_manager.install_missing_modules()
-
-    import yaml
-    if not os.path.exists(mkdocs_yml_path):
-        print(f"mkdocs.yml not found at: {mkdocs_yml_path}")
-        return
-
-    with open(mkdocs_yml_path, 'r') as f:
-        config = yaml.safe_load(f) or {}
-
-    nav = config.get("nav", [])
-    if not isinstance(nav, list):
-        print("Invalid format: 'nav' section should be a list.")
-        return
-
-    # Remove any existing section with the given name
-    nav = [item for item in nav if not (isinstance(item, dict) and nav_section_name in item)]
-
-    # Convert tuples to dicts for YAML formatting
-    nav_section_items = [{source: target} for source, target in section_entries]
-
-    # Add the new section
-    nav.append({nav_section_name: nav_section_items})
-    config["nav"] = nav
-
-    with open(mkdocs_yml_path, 'w') as f:
-        yaml.dump(config, f, sort_keys=False)
-
-    print(f"Updated '{nav_section_name}' section in mkdocs.yml.")
+import itertools
+from typing import Dict, List, Optional, Tuple
 
 
 class VmDocsGenerator:
     def __init__(self, docs_dir: str = None):
-        self.pattern_matcher = GitignorePatternMatcher()
+        self.pattern_matcher = CompiledPatternMatcher()
         
         self.pattern_matcher.add_pattern_str(
         """
@@ -90,24 +59,119 @@ class VmDocsGenerator:
         *.tmp
         """)
 
-        self.files = set()
+        self.files = SourceFileSet()
+
+        # Directories passed to add_files_in_dir, the relative paths are relative to these
+        self._roots = list()
+
+        # Untracked files of the directories added with add_files_from_git
+        self._git_untracked_files: Dict[str, set] = dict()
 
         self.docs_dir = docs_dir
 
-        self._added_files = list()
+        self._manifest = None
+
+        self._output_writer = None
+
+        # How the raw sources behind "View raw source code" are published, see set_raw_source_options
+        self.raw_link_mode = "reflink"
+        self.raw_store = False
+        self.raw_compress = False
+        self.raw_max_size = None
+
+        # Directories nested deeper are only linked from the overview page of their parent, not from the nav
+        self.overview_nav_depth = 2
+
+        # Off for shards of a distributed run, the overview and nav are written when the shards are merged
+        self.write_overview = True
+
+        # Overview directories whose page has to be written again in this run
+        self._dirty_overview_dirs = set()
+
+        # Files git reports as changed, per directory added with add_files_from_git, during generate()
+        self._git_changed_files: Dict[str, set] = dict()
 
 
     def set_pattern(self, gitignore_pattern: str):
-        self.pattern_matcher = GitignorePatternMatcher()
+        self.pattern_matcher = CompiledPatternMatcher()
         self.pattern_matcher.add_pattern_str(gitignore_pattern)
 
 
+    def set_raw_source_options(self, link_mode: str = "reflink", use_store: bool = False, compress: bool = False, max_size: int = None):
+        """
+        Args:
+            link_mode: How raw sources are copied to docs/vmdoc, see clone_file.
+                       "reflink" shares data blocks where the filesystem supports it and copies in the kernel otherwise,
+                       "auto" also hardlinks the source files, "copy" always copies
+            use_store: Publish raw sources once per content hash in docs/vmdoc/raw/<ab>/<sha256>.txt,
+                       files with the same content share one copy
+            compress: Also write a gzipped <sha256>.txt.gz next to every blob, for static servers that send
+                      precompressed files (e.g. nginx gzip_static). The pages still link to the .txt. Needs use_store
+            max_size: Only publish the first max_size bytes of larger sources, cut at a line end and followed
+                      by a note that the file was truncated. Needs use_store
+        """
+        if (compress or max_size is not None) and not use_store:
+            raise ValueError("compress and max_size need use_store=True")
+        self.raw_link_mode = link_mode
+        self.raw_store = use_store
+        self.raw_compress = compress
+        self.raw_max_size = max_size
+
+
+    def clear_files(self):
+        self.files = SourceFileSet()
+        self._roots = list()
+        self._git_untracked_files = dict()
+
+
     def add_files_in_dir(self, dir_path: str):
-        # List all matching files according to .gitignore-like rules
-        files_full_path = self.pattern_matcher.list_matching_files(dir_path)
-        for file_path in files_full_path:
-            file_relative_path = file_path.replace(dir_path, "")
-            self.files.add((file_path, file_relative_path))
+        # List all matching files according to .gitignore-like rules, excluded directories are never entered
+        if dir_path not in self._roots:
+            self._roots.append(dir_path)
+
+        walk_stats = WalkStats()
+        with tracing.span("walk", dir=dir_path):
+            for file_path in walk_matching_files(dir_path, self.pattern_matcher, walk_stats):
+                file_relative_path = file_path.replace(dir_path, "")
+                self.files.add((file_path, file_relative_path))
+
+        tracing.count("files_matched", walk_stats.files_matched)
+        tracing.count("files_excluded", walk_stats.files_excluded)
+        tracing.count("dirs_pruned", walk_stats.dirs_pruned)
+        print(f"Scanned {dir_path}: {walk_stats}")
+        return walk_stats
+
+
+    def add_files_from_git(self, dir_path: str):
+        """
+        Like add_files_in_dir, but the files are listed by git, the tracked files and the untracked files
+        not ignored by .gitignore, which also have to match the pattern. generate() then only checks the files
+        that changed since the commit of its previous run. Walks dir_path if it is not in a git repository
+        """
+        with tracing.span("git_ls_files", dir=dir_path):
+            git_files = list_git_files(dir_path)
+        if git_files is None:
+            print(f"{dir_path} is not in a git repository, walking it instead")
+            return self.add_files_in_dir(dir_path)
+
+        if dir_path not in self._roots:
+            self._roots.append(dir_path)
+
+        walk_stats = WalkStats()
+        for git_relative_path in git_files[0]:
+            if self.pattern_matcher.is_included(git_relative_path.replace(os.sep, "/")):
+                file_path = os.path.join(dir_path, git_relative_path)
+                if os.path.lexists(file_path): # Files deleted but not committed are still listed
+                    walk_stats.files_matched += 1
+                    self.files.add((file_path, file_path.replace(dir_path, "")))
+            else:
+                walk_stats.files_excluded += 1
+        self._git_untracked_files[dir_path] = git_files[1]
+
+        tracing.count("files_matched", walk_stats.files_matched)
+        tracing.count("files_excluded", walk_stats.files_excluded)
+        print(f"Listed {dir_path} with git: {walk_stats.files_matched} files matched, {walk_stats.files_excluded} files excluded")
+        return walk_stats
 
 
     def _get_file_basename(self, src_relative_path):
@@ -120,205 +184,721 @@ class VmDocsGenerator:
         return f"{base_name}_{file_hash}"
 
 
-    def _update_mkdocs_yml_file(self):
+    def _update_mkdocs_yml_file(self, overview_tree: OverviewTree):
         """
-        Update the mkdocs.yml file to reflect the current list of documentation files.
-        This method removes any existing `nav > files:` section and replaces it with
-        entries pointing to generated markdown files under `docs/vmdoc/`.
+        Update the mkdocs.yml file to reflect the current list of documented directories.
+        `nav > vmdoc:` gets the overview pages nested like the directories, every file is linked from
+        the overview page of its directory. A `files:` section left by older versions is removed.
+        mkdocs.yml is only written if it changes.
         """
         mkdocs_yml_file_path = os.path.join(self.docs_dir, "mkdocs.yml")
         if not os.path.exists(mkdocs_yml_file_path):
             print(f"mkdocs.yml not found at {mkdocs_yml_file_path}")
             return
 
-        with open(mkdocs_yml_file_path, 'r') as f:
-            lines = f.readlines()
+        overview_nav = get_overview_nav(overview_tree, "vmdoc", self.overview_nav_depth)
+        if update_nav_section(mkdocs_yml_file_path, "vmdoc", overview_nav) | remove_nav_section(mkdocs_yml_file_path, "files"):
+            print("Updated mkdocs.yml successfully.")
+
 
-        lines = self._remove_old_nav_files_section(lines)
-        new_entries = self._generate_nav_file_entries()
-        #if len(new_entries) > 0:
-            #lines = self._insert_new_nav_files_section(lines, new_entries)
+    def _mark_overview_dirty(self, src_relative_path):
+        # The directory lists the file, the parents list the file count of their subdirectories
+        self._dirty_overview_dirs.update(iter_parent_dirs(get_overview_dir(src_relative_path)))
 
-        with open(mkdocs_yml_file_path, 'w') as f:
-            f.writelines(lines)
 
-        print("Updated mkdocs.yml successfully.")
+    def iter_documented_files(self):
+        """Yield (full_path, relative_path, manifest entry) of every added file that has vmdoc tags"""
+        for src_file_path, src_relative_path in self.files:
+            entry = self._manifest.get(src_relative_path)
+            if entry is not None and entry["tagged"]:
+                yield src_file_path, src_relative_path, entry
 
 
-    def _generate_nav_file_entries(self):
+    def _write_overview_page(self, overview_tree: OverviewTree, overview_dir: str, documented_files):
         """
-        Generate a list of YAML-formatted strings representing the new 'files:' section
-        entries for mkdocs.yml under the 'nav' section.
+        Stream the overview page of a directory to disk
+
+        Args:
+            documented_files: (full_path, relative_path, manifest entry) of the files in the directory
         """
-        entries = []
-        for _, rel_path in sorted(self._added_files):
-            doc_name = self._get_file_base_name_with_hash(rel_path)
-            md_file_path = f"vmdoc/{doc_name}.txt"
-            entries.append(f"    - {rel_path}: {md_file_path}")
-        return entries
+        page_path = f"{self.docs_dir}/docs/vmdoc/{get_overview_page(overview_dir)}"
+        os.makedirs(os.path.dirname(page_path), exist_ok=True)
+        with self._output_writer.open_stream(page_path) as f:
+            f.write(render_overview_header(overview_tree, overview_dir))
+            for src_file_path, src_relative_path, entry in documented_files:
+                # The description was captured during extraction, no need to read the file again
+                md_file_name = f"{self._get_file_base_name_with_hash(src_relative_path)}.md"
+                f.write(render_overview_file_line(overview_dir, src_relative_path, md_file_name, entry["description"]))
+        return f.written
 
 
-    def _remove_old_nav_files_section(self, lines):
+    def _update_vmdoc_file(self):
         """
-        Removes the existing '- files:' section and all indented sub-entries from the `nav:` block.
-        Returns the cleaned list of lines.
+        Update the overview pages and the nav, vmdocs.md lists the root directory and every other directory
+        with documented files gets its own page. Only the pages of directories where a documented file was
+        added, removed or got another description are written again.
+        Also marks the outputs of every documented file as produced in this run
         """
-        updated_lines = []
-        in_nav = False
-        in_files_section = False
-        indent_level = None
+        overview_tree = OverviewTree()
+        for src_file_path, src_relative_path, entry in self.iter_documented_files():
+            overview_tree.add(src_relative_path)
+            for output_path in self._get_published_paths(src_relative_path, entry):
+                self._output_writer.keep(output_path)
+
+        dirty_dirs = set()
+        for overview_dir in overview_tree.dirs():
+            page_path = f"{self.docs_dir}/docs/vmdoc/{get_overview_page(overview_dir)}"
+            if overview_dir in self._dirty_overview_dirs or not os.path.exists(page_path):
+                dirty_dirs.add(overview_dir)
+            else:
+                self._output_writer.keep(page_path)
+
+        # Files are listed grouped by directory, so the pages are written in one pass without holding the file lists
+        written_pages = 0
+        written_dirs = set()
+        split_dirs = set() # Directories whose files were not listed together, e.g. from two source directories
+        documented_files = self.iter_documented_files() if dirty_dirs else ()
+        for overview_dir, dir_files in itertools.groupby(documented_files, key=lambda x: get_overview_dir(x[1])):
+            if overview_dir in written_dirs:
+                split_dirs.add(overview_dir)
+            elif overview_dir in dirty_dirs:
+                written_pages += self._write_overview_page(overview_tree, overview_dir, dir_files)
+                written_dirs.add(overview_dir)
+
+        for overview_dir in sorted((dirty_dirs - written_dirs) | split_dirs):
+            dir_files = ()
+            if overview_tree.file_counts.get(overview_dir, 0) != 0:
+                dir_files = (x for x in self.iter_documented_files() if get_overview_dir(x[1]) == overview_dir)
+            written_pages += self._write_overview_page(overview_tree, overview_dir, dir_files)
+
+        self._update_mkdocs_yml_file(overview_tree)
+        self._dirty_overview_dirs = set()
+        if written_pages:
+            print(f"{written_pages} overview pages written, {len(overview_tree.total_counts)} in total")
+
+
+    def _get_output_paths(self, src_relative_path):
+        base_name_with_hash = self._get_file_base_name_with_hash(src_relative_path)
+        output_md_path = f"{self.docs_dir}/docs/vmdoc/{base_name_with_hash}.md"
+        output_txt_path = f"{self.docs_dir}/docs/vmdoc/{base_name_with_hash}.txt"
+        return output_md_path, output_txt_path
+
+
+    def _get_raw_store_dir(self):
+        return f"{self.docs_dir}/docs/vmdoc/{RAW_STORE_DIR_NAME}"
+
+
+    def _get_published_paths(self, src_relative_path, entry):
+        """The .md and the raw source the .md links to, which is in the raw store if enabled, with its .gz if compressed"""
+        output_md_path, output_txt_path = self._get_output_paths(src_relative_path)
+        if not self.raw_store:
+            return output_md_path, output_txt_path
+        output_txt_path = get_raw_store_path(self._get_raw_store_dir(), entry["sha256"], entry["size"], self.raw_max_size)
+        if self.raw_compress:
+            return output_md_path, output_txt_path, f"{output_txt_path}.gz"
+        return output_md_path, output_txt_path
+
+
+    def _remove_outputs(self, src_relative_path):
+        # Files in the raw store can be shared, unused ones are deleted when pruning
+        for output_path in self._get_output_paths(src_relative_path):
+            self._output_writer.remove(output_path)
+
+
+    def _outputs_exist(self, src_relative_path, entry):
+        return _files_exist(self._get_published_paths(src_relative_path, entry))
+
+
+    def _create_task(self, src_file_path, src_relative_path):
+        """
+        Check a source file against the manifest.
+        Returns None if it is unchanged since the last run, otherwise a task for _process_source_file
+        """
+        entry = self._manifest.get(src_relative_path)
+        if entry is not None and self._is_unchanged_in_git(src_file_path, src_relative_path):
+            if not entry["tagged"] or self._outputs_exist(src_relative_path, entry):
+                return None # git reports no change, skip without even a stat
 
-        for line in lines:
-            stripped = line.strip()
+        try:
+            stat = os.stat(src_file_path)
+        except OSError as e:
+            print(f"Error reading file {src_file_path}: {e}")
+            return None
 
-            if stripped == "nav:":
-                in_nav = True
-                updated_lines.append(line)
-                continue
+        if entry is not None and self._manifest.matches_stat(entry, stat):
+            if not entry["tagged"] or self._outputs_exist(src_relative_path, entry):
+                return None # Unchanged, skip without reading the file
 
-            if in_nav:
-                if stripped.startswith("- files:"):
-                    in_files_section = True
-                    indent_level = len(line) - len(line.lstrip())
-                    continue  # Skip this line and its children
+        output_md_path, output_txt_path = self._get_output_paths(src_relative_path)
+        raw_store_dir = self._get_raw_store_dir() if self.raw_store else None
+        return VmDocFileTask(src_file_path, src_relative_path, output_md_path, output_txt_path, stat, entry,
+                             raw_store_dir, self.raw_link_mode, self.raw_max_size, self.raw_compress)
 
-                if in_files_section:
-                    current_indent = len(line) - len(line.lstrip())
-                    if current_indent > indent_level:
-                        continue  # Still inside old files section
-                    else:
-                        in_files_section = False  # End of old files section
 
-            updated_lines.append(line)
+    def _is_unchanged_in_git(self, src_file_path, src_relative_path) -> bool:
+        changed_files = self._git_changed_files.get(src_file_path[:len(src_file_path) - len(src_relative_path)])
+        return changed_files is not None and src_relative_path.lstrip(os.sep) not in changed_files
 
-        return updated_lines
 
+    def _find_git_changes(self) -> list:
+        """
+        Ask git which files changed since the previous run, for every directory added with add_files_from_git.
+        Returns the git states to record in the manifest once the files are processed
+        """
+        self._git_changed_files = dict()
+        git_states = list()
+        for dir_path, untracked_files in self._git_untracked_files.items():
+            state = get_git_source_state(dir_path, untracked_files)
+            if state is None:
+                continue
+            state.find_changed_files(dir_path, self._manifest.get_git_source(os.path.abspath(dir_path)))
+            if state.changed_files is not None:
+                self._git_changed_files[dir_path] = state.changed_files
+                tracing.count("git_changed_files", len(state.changed_files))
+            git_states.append((dir_path, state))
+        return git_states
+
+
+    def _iter_tasks(self, files):
+        for src_file_path, src_relative_path in files:
+            task = self._create_task(src_file_path, src_relative_path)
+            if task is not None:
+                yield task
 
-    def _insert_new_nav_files_section(self, lines, new_entries):
+
+    def _run_tasks(self, tasks, jobs: int, use_threads: bool):
         """
-        Inserts the new `- files:` section into the `nav:` block of mkdocs.yml.
-        Inserts after the 'nav:' key.
+        Run the tasks in a worker pool and yield (task, result) in the same order as the tasks,
+        so the generated nav and overview do not depend on scheduling.
+        tasks is consumed lazily and at most jobs * 4 chunks are in flight, so memory stays
+        the same however many files there are
         """
-        for i, line in enumerate(lines):
-            if line.strip() == "nav:":
-                insert_index = i + 1
-                break
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+
+        tasks = iter(tasks)
+        first_tasks = list(itertools.islice(tasks, 2))
+        if jobs == 1 or len(first_tasks) <= 1:
+            # Not worth starting a pool
+            for task in itertools.chain(first_tasks, tasks):
+                yield task, _process_source_file(task)
+            return
+
+        import collections
+        import concurrent.futures
+        if use_threads:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+            chunk_size = 1
         else:
-            insert_index = len(lines)
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+            chunk_size = 16 # Fewer round trips to the worker processes
 
-        insertion = ["  - files:\n"] + [f"{entry}\n" for entry in new_entries]
-        return lines[:insert_index] + insertion + lines[insert_index:]
+        tasks = itertools.chain(first_tasks, tasks)
+        in_flight = collections.deque()
+        with executor:
+            while True:
+                chunk = list(itertools.islice(tasks, chunk_size))
+                if chunk:
+                    in_flight.append((chunk, executor.submit(_process_source_files, chunk)))
 
+                if in_flight and (not chunk or len(in_flight) >= jobs * 4):
+                    done_chunk, future = in_flight.popleft()
+                    yield from zip(done_chunk, future.result())
+                elif not chunk:
+                    break
 
-    def _update_vmdoc_file(self):
-        vmdoc_md_file_path = f"{self.docs_dir}/docs/vmdoc/vmdocs.md"
 
-        # List all the files with their description, and include a link to them
-        # Prepare the vmdocs.md overview file
-        vmdoc_description = "# Vmdoc Overview\n\nThis document lists all the generated documentation files.\n\n"
+    def _load_manifest(self):
+        os.makedirs(self.docs_dir+"/docs/vmdoc", exist_ok=True)
 
-        added_files_sorted = sorted(self._added_files, key=lambda x: x[1])
+        self._manifest = VmDocManifest(f"{self.docs_dir}/docs/vmdoc/{MANIFEST_FILE_NAME}")
+        self._manifest.load()
+
+
+    def _apply_tasks(self, tasks, jobs: int, use_threads: bool) -> int:
+        """Run the tasks and store their results, returns the number of tasks"""
+        stats = self._output_writer.stats
+        task_count = 0
+        for counter_name in ("files_scanned", "files_tagged", "bytes_read", "bytes_written"):
+            tracing.count(counter_name, 0)
+
+        for task, result in self._run_tasks(tasks, jobs, use_threads):
+            task_count += 1
+            tracing.count("files_scanned")
+            stats.written += result.files_written
+            stats.deleted += result.files_deleted
+            tracing.count("bytes_read", result.bytes_read)
+            tracing.count("bytes_written", result.bytes_written)
+            if result.entry is not None:
+                tracing.count("files_tagged", result.entry["tagged"])
+                old_entry = task.entry
+                if result.entry["tagged"] != (old_entry is not None and old_entry["tagged"]) or \
+                        (result.entry["tagged"] and result.entry["description"] != old_entry["description"]):
+                    self._mark_overview_dirty(task.src_relative_path)
+                self._manifest.set(task.src_relative_path, result.entry)
+        return task_count
+
+
+    def _remove_source(self, src_relative_path):
+        entry = self._manifest.get(src_relative_path)
+        if entry is not None:
+            if entry["tagged"]:
+                self._remove_outputs(src_relative_path)
+                self._mark_overview_dirty(src_relative_path)
+            self._manifest.remove(src_relative_path)
+
+
+    def _is_added(self, src_relative_path) -> bool:
+        if not self._roots:
+            return any(relative_path == src_relative_path for _, relative_path in self.files)
+        return any((root + src_relative_path, src_relative_path) in self.files for root in self._roots)
+
+
+    def _finish_generate(self):
+        # The overview is written before the manifest, so an interrupted run redoes the overview pages it missed
+        if self.write_overview:
+            with tracing.span("overview"):
+                self._update_vmdoc_file()
+        else:
+            for src_file_path, src_relative_path, entry in self.iter_documented_files():
+                for output_path in self._get_published_paths(src_relative_path, entry):
+                    self._output_writer.keep(output_path)
+
+        if self._manifest.changed:
+            with tracing.span("manifest_save"):
+                self._manifest.save()
+
+        # Delete everything in docs/vmdoc that this run did not produce, e.g. outputs of older versions
+        with tracing.span("prune"):
+            self._output_writer.prune()
+        stats = self._output_writer.stats
+        tracing.count("outputs_written", stats.written)
+        tracing.count("outputs_deleted", stats.deleted)
+        tracing.count("outputs_bytes", stats.total_bytes)
+        tracing.count("outputs_disk_bytes", stats.disk_bytes)
+        print(f"vmdoc outputs: {stats}")
+        print(f"vmdoc size: {_format_size(stats.total_bytes)} to deploy, {_format_size(stats.disk_bytes)} on disk")
+        if self.raw_store:
+            self._report_raw_store()
+        self._output_writer = OutputWriter(self._output_writer.output_dir)
+
+
+    def _report_raw_store(self):
+        blob_count = 0
+        truncated_count = 0
+        stored_bytes = 0
+        for dir_path, dir_names, file_names in os.walk(self._get_raw_store_dir()):
+            for file_name in file_names:
+                if file_name.endswith(".txt"):
+                    blob_count += 1
+                    truncated_count += ".max" in file_name
+                stored_bytes += os.path.getsize(os.path.join(dir_path, file_name))
+        source_bytes = sum(entry["size"] for _, _, entry in self.iter_documented_files())
+
+        tracing.count("raw_store_bytes", stored_bytes)
+        print(f"vmdoc raw store: {blob_count} blobs ({truncated_count} truncated), "
+              f"{_format_size(stored_bytes)} stored for {_format_size(source_bytes)} of sources")
+
+
+    def _begin_run(self):
+        if self._manifest is None:
+            with tracing.span("manifest_load"):
+                self._load_manifest()
+        if self._output_writer is None:
+            self._output_writer = OutputWriter(f"{self.docs_dir}/docs/vmdoc")
+
+
+    def generate(self, jobs: int = 1, use_threads: bool = False):
+        """
+        Generate docs/vmdoc from the added files, only files that changed since the last run are processed.
 
-        for src_file_path, src_relative_path in added_files_sorted:
-            description = get_docs_tag_contents_joined(src_file_path, '[vmdoc:description ]'.replace(" ", ""), '[vmdoc:enddescription ]'.replace(" ", ""))
-            base_name_with_hash = self._get_file_base_name_with_hash(src_relative_path)
+        Args:
+            jobs: Number of workers used to extract tags and write outputs, 0 uses all cores
+            use_threads: Use a thread pool instead of a process pool
+        """
+        with tracing.span("generate"):
+            self._begin_run()
 
-            vmdoc_description += f"- [{src_relative_path}]( {base_name_with_hash}.md ) - {description}\n\n"
+            with tracing.span("git_diff"):
+                git_states = self._find_git_changes()
 
-        with open(vmdoc_md_file_path, 'w', encoding='utf-8') as f:
-            f.write(vmdoc_description)
-        
-        print(f"vmdocs.md file generated at: {vmdoc_md_file_path}")
+            # Pipeline: the stat check against the manifest, then prefilter, extract and write in the workers.
+            # Tasks are created while earlier ones are processed, they are never all in memory at once
+            with tracing.span("extract_and_write", jobs=jobs):
+                task_count = self._apply_tasks(self._iter_tasks(self.files), jobs, use_threads)
+            tracing.count("files_skipped", len(self.files) - task_count)
 
+            # Remove the outputs of sources that no longer exist
+            with tracing.span("remove_stale"):
+                for src_relative_path in self._manifest.paths():
+                    if not self._is_added(src_relative_path):
+                        self._remove_source(src_relative_path)
 
-    def generate(self):
-        self._added_files = []
+            for dir_path, state in git_states:
+                self._manifest.set_git_source(os.path.abspath(dir_path), state.to_dict())
+            self._git_changed_files = dict()
 
-        os.makedirs(self.docs_dir+"/docs/vmdoc", exist_ok=True)
+            self._finish_generate()
 
-        for src_file_path, src_relative_path in self.files:
-            doc_tag_content = get_docs_tag_contents_joined(src_file_path, '[vmdoc:start ]'.replace(" ", ""), '[vmdoc:end ]'.replace(" ", ""))
-            description_tag_content = get_docs_tag_contents_joined(src_file_path, '[vmdoc:description ]'.replace(" ", ""), '[vmdoc:enddescription ]'.replace(" ", ""))
 
-            if len(doc_tag_content) == 0 and len(description_tag_content) == 0:
-                # Do not add file without vmdoc tags
-                continue
+    def merge_generated_outputs(self, output_dirs: List[str], entries: Dict[str, ManifestEntry], saved_ns_limit: int = None):
+        """
+        Make docs/vmdoc from outputs generated elsewhere, e.g. by the shards of a distributed run (see vmdoc_shard.py),
+        then write the overview and nav. The outputs are hardlinked or copied, files that are already up to date
+        are kept, and everything else in docs/vmdoc is deleted.
+
+        Args:
+            output_dirs: docs/vmdoc directories of the generators that produced the outputs
+            entries: The manifest entries of all the generated files, they become the added files
+            saved_ns_limit: Save time of the oldest part, see VmDocManifest.saved_ns_limit
+        """
+        self._begin_run()
+
+        with tracing.span("copy_outputs"):
+            for output_dir in output_dirs:
+                for dir_path, dir_names, file_names in os.walk(output_dir):
+                    relative_dir = os.path.relpath(dir_path, output_dir)
+                    target_dir = os.path.normpath(os.path.join(self._output_writer.output_dir, relative_dir))
+                    os.makedirs(target_dir, exist_ok=True)
+                    for file_name in file_names:
+                        if not file_name.startswith("."):
+                            self._output_writer.copy_file(os.path.join(dir_path, file_name), os.path.join(target_dir, file_name), "auto")
+
+        for src_relative_path in self._manifest.paths():
+            if src_relative_path not in entries:
+                self._remove_source(src_relative_path)
+        for src_relative_path, entry in entries.items():
+            old_entry = self._manifest.get(src_relative_path)
+            if old_entry is None or old_entry["tagged"] != entry["tagged"] or old_entry["description"] != entry["description"]:
+                self._mark_overview_dirty(src_relative_path)
+            self._manifest.set(src_relative_path, entry)
+        self._manifest.saved_ns_limit = saved_ns_limit
+
+        # The generated files are only known by their relative path here
+        self.clear_files()
+        self._roots.append("")
+        self.files = SourceFileSet((src_relative_path, src_relative_path) for src_relative_path in entries)
+        self._finish_generate()
+
+
+    def update_files(self, changed_files: List[Tuple[str, str]], jobs: int = 1, use_threads: bool = False):
+        """
+        Regenerate only the outputs of the given files, used by watch mode.
+        Files that no longer exist, or are not matched by the pattern, are removed from the docs.
+
+        Args:
+            changed_files: List of (full_path, relative_path) tuples, as stored in self.files
+        """
+        self._begin_run()
+
+        # Changes seen by the watcher are not in the git state of the last generate, check every file next time
+        for dir_path in self._git_untracked_files:
+            self._manifest.set_git_source(os.path.abspath(dir_path), None)
+
+        tasks = list()
+        for src_file_path, src_relative_path in sorted(set(changed_files)):
+            if os.path.isfile(src_file_path) and self.pattern_matcher.is_included(src_relative_path.lstrip("/")):
+                self.files.add((src_file_path, src_relative_path))
+                task = self._create_task(src_file_path, src_relative_path)
+                if task is not None:
+                    tasks.append(task)
+            else:
+                self.files.discard((src_file_path, src_relative_path))
+                self._remove_source(src_relative_path)
+
+        task_count = self._apply_tasks(tasks, jobs, use_threads)
+        self._finish_generate()
+        return task_count
 
-            self._added_files.append((src_file_path, src_relative_path)) # Mark that we have added the file to the documentation
 
-            base_name_with_hash = self._get_file_base_name_with_hash(src_relative_path)
-            md_file_name = base_name_with_hash + ".md"
-            txt_file_name = base_name_with_hash + ".txt"
 
-            output_md_path = f"{self.docs_dir}/docs/vmdoc/{md_file_name}" 
-            output_txt_path = f"{self.docs_dir}/docs/vmdoc/{txt_file_name}" 
+def _remove_files(paths) -> int:
+    removed = 0
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
 
-            # Remove all the lines with [vmdoc:skip_line] from doc_tag_content
-            doc_tag_content_lines = doc_tag_content.split("\n")
-            filtered_tag_content = [s for s in doc_tag_content_lines if "[vmdoc:skip_line]" not in s]
-            doc_tag_content = "\n".join(filtered_tag_content)
 
-            metadata = (
-            f"---\n"
-            f"title: {src_relative_path}\n"
-            f"source_file: {src_relative_path}\n"
-            f"description: {description_tag_content}\n"
-            f"generated_from: vmdoc\n"
-            f"source_code_file: {txt_file_name}\n"
-            f"---\n\n")
+def _format_size(size: int) -> str:
+    return f"{size / 1e6:.1f} MB"
 
-            body = (
-                f"[📄 View raw source code]({txt_file_name})"
-                f"\n\n"
-                f"{doc_tag_content.strip()}\n\n"
-            )
 
-            with open(output_md_path, 'w', encoding='utf-8') as f:
-                f.write(metadata + body)
+def _files_exist(paths):
+    return all(os.path.exists(path) for path in paths)
 
-            # Write raw source to .txt
-            try:
-                with open(src_file_path, 'r', encoding='utf-8') as src_file:
-                    source_code = src_file.read()
-                with open(output_txt_path, 'w', encoding='utf-8') as txt_file:
-                    txt_file.write(source_code)
-            except Exception as e:
-                print(f"Error writing source code to txt: {e}")
 
-        self._update_mkdocs_yml_file()
-        self._update_vmdoc_file()
+# Directory in docs/vmdoc holding the content-addressed raw sources
+RAW_STORE_DIR_NAME = "raw"
 
 
+# Appended to raw sources that were cut at the size cap of the raw store
+RAW_TRUNCATION_NOTE = "\n\n... truncated by vmdoc, {shown_size} of {size} bytes shown\n"
+
+
+def get_raw_store_path(raw_store_dir: str, content_hash: str, size: int = 0, max_size: int = None) -> str:
+    """
+    Path of a blob in the raw store, named by content hash.
+    Truncated blobs also carry the size cap in their name, the gzipped copy of a blob is the same path with .gz
+    """
+    name = content_hash if max_size is None or size <= max_size else f"{content_hash}.max{max_size}"
+    return f"{raw_store_dir}/{content_hash[:2]}/{name}.txt"
+
+
+class VmDocFileTask:
+    """A source file that has to be scanned, sent to the worker pool by VmDocsGenerator.generate"""
+    __slots__ = ("src_file_path", "src_relative_path", "output_md_path", "output_txt_path", "stat", "entry",
+                 "raw_store_dir", "link_mode", "raw_max_size", "raw_compress")
+
+    def __init__(self, src_file_path, src_relative_path, output_md_path, output_txt_path, stat, entry,
+                 raw_store_dir=None, link_mode="reflink", raw_max_size=None, raw_compress=False):
+        self.src_file_path = src_file_path
+        self.src_relative_path = src_relative_path
+        self.output_md_path = output_md_path
+        self.output_txt_path = output_txt_path
+        self.stat = stat
+        self.entry = entry # The manifest entry from the previous run, None for new files
+        self.raw_store_dir = raw_store_dir # Publish the raw source in the content-addressed store if set
+        self.link_mode = link_mode
+        self.raw_max_size = raw_max_size # Cap of the raw store, None to publish whole files
+        self.raw_compress = raw_compress # Write a gzipped copy next to the blobs in the raw store
+
+
+    def get_published_txt_path(self, content_hash: str) -> str:
+        if self.raw_store_dir is None:
+            return self.output_txt_path
+        return get_raw_store_path(self.raw_store_dir, content_hash, self.stat.st_size, self.raw_max_size)
+
+
+def _publish_raw_source(task: VmDocFileTask, txt_path: str) -> int:
+    """
+    Publish the raw source, whole files are never read into python but reflinked, hardlinked or copied in the kernel.
+    Returns the number of bytes written, 0 if the file was already published
+    """
+    if task.raw_store_dir is None:
+        return task.stat.st_size if copy_file_if_changed(task.src_file_path, txt_path, task.link_mode) else 0
+
+    compressed_path = f"{txt_path}.gz" if task.raw_compress else None
+    if os.path.exists(txt_path) and (compressed_path is None or os.path.exists(compressed_path)):
+        return 0 # Named by content hash, an existing file has the same content
+
+    truncated = task.raw_max_size is not None and task.stat.st_size > task.raw_max_size
+    if not truncated and compressed_path is None:
+        # Never hardlink into the store, editing the source in place would change the content behind the hash
+        clone_file(task.src_file_path, txt_path, "reflink" if task.link_mode == "auto" else task.link_mode)
+        return task.stat.st_size
+
+    with open(task.src_file_path, 'rb') as f:
+        data = f.read(task.raw_max_size if truncated else -1)
+    if truncated:
+        data = data[:data.rfind(b"\n") + 1] or data # Cut at a line end if there is one
+        data += RAW_TRUNCATION_NOTE.format(shown_size=len(data), size=task.stat.st_size).encode('utf-8')
+
+    os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+    bytes_written = len(data) if write_file_if_changed(txt_path, data) else 0
+    if compressed_path is not None:
+        # Browsers show the .txt, servers that support it send the precompressed copy instead
+        compressed_data = gzip.compress(data, mtime=0)
+        if write_file_if_changed(compressed_path, compressed_data):
+            bytes_written += len(compressed_data)
+    return bytes_written
+
+
+class VmDocFileResult:
+    """What a worker did for one VmDocFileTask, sent back to the parent"""
+    __slots__ = ("entry", "files_written", "files_deleted", "bytes_read", "bytes_written")
+
+    def __init__(self, entry: Optional[dict] = None, bytes_read: int = 0):
+        self.entry = entry # The new manifest entry, None if the file could not be read
+        self.files_written = 0
+        self.files_deleted = 0
+        self.bytes_read = bytes_read
+        self.bytes_written = 0
+
+
+def _write_vmdoc_outputs(task: VmDocFileTask, txt_path: str, doc_tag_content: str, description_tag_content: str,
+                         result: VmDocFileResult):
+    """Outputs that already have the right content are left untouched, result counts what was written"""
+    src_relative_path = task.src_relative_path
+    txt_file_name = os.path.relpath(txt_path, os.path.dirname(task.output_md_path)).replace(os.sep, "/")
+
+    metadata = (
+    f"---\n"
+    f"title: {src_relative_path}\n"
+    f"source_file: {src_relative_path}\n"
+    f"description: {description_tag_content}\n"
+    f"generated_from: vmdoc\n"
+    f"source_code_file: {txt_file_name}\n"
+    f"---\n\n")
+
+    body = (
+        f"[📄 View raw source code]({txt_file_name})"
+        f"\n\n"
+        f"{doc_tag_content.strip()}\n\n"
+    )
+
+    md_data = (metadata + body).encode('utf-8')
+    if write_file_if_changed(task.output_md_path, md_data):
+        result.files_written += 1
+        result.bytes_written += len(md_data)
+
+    # Publish raw source as .txt, the source is never decoded
+    try:
+        bytes_written = _publish_raw_source(task, txt_path)
+        if bytes_written:
+            result.files_written += 1
+            result.bytes_written += bytes_written
+    except Exception as e:
+        print(f"Error writing source code to txt: {e}")
+
+
+def _process_source_files(tasks: List[VmDocFileTask]) -> List[VmDocFileResult]:
+    return [_process_source_file(task) for task in tasks]
+
+
+def _process_source_file(task: VmDocFileTask) -> VmDocFileResult:
+    """
+    Scan a single source file and regenerate its outputs if its content changed.
+    Runs in a worker, so it only touches the outputs of its own file.
+    """
+    entry = task.entry
+    output_paths = (task.output_md_path, task.output_txt_path)
+
+    scan = scan_vmdoc_file(task.src_file_path)
+    if scan is None:
+        return VmDocFileResult()
+    result = VmDocFileResult(bytes_read=task.stat.st_size)
+
+    txt_path = task.get_published_txt_path(scan.content_hash)
+    published_paths = (task.output_md_path, txt_path) + ((f"{txt_path}.gz",) if task.raw_store_dir and task.raw_compress else ())
+
+    if not scan.has_tags():
+        # Do not add file without vmdoc tags
+        if entry is not None and entry["tagged"]:
+            result.files_deleted = _remove_files(output_paths)
+        result.entry = make_manifest_entry(task.stat, scan.content_hash, False)
+        return result
+
+    if entry is not None and entry["tagged"] and entry["sha256"] == scan.content_hash:
+        if _files_exist(published_paths):
+            # Only touched, the content is the same
+            result.entry = make_manifest_entry(task.stat, scan.content_hash, True, entry["description"])
+            return result
+
+    _write_vmdoc_outputs(task, txt_path, scan.doc, scan.description, result)
+    result.entry = make_manifest_entry(task.stat, scan.content_hash, True, scan.description)
+    return result
+
+
+# Every vmdoc tag starts with this, files without it are rejected before decoding anything
+VMDOC_TAG_MARKER = b"[vmdoc"
+
+_VMDOC_TAG_RE = re.compile(rb"\[vmdoc:(start|end|description|enddescription)\]")
+
+
+class VmDocFileScan:
+    """Result of scanning a source file for vmdoc tags"""
+    __slots__ = ("content_hash", "doc", "description")
+
+    def __init__(self, content_hash: str = "", doc: str = "", description: str = ""):
+        self.content_hash = content_hash
+        self.doc = doc
+        self.description = description
+
+
+    def has_tags(self) -> bool:
+        return len(self.doc) != 0 or len(self.description) != 0
+
+
+def _decode_tag_content(data: bytes) -> str:
+    # Same newline handling as reading the file in text mode. Invalid UTF-8 is replaced, so the file still
+    # gets a manifest entry and is skipped while unchanged, instead of failing and being read again every run
+    return bytes(data).decode('utf-8', errors='replace').replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def _pair_tag_contents(buffer, file_path: str, start_positions: List[Tuple[int, int]], end_positions: List[Tuple[int, int]]) -> List[str]:
+    """
+    Pair up (start, end) byte spans of start and end tags and decode the content between them.
+    Only the content between tags is decoded, the rest of the file is never turned into a string
+    """
+    contents = []
+
+    if len(start_positions) != len(end_positions):
+        print(f"Warning: Mismatched number of start and end tags in {file_path}")
+        return contents
+
+    for (_, start), (end, _) in zip(start_positions, end_positions):
+        if end > start:
+            contents.append(_decode_tag_content(buffer[start:end]))
+
+    return contents
+
+
+def _scan_vmdoc_buffer(buffer, file_path: str) -> Tuple[str, str]:
+    """Extract all vmdoc tag kinds from a bytes-like buffer in a single pass"""
+    tag_positions: Dict[bytes, List[Tuple[int, int]]] = {
+        b"start": [], b"end": [], b"description": [], b"enddescription": []
+    }
+    for match in _VMDOC_TAG_RE.finditer(buffer):
+        tag_positions[match.group(1)].append(match.span())
+
+    doc_contents = _pair_tag_contents(buffer, file_path, tag_positions[b"start"], tag_positions[b"end"])
+    description_contents = _pair_tag_contents(buffer, file_path, tag_positions[b"description"], tag_positions[b"enddescription"])
+
+    doc = ('\n\n'.join(doc_contents)).strip()
+    description = ('\n\n'.join(description_contents)).strip()
+
+    # Remove all the lines with [vmdoc:skip_line] from the doc content
+    doc = "\n".join([s for s in doc.split("\n") if "[vmdoc:skip_line]" not in s])
+
+    return doc, description
+
+
+def scan_vmdoc_file(file_path: str) -> Optional[VmDocFileScan]:
+    """
+    Extract the doc and description tags of a file in one pass.
+
+    The file is memory mapped, so even very large generated files are scanned without
+    loading them into memory. Files without any vmdoc marker are rejected with a
+    byte-level search and never hashed or decoded, and their content_hash is left empty.
+
+    Returns None if the file could not be read.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return VmDocFileScan()
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if buffer.find(VMDOC_TAG_MARKER) == -1:
+                    return VmDocFileScan()
+
+                doc, description = _scan_vmdoc_buffer(buffer, file_path)
+                return VmDocFileScan(hash_file_content(buffer), doc, description)
+
+    except (OSError, ValueError) as e:
+        print(f"Error reading file {file_path}: {e}")
+        return None
+
 
 def get_docs_tag_contents(file_path: str, start_tag: str, end_tag: str) -> List[str]:
     """Extract content between the specified start and end tags from a file."""
     contents = []
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            file_content = file.read()
-
-        start_positions = []
-        end_positions = []
-
-        start_pos = file_content.find(start_tag)
-        while start_pos != -1:
-            start_positions.append(start_pos)
-            start_pos = file_content.find(start_tag, start_pos + len(start_tag))
-
-        end_pos = file_content.find(end_tag)
-        while end_pos != -1:
-            end_positions.append(end_pos)
-            end_pos = file_content.find(end_tag, end_pos + len(end_tag))
-
-        if len(start_positions) != len(end_positions):
-            print(f"Warning: Mismatched number of start and end tags in {file_path}")
-            return contents
-
-        for start, end in zip(start_positions, end_positions):
-            if end > start:
-                content = file_content[start + len(start_tag):end].strip()
-                contents.append(content)
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return contents
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                start_tag_bytes = start_tag.encode('utf-8')
+                end_tag_bytes = end_tag.encode('utf-8')
+
+                start_positions = [m.span() for m in re.finditer(re.escape(start_tag_bytes), buffer)]
+                end_positions = [m.span() for m in re.finditer(re.escape(end_tag_bytes), buffer)]
+
+                contents = _pair_tag_contents(buffer, file_path, start_positions, end_positions)
 
     except Exception as e:
         print(f"Error reading file {file_path}: {e}")
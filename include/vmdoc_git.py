@@ -0,0 +1,115 @@
+"""
+[vmdoc:description]
+Source discovery and change detection through the local git repository
+[vmdoc:enddescription]
+
+git knows which files are tracked or ignored and which changed since a commit, from its index,
+so no directory has to be walked and unchanged files do not even have to be stat-ed.
+"""
+
+import os
+import subprocess
+from typing import List, Optional, Set, Tuple
+
+
+def run_git(dir_path: str, args: List[str]) -> Optional[bytes]:
+    """Run git in dir_path, returns its output or None if git is missing or fails (e.g. not a repository)"""
+    try:
+        result = subprocess.run(["git", "-C", dir_path] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout
+
+
+def _split_paths(output: bytes) -> List[str]:
+    """Paths of a -z output, as native paths relative to the directory git was run in"""
+    return [os.fsdecode(path).replace("/", os.sep) for path in output.split(b"\0") if path]
+
+
+def get_head_commit(dir_path: str) -> Optional[str]:
+    """The commit checked out in the repository of dir_path, None if it is not a repository or has no commits"""
+    output = run_git(dir_path, ["rev-parse", "--verify", "-q", "HEAD"])
+    return output.decode('ascii').strip() if output else None
+
+
+def list_git_files(dir_path: str) -> Optional[Tuple[List[str], Set[str]]]:
+    """
+    Like `git ls-files -z --cached --others --exclude-standard`, the files in dir_path that are
+    tracked or untracked but not ignored by .gitignore, relative to dir_path.
+    Returns (all files, untracked files), or None if dir_path is not in a git repository
+    """
+    output = run_git(dir_path, ["ls-files", "-z", "-t", "--cached", "--others", "--exclude-standard"])
+    if output is None:
+        return None
+
+    # -t prefixes every path with its status, "? " for untracked files
+    files = list()
+    untracked = set()
+    for line in output.split(b"\0"):
+        if len(line) < 3:
+            continue
+        path = os.fsdecode(line[2:]).replace("/", os.sep)
+        files.append(path)
+        if line[:1] == b"?":
+            untracked.add(path)
+    return files, untracked
+
+
+def get_changed_files(dir_path: str, commit: str) -> Optional[Set[str]]:
+    """
+    Files in dir_path whose content in the working tree differs from commit, committed or not,
+    relative to dir_path. Returns None if the commit is unknown, e.g. after a history rewrite
+    """
+    output = run_git(dir_path, ["diff", "--name-only", "-z", "--no-renames", "--relative", commit, "--"])
+    if output is None:
+        return None
+    return set(_split_paths(output))
+
+
+class GitSourceState:
+    """
+    What git reported for a source directory in this run, stored in the manifest so the next run
+    only has to look at the files changed since then
+
+    Args:
+        commit: HEAD when the sources were listed
+        dirty_files: Tracked files that differed from commit, these are checked again next run
+                     even if git no longer reports them, e.g. after a local change was reverted
+    """
+    __slots__ = ("commit", "dirty_files", "untracked_files", "changed_files")
+
+    def __init__(self, commit: Optional[str], dirty_files: Set[str], untracked_files: Set[str]):
+        self.commit = commit
+        self.dirty_files = dirty_files
+        self.untracked_files = untracked_files
+        self.changed_files: Optional[Set[str]] = None # Files to check this run, None to check every file
+
+
+    def to_dict(self) -> dict:
+        return {"commit": self.commit, "dirty_files": sorted(self.dirty_files)}
+
+
+    def find_changed_files(self, dir_path: str, previous: Optional[dict]):
+        """
+        Set changed_files from the state recorded by the previous run, left None if everything has to be checked
+
+        Args:
+            previous: GitSourceState.to_dict() of the previous run
+        """
+        if previous is None or previous.get("commit") is None or self.commit is None:
+            return
+
+        changed_files = self.dirty_files
+        if previous["commit"] != self.commit:
+            changed_files = get_changed_files(dir_path, previous["commit"])
+            if changed_files is None:
+                return
+        self.changed_files = changed_files | self.dirty_files | self.untracked_files | set(previous.get("dirty_files", ()))
+
+
+def get_git_source_state(dir_path: str, untracked_files: Set[str]) -> Optional[GitSourceState]:
+    commit = get_head_commit(dir_path)
+    dirty_files = get_changed_files(dir_path, commit) if commit is not None else set()
+    if dirty_files is None:
+        return None
+    return GitSourceState(commit, dirty_files, untracked_files)
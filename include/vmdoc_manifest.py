@@ -0,0 +1,183 @@
+"""
+[vmdoc:description]
+Persistent manifest of scanned vmdoc sources, used to skip unchanged files between runs
+[vmdoc:enddescription]
+"""
+
+import os
+import json
+import time
+import hashlib
+from typing import Dict, Iterator, Optional
+
+
+MANIFEST_FILE_NAME = ".vmdoc_manifest.json"
+
+# Bump when the generated output format changes, so every file is regenerated once
+MANIFEST_VERSION = 2
+
+
+def hash_file_content(data) -> str:
+    """Content hash stored in the manifest, accepts bytes or any buffer (e.g. mmap)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ManifestEntry:
+    """
+    One manifest entry, a compact record that can be read like the dict it is stored as,
+    e.g. entry["tagged"]
+    """
+    __slots__ = ("size", "mtime_ns", "sha256", "tagged", "description")
+
+    def __init__(self, size: int, mtime_ns: int, sha256: str, tagged: bool, description: str = ""):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+        self.tagged = tagged
+        self.description = description
+
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ManifestEntry) and all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+    @staticmethod
+    def from_dict(data: dict):
+        return ManifestEntry(data["size"], data["mtime_ns"], data["sha256"], data["tagged"], data.get("description", ""))
+
+
+def make_manifest_entry(stat: os.stat_result, sha256: str, tagged: bool, description: str = "") -> ManifestEntry:
+    return ManifestEntry(stat.st_size, stat.st_mtime_ns, sha256, tagged, description)
+
+
+class VmDocManifest:
+    """
+    Records size, mtime and content hash of every scanned source file together with
+    the tag-extraction result, so unchanged files can be skipped on the next run.
+
+    The manifest lives next to the generated files as docs/vmdoc/.vmdoc_manifest.json,
+    mkdocs ignores dot-files so it never ends up in the built site.
+
+    Entry format on disk (keyed by the source path relative to the scanned directory), ManifestEntry in memory:
+        {"size": int, "mtime_ns": int, "sha256": str, "tagged": bool, "description": str}
+
+    sha256 is left empty for files without any vmdoc marker, those are never hashed.
+
+    Source directories listed through git also get a record of the git state at the last run,
+    keyed by the source directory, see GitSourceState.
+    """
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, ManifestEntry] = dict()
+        self.git_sources: Dict[str, dict] = dict() # By absolute source directory
+
+        # Time of the previous save, files modified after it can not be trusted by stat alone
+        self._saved_ns = 0
+
+        # Set when an entry was added, changed or removed since load(), save() can be skipped otherwise
+        self.changed = False
+
+        # Latest save time save() may record, for a manifest merged from manifests saved earlier
+        self.saved_ns_limit: Optional[int] = None
+
+
+    def load(self):
+        self.entries = dict()
+        self.git_sources = dict()
+        self._saved_ns = 0
+        self.changed = True
+
+        if not os.path.exists(self.manifest_path):
+            return
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable manifest {self.manifest_path}: {e}")
+            return
+
+        if data.get("version") != MANIFEST_VERSION:
+            # Output format changed, regenerate everything
+            return
+
+        self.entries = {relative_path: ManifestEntry.from_dict(entry) for relative_path, entry in data.get("files", {}).items()}
+        self.git_sources = data.get("git_sources", {})
+        self._saved_ns = data.get("saved_ns", 0)
+        self.changed = False
+
+
+    def save(self):
+        data = {
+            "version": MANIFEST_VERSION,
+            "saved_ns": min(time.time_ns(), self.saved_ns_limit or time.time_ns()),
+            "files": {relative_path: entry.to_dict() for relative_path, entry in self.entries.items()},
+            "git_sources": self.git_sources,
+        }
+
+        # Write through a temp file so an interrupted run never leaves a truncated manifest
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, sort_keys=True, separators=(',', ':'))
+        os.replace(tmp_path, self.manifest_path)
+        self._saved_ns = data["saved_ns"]
+        self.changed = False
+
+
+    def get(self, relative_path: str) -> Optional[ManifestEntry]:
+        return self.entries.get(relative_path)
+
+
+    def set(self, relative_path: str, entry: ManifestEntry):
+        if self.entries.get(relative_path) != entry:
+            self.entries[relative_path] = entry
+            self.changed = True
+
+
+    def remove(self, relative_path: str):
+        if self.entries.pop(relative_path, None) is not None:
+            self.changed = True
+
+
+    @property
+    def saved_ns(self) -> int:
+        """Time of the save this manifest was loaded from or last written by, 0 if there was none"""
+        return self._saved_ns
+
+
+    def get_git_source(self, dir_path: str) -> Optional[dict]:
+        return self.git_sources.get(dir_path)
+
+
+    def set_git_source(self, dir_path: str, state: Optional[dict]):
+        """Record the git state of a source directory, None forgets it so every file is checked next run"""
+        if self.git_sources.get(dir_path) == state:
+            return
+        if state is None:
+            del self.git_sources[dir_path]
+        else:
+            self.git_sources[dir_path] = state
+        self.changed = True
+
+
+    def paths(self) -> Iterator[str]:
+        return iter(list(self.entries.keys()))
+
+
+    def matches_stat(self, entry: ManifestEntry, stat: os.stat_result) -> bool:
+        """
+        True if the file can be assumed unchanged without reading it.
+        Files modified at or after the previous save may have been changed again
+        within the same timestamp granularity, so those are always re-hashed.
+        """
+        return (entry["size"] == stat.st_size and
+                entry["mtime_ns"] == stat.st_mtime_ns and
+                stat.st_mtime_ns < self._saved_ns)
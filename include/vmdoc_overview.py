@@ -0,0 +1,121 @@
+"""
+[vmdoc:description]
+Per-directory overview pages of the documented files, and the matching hierarchical nav
+[vmdoc:enddescription]
+
+The root directory is listed in vmdoc/vmdocs.md, every other directory with documented files
+in vmdoc/overview/<directory>.md. A page lists the subdirectories and the files of its directory,
+so a page only changes when something in its directory, or the file count of a subdirectory, changes.
+"""
+
+import os
+import posixpath
+from urllib.parse import quote
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+
+ROOT_OVERVIEW_PAGE = "vmdocs.md"
+OVERVIEW_DIR_NAME = "overview"
+
+
+def get_overview_dir(src_relative_path: str) -> str:
+    """The directory of a source file as used for the overview pages, "" for the root"""
+    return posixpath.dirname(src_relative_path.replace(os.sep, "/").strip("/"))
+
+
+def get_overview_page(overview_dir: str) -> str:
+    """Path of the overview page of a directory, relative to docs/vmdoc"""
+    if overview_dir == "":
+        return ROOT_OVERVIEW_PAGE
+    return f"{OVERVIEW_DIR_NAME}/{overview_dir}.md"
+
+
+def iter_parent_dirs(overview_dir: str) -> Iterator[str]:
+    """Yield the directory and every parent directory, ending with the root"""
+    while overview_dir != "":
+        yield overview_dir
+        overview_dir = posixpath.dirname(overview_dir)
+    yield ""
+
+
+def _link(from_page: str, to_page: str) -> str:
+    return quote(posixpath.relpath(to_page, posixpath.dirname(from_page) or "."))
+
+
+class OverviewTree:
+    """The directories that contain documented files, directly or in a subdirectory"""
+    def __init__(self):
+        self.total_counts: Dict[str, int] = {"": 0} # Documented files in the directory and its subdirectories
+        self.file_counts: Dict[str, int] = dict() # Documented files directly in the directory
+        self.subdirs: Dict[str, Set[str]] = dict()
+
+
+    def add(self, src_relative_path: str):
+        overview_dir = get_overview_dir(src_relative_path)
+        self.file_counts[overview_dir] = self.file_counts.get(overview_dir, 0) + 1
+
+        child = None
+        for parent in iter_parent_dirs(overview_dir):
+            self.total_counts[parent] = self.total_counts.get(parent, 0) + 1
+            if child is not None:
+                self.subdirs.setdefault(parent, set()).add(child)
+            child = parent
+
+
+    def dirs(self) -> Iterable[str]:
+        return self.total_counts.keys()
+
+
+    def get_subdirs(self, overview_dir: str) -> List[str]:
+        return sorted(self.subdirs.get(overview_dir, ()))
+
+
+def render_overview_header(tree: OverviewTree, overview_dir: str) -> str:
+    """Title and subdirectory list of an overview page, the file lines follow"""
+    page = get_overview_page(overview_dir)
+    if overview_dir == "":
+        text = "# Vmdoc Overview\n\nThis document lists all the generated documentation files by directory.\n\n"
+    else:
+        text = f"# {overview_dir}/\n\n{tree.total_counts[overview_dir]} documented files in this directory and its subdirectories.\n\n"
+
+    subdirs = tree.get_subdirs(overview_dir)
+    if len(subdirs) != 0:
+        text += "## Directories\n\n"
+        for subdir in subdirs:
+            text += f"- [{posixpath.basename(subdir)}/]( {_link(page, get_overview_page(subdir))} ) - {tree.total_counts[subdir]} files\n"
+        text += "\n"
+
+    if tree.file_counts.get(overview_dir, 0) != 0:
+        text += "## Files\n\n"
+    return text
+
+
+def render_overview_file_line(overview_dir: str, src_relative_path: str, md_file_name: str, description: str) -> str:
+    """
+    Args:
+        md_file_name: The generated .md of the source file, relative to docs/vmdoc
+    """
+    return f"- [{src_relative_path}]( {_link(get_overview_page(overview_dir), md_file_name)} ) - {description}\n\n"
+
+
+def get_overview_nav(tree: OverviewTree, nav_prefix: str, max_depth: int) -> List[Tuple[str, object]]:
+    """
+    Nav entries of the overview pages, nested like the directories.
+    Directories deeper than max_depth are only linked from the overview page of their parent,
+    so the nav shown on every page stays small
+
+    Args:
+        nav_prefix: Path of docs/vmdoc relative to the mkdocs docs directory, e.g. "vmdoc"
+    """
+    def get_entries(overview_dir: str, depth: int) -> List[Tuple[str, object]]:
+        entries = list()
+        for subdir in tree.get_subdirs(overview_dir):
+            subdir_page = f"{nav_prefix}/{get_overview_page(subdir)}"
+            children = get_entries(subdir, depth + 1) if depth < max_depth else []
+            if len(children) == 0:
+                entries.append((posixpath.basename(subdir), subdir_page))
+            else:
+                entries.append((posixpath.basename(subdir), [("Overview", subdir_page)] + children))
+        return entries
+
+    return [("Overview", f"{nav_prefix}/{ROOT_OVERVIEW_PAGE}")] + get_entries("", 1)
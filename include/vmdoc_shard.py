@@ -0,0 +1,173 @@
+"""
+[vmdoc:description]
+Distributed vmdoc generation, every shard generates a deterministic slice of the files and the shards are merged into docs/vmdoc
+[vmdoc:enddescription]
+
+Every shard runs on its own (e.g. one CI matrix job per shard) and writes its outputs, with the partial manifest,
+to <shard_dir>/docs/vmdoc. Once all shards are done, with their shard directories in one place, the merge links
+or copies the outputs into docs/vmdoc and writes the overview pages and the nav.
+
+    python include/vmdoc_shard.py generate --shard 0 --shard-count 4 --src SRC_DIR --out SHARD_DIR
+    python include/vmdoc_shard.py merge --docs DOCS_DIR SHARD_DIR_0 SHARD_DIR_1 ...
+
+Files are assigned by the hash of their path relative to the source directory, so every shard gets
+the same slice on every host, whatever order the files are listed in.
+"""
+
+import sys
+from pathlib import Path
+if str(Path(__file__).resolve().parents[1]) not in sys.path:
+    sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import os
+import json
+import hashlib
+from typing import List
+
+from include.vmdoc import VmDocsGenerator
+from include.vmdoc_walk import SourceFileSet
+from include.vmdoc_manifest import VmDocManifest, MANIFEST_FILE_NAME
+from include import tracing
+
+
+SHARD_INFO_FILE_NAME = ".vmdoc_shard.json"
+
+# Bump when shards of an older version can not be merged
+SHARD_VERSION = 1
+
+
+def get_shard_index(src_relative_path: str, shard_count: int) -> int:
+    """The shard a source file belongs to, the same on every host and platform"""
+    normalized_path = src_relative_path.replace(os.sep, "/").strip("/")
+    return int(hashlib.sha256(normalized_path.encode('utf-8')).hexdigest()[:16], 16) % shard_count
+
+
+def select_shard(generator: VmDocsGenerator, shard_index: int, shard_count: int):
+    """Only keep the added files of one shard"""
+    generator.files = SourceFileSet(file for file in generator.files if get_shard_index(file[1], shard_count) == shard_index)
+
+
+def _get_output_dir(shard_dir: str) -> str:
+    return os.path.join(shard_dir, "docs", "vmdoc")
+
+
+def generate_vmdoc_shard(shard_dir: str, src_dir: str, shard_index: int, shard_count: int,
+                         gitignore_content: str = None, jobs: int = 1, raw_store: bool = False):
+    """
+    Generate the outputs of one shard into <shard_dir>/docs/vmdoc, without overview and nav.
+    Run again in the same shard_dir, only the files that changed are processed.
+
+    Args:
+        shard_index: Which shard this is, 0 to shard_count - 1
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard {shard_index} of {shard_count}")
+
+    generator = VmDocsGenerator(shard_dir)
+    if gitignore_content:
+        generator.set_pattern(gitignore_content)
+    generator.set_raw_source_options(use_store=raw_store)
+    generator.write_overview = False
+
+    generator.add_files_in_dir(src_dir)
+    select_shard(generator, shard_index, shard_count)
+    print(f"Shard {shard_index} of {shard_count}: {len(generator.files)} files")
+    generator.generate(jobs=jobs)
+
+    shard_info = {"version": SHARD_VERSION, "shard_index": shard_index, "shard_count": shard_count, "raw_store": raw_store}
+    with open(os.path.join(_get_output_dir(shard_dir), SHARD_INFO_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(shard_info, f)
+
+
+def merge_vmdoc_shards(docs_dir: str, shard_dirs: List[str]):
+    """
+    Combine the outputs of every shard into <docs_dir>/docs/vmdoc, and write the overview pages and the nav.
+    Raises ValueError if a shard is missing, or the shards do not belong together
+    """
+    shard_infos = list()
+    for shard_dir in shard_dirs:
+        try:
+            with open(os.path.join(_get_output_dir(shard_dir), SHARD_INFO_FILE_NAME), 'r', encoding='utf-8') as f:
+                shard_infos.append(json.load(f))
+        except (OSError, ValueError) as e:
+            raise ValueError(f"{shard_dir} is not a finished vmdoc shard: {e}")
+
+    shard_count = shard_infos[0]["shard_count"] if shard_infos else 0
+    if any(info.get("version") != SHARD_VERSION or info["shard_count"] != shard_count for info in shard_infos):
+        raise ValueError("The shards were generated with different shard counts or versions")
+    if sorted(info["shard_index"] for info in shard_infos) != list(range(shard_count)):
+        raise ValueError(f"Expected shards 0 to {shard_count - 1}, got {sorted(info['shard_index'] for info in shard_infos)}")
+    raw_store = shard_infos[0]["raw_store"]
+    if any(info["raw_store"] != raw_store for info in shard_infos):
+        raise ValueError("Some shards were generated with raw_store and some without")
+
+    entries = dict()
+    saved_ns_limit = None
+    with tracing.span("merge_manifests"):
+        for shard_dir in shard_dirs:
+            manifest = VmDocManifest(os.path.join(_get_output_dir(shard_dir), MANIFEST_FILE_NAME))
+            manifest.load()
+            entries.update(manifest.entries)
+            saved_ns_limit = manifest.saved_ns if saved_ns_limit is None else min(saved_ns_limit, manifest.saved_ns)
+
+    generator = VmDocsGenerator(docs_dir)
+    generator.set_raw_source_options(use_store=raw_store)
+    generator.merge_generated_outputs([_get_output_dir(shard_dir) for shard_dir in shard_dirs], entries, saved_ns_limit)
+    print(f"Merged {shard_count} shards, {len(entries)} files")
+
+
+def _generate_shard_process(args):
+    shard_dir, src_dir, shard_index, shard_count, gitignore_content, raw_store = args
+    generate_vmdoc_shard(shard_dir, src_dir, shard_index, shard_count, gitignore_content, raw_store=raw_store)
+
+
+def generate_sharded_locally(docs_dir: str, src_dir: str, shard_count: int, shards_dir: str = None,
+                             gitignore_content: str = None, raw_store: bool = False):
+    """
+    Run every shard in its own process with a shared shards directory, then merge them.
+    The same as a distributed run, useful to test it on one machine
+
+    Args:
+        shards_dir: Where the shard directories are created, defaults to <docs_dir>/.vmdoc_shards
+    """
+    import concurrent.futures
+
+    shards_dir = shards_dir or os.path.join(docs_dir, ".vmdoc_shards")
+    shard_dirs = [os.path.join(shards_dir, str(shard_index)) for shard_index in range(shard_count)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=shard_count) as executor:
+        list(executor.map(_generate_shard_process, [(shard_dirs[shard_index], src_dir, shard_index, shard_count, gitignore_content, raw_store)
+                                                    for shard_index in range(shard_count)]))
+    merge_vmdoc_shards(docs_dir, shard_dirs)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate vmdoc in shards and merge them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Generate one shard")
+    generate_parser.add_argument("--shard", type=int, required=True, help="Index of this shard, from 0")
+    generate_parser.add_argument("--shard-count", type=int, required=True)
+    generate_parser.add_argument("--src", required=True, help="The source directory")
+    generate_parser.add_argument("--out", required=True, help="The shard directory")
+    generate_parser.add_argument("--pattern-file", help="File with .gitignore-like patterns of the files to include")
+    generate_parser.add_argument("--jobs", type=int, default=1)
+    generate_parser.add_argument("--raw-store", action="store_true")
+
+    merge_parser = subparsers.add_parser("merge", help="Merge every shard into the docs directory")
+    merge_parser.add_argument("--docs", required=True, help="The mkdocs project directory")
+    merge_parser.add_argument("shard_dirs", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        gitignore_content = None
+        if args.pattern_file:
+            with open(args.pattern_file, 'r') as f:
+                gitignore_content = f.read()
+        generate_vmdoc_shard(args.out, args.src, args.shard, args.shard_count, gitignore_content, args.jobs, args.raw_store)
+    else:
+        merge_vmdoc_shards(args.docs, args.shard_dirs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+[vmdoc:description]
+Directory walker that prunes excluded directories, with .gitignore-like patterns compiled into a single regex
+[vmdoc:enddescription]
+"""
+
+import os
+import re
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """
+    Translate a glob into a regex, * and ** both match across directories
+    (like fnmatch, so *venv/* matches a/b/venv/c.py), ? matches a single character
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "*":
+            while i + 1 < len(pattern) and pattern[i + 1] == "*":
+                i += 1
+            regex += ".*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                char_class = pattern[i + 1:end]
+                if char_class.startswith("!"):
+                    char_class = "^" + char_class[1:]
+                regex += "[" + char_class.replace("\\", "\\\\") + "]"
+                i = end
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+
+class WalkStats:
+    """Counters reported by walk_matching_files"""
+    __slots__ = ("dirs_walked", "dirs_pruned", "files_matched", "files_excluded")
+
+    def __init__(self):
+        self.dirs_walked = 0
+        self.dirs_pruned = 0
+        self.files_matched = 0
+        self.files_excluded = 0
+
+
+    def __str__(self):
+        return (f"{self.files_matched} files matched, {self.files_excluded} files excluded, "
+                f"{self.dirs_walked} directories walked, {self.dirs_pruned} directories pruned")
+
+
+class CompiledPatternMatcher:
+    """
+    .gitignore-like include/exclude rules, drop-in replacement for GitignorePatternMatcher.
+
+    Rules are evaluated like .gitignore, the last matching rule decides, and rules starting
+    with ! include the path again. A rule starting with / is anchored to the walked directory,
+    other rules match at any depth. A rule ending with / matches everything inside the directory.
+
+    All rules are compiled into one regex for files, and one for directories that can be
+    pruned. A directory is pruned when an exclude rule covers everything inside it
+    (e.g. node_modules/*) and no include rule comes after it, so nothing inside can match.
+    """
+    def __init__(self):
+        self._rules: List[Tuple[str, bool]] = list() # (pattern, negate)
+        self._file_regex = None
+        self._prune_regex = None
+
+
+    def add_pattern_str(self, pattern_str: str):
+        for line in pattern_str.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+
+            if line.endswith("/"):
+                line += "*"
+
+            self._rules.append((line, negate))
+
+        self._compile()
+
+
+    def copy(self):
+        matcher = CompiledPatternMatcher()
+        matcher._rules = list(self._rules)
+        matcher._compile()
+        return matcher
+
+
+    def _rule_regex(self, pattern: str) -> str:
+        if pattern.startswith("/"):
+            return _glob_to_regex(pattern[1:])
+        return "(?:.*/)?" + _glob_to_regex(pattern)
+
+
+    def _compile(self):
+        # Alternatives are tried in order, so list the rules last to first,
+        # then the first alternative that matches is the rule that decides
+        file_alternatives = list()
+        for i in reversed(range(len(self._rules))):
+            pattern, _ = self._rules[i]
+            file_alternatives.append(f"(?P<r{i}>{self._rule_regex(pattern)})")
+        self._file_regex = re.compile("|".join(file_alternatives), re.DOTALL) if file_alternatives else None
+
+        prune_alternatives = list()
+        for i, (pattern, negate) in enumerate(self._rules):
+            if negate or not (pattern.endswith("/*") or pattern.endswith("/**")):
+                continue
+
+            if any(later_negate for _, later_negate in self._rules[i + 1:]):
+                # A later include rule could match something inside the directory
+                continue
+
+            dir_pattern = pattern[:-2] if pattern.endswith("/*") else pattern[:-3]
+            prune_alternatives.append(self._rule_regex(dir_pattern))
+        self._prune_regex = re.compile("|".join(prune_alternatives), re.DOTALL) if prune_alternatives else None
+
+
+    def is_included(self, relative_path: str) -> bool:
+        """relative_path uses / as separator and has no leading /"""
+        if self._file_regex is None:
+            return True
+
+        match = self._file_regex.fullmatch(relative_path)
+        if match is None:
+            return True
+
+        _, negate = self._rules[int(match.lastgroup[1:])]
+        return negate
+
+
+    def is_pruned_dir(self, relative_dir: str) -> bool:
+        """True if no file inside the directory can be included"""
+        return self._prune_regex is not None and self._prune_regex.fullmatch(relative_dir) is not None
+
+
+    def list_matching_files(self, dir_path: str, stats: Optional[WalkStats] = None) -> List[str]:
+        return list(walk_matching_files(dir_path, self, stats))
+
+
+def walk_matching_files(dir_path: str, matcher: CompiledPatternMatcher, stats: Optional[WalkStats] = None) -> Iterator[str]:
+    """
+    Yield the full path of every file in dir_path included by matcher, in a deterministic order.
+    Excluded directories are pruned as soon as they are seen and never descended into.
+    """
+    if stats is None:
+        stats = WalkStats()
+
+    stack = [(dir_path, "")]
+    while stack:
+        current_path, current_relative_path = stack.pop()
+        stats.dirs_walked += 1
+
+        try:
+            with os.scandir(current_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Error reading directory {current_path}: {e}")
+            continue
+
+        sub_dirs = list()
+        for entry in entries:
+            relative_path = current_relative_path + entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if is_dir:
+                if matcher.is_pruned_dir(relative_path):
+                    stats.dirs_pruned += 1
+                else:
+                    sub_dirs.append((entry.path, relative_path + "/"))
+            elif matcher.is_included(relative_path):
+                stats.files_matched += 1
+                yield entry.path
+            else:
+                stats.files_excluded += 1
+
+        # Walk the sub directories in sorted order
+        stack.extend(reversed(sub_dirs))
+
+
+def walk_matching_dirs(dir_path: str, matcher: CompiledPatternMatcher) -> Iterator[str]:
+    """Yield dir_path and every directory below it that is not pruned by matcher"""
+    stack = [(dir_path, "")]
+    while stack:
+        current_path, current_relative_path = stack.pop()
+        yield current_path
+
+        try:
+            with os.scandir(current_path) as it:
+                for entry in it:
+                    relative_path = current_relative_path + entry.name
+                    if entry.is_dir(follow_symlinks=False) and not matcher.is_pruned_dir(relative_path):
+                        stack.append((entry.path, relative_path + "/"))
+        except OSError:
+            continue
+
+
+class _DirectoryFiles:
+    __slots__ = ("relative_dir", "names")
+
+    def __init__(self, relative_dir: str):
+        self.relative_dir = relative_dir
+        self.names = set()
+
+
+class SourceFileSet:
+    """
+    Set of (full_path, relative_path) tuples, stored per directory so the directory part of the paths
+    is kept once instead of twice per file. The tuples are created again when iterating.
+    Iteration is sorted by directory, then by file name.
+    """
+    __slots__ = ("_dirs", "_other", "_count")
+
+    def __init__(self, files=()):
+        self._dirs: Dict[str, _DirectoryFiles] = dict()
+        self._other = set() # Tuples that do not split into directory and name the same way
+        self._count = 0
+        for file in files:
+            self.add(file)
+
+
+    def _split(self, file: Tuple[str, str]):
+        full_path, relative_path = file
+        dir_path, separator, name = full_path.rpartition(os.sep)
+        if not separator or not relative_path.endswith(separator + name):
+            return None, None, None
+        return dir_path, relative_path[:-len(name) - 1], name
+
+
+    def add(self, file: Tuple[str, str]):
+        dir_path, relative_dir, name = self._split(file)
+        directory = self._dirs.get(dir_path)
+        if directory is None and dir_path is not None:
+            directory = self._dirs[sys.intern(dir_path)] = _DirectoryFiles(relative_dir)
+
+        if directory is None or directory.relative_dir != relative_dir:
+            # The same directory reached from another root, keep the tuple as it is
+            if file not in self._other:
+                self._other.add(file)
+                self._count += 1
+            return
+
+        if name not in directory.names:
+            directory.names.add(name)
+            self._count += 1
+
+
+    def discard(self, file: Tuple[str, str]):
+        if file in self._other:
+            self._other.discard(file)
+            self._count -= 1
+            return
+
+        dir_path, relative_dir, name = self._split(file)
+        directory = self._dirs.get(dir_path)
+        if directory is not None and directory.relative_dir == relative_dir and name in directory.names:
+            directory.names.discard(name)
+            self._count -= 1
+            if not directory.names:
+                del self._dirs[dir_path]
+
+
+    def __contains__(self, file: Tuple[str, str]) -> bool:
+        if file in self._other:
+            return True
+        dir_path, relative_dir, name = self._split(file)
+        directory = self._dirs.get(dir_path)
+        return directory is not None and directory.relative_dir == relative_dir and name in directory.names
+
+
+    def __len__(self) -> int:
+        return self._count
+
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for dir_path in sorted(self._dirs):
+            directory = self._dirs[dir_path]
+            for name in sorted(directory.names):
+                yield (dir_path + os.sep + name, directory.relative_dir + os.sep + name)
+        yield from sorted(self._other)
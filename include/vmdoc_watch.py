@@ -0,0 +1,288 @@
+"""
+[vmdoc:description]
+Watch source files and regenerate the vmdoc outputs of only the files that changed
+[vmdoc:enddescription]
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+from typing import List, Optional, Set, Tuple
+
+from include.vmdoc_walk import CompiledPatternMatcher, walk_matching_dirs, walk_matching_files
+
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class _InotifyBackend:
+    """Recursive inotify watch on every directory that is not pruned by the matcher"""
+    def __init__(self, src_dir: str, matcher: CompiledPatternMatcher):
+        self._src_dir = src_dir
+        self._matcher = matcher
+        self._wd_paths = dict()
+
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        try:
+            self._add_watches(src_dir)
+        except OSError:
+            self.close()
+            raise
+
+
+    def _add_watches(self, dir_path: str):
+        relative_path = os.path.relpath(dir_path, self._src_dir)
+        if relative_path != "." and self._matcher.is_pruned_dir(relative_path.replace(os.sep, "/")):
+            return
+
+        for path in walk_matching_dirs(dir_path, self._matcher_below(relative_path)):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+            if wd < 0:
+                error = self._ctypes.get_errno()
+                if error == errno.ENOENT:
+                    continue # Removed while walking
+                # ENOSPC means fs.inotify.max_user_watches is reached
+                raise OSError(error, f"inotify_add_watch failed for {path}")
+            self._wd_paths[wd] = path
+
+
+    def _matcher_below(self, relative_path: str) -> CompiledPatternMatcher:
+        # walk_matching_dirs matches relative to the walked directory, anchor the rules to src_dir again
+        if relative_path == ".":
+            return self._matcher
+        return _PrefixedMatcher(self._matcher, relative_path.replace(os.sep, "/") + "/")
+
+
+    def _remove_watches(self, dir_path: str):
+        for wd, path in list(self._wd_paths.items()):
+            if path == dir_path or path.startswith(dir_path + os.sep):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._wd_paths[wd]
+
+
+    def read_changes(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        """
+        Wait up to timeout seconds for events.
+        Returns the changed paths, or None if the kernel queue overflowed and events were lost
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = os.read(self._fd, 256 * 1024)
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + _INOTIFY_EVENT.size:offset + _INOTIFY_EVENT.size + length].rstrip(b"\0")
+            offset += _INOTIFY_EVENT.size + length
+
+            if mask & _IN_Q_OVERFLOW:
+                return None
+
+            if mask & _IN_IGNORED:
+                self._wd_paths.pop(wd, None)
+                continue
+
+            dir_path = self._wd_paths.get(wd)
+            if dir_path is None:
+                continue
+
+            path = os.path.join(dir_path, os.fsdecode(name)) if name else dir_path
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add_watches(path)
+                elif mask & _IN_MOVED_FROM:
+                    self._remove_watches(path)
+            changes.add(path)
+
+        return changes
+
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PrefixedMatcher:
+    """Matcher for a sub directory, checks paths as if they were relative to the original directory"""
+    def __init__(self, matcher: CompiledPatternMatcher, prefix: str):
+        self._matcher = matcher
+        self._prefix = prefix
+
+
+    def is_included(self, relative_path: str) -> bool:
+        return self._matcher.is_included(self._prefix + relative_path)
+
+
+    def is_pruned_dir(self, relative_dir: str) -> bool:
+        return self._matcher.is_pruned_dir(self._prefix + relative_dir)
+
+
+class _PollingBackend:
+    """Fallback that compares the size and mtime of the matched files, excluded directories are never walked"""
+    def __init__(self, src_dir: str, matcher: CompiledPatternMatcher, poll_interval: float):
+        self._src_dir = src_dir
+        self._matcher = matcher
+        self._poll_interval = poll_interval
+        self._snapshot = self._scan()
+
+
+    def _scan(self):
+        snapshot = dict()
+        for path in walk_matching_files(self._src_dir, self._matcher):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+
+    def read_changes(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        time.sleep(self._poll_interval if timeout is None else min(timeout, self._poll_interval))
+
+        snapshot = self._scan()
+        changes = set(path for path, state in snapshot.items() if self._snapshot.get(path) != state)
+        changes.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changes
+
+
+    def close(self):
+        pass
+
+
+class SourceWatcher:
+    """
+    Watch the files in src_dir that are matched by pattern_matcher.
+
+    Uses inotify on Linux, and falls back to polling file stats on other platforms or
+    when the inotify watch limit is reached. Directories in exclude_dirs (e.g. the docs
+    directory when it is inside src_dir) are never watched.
+    """
+    def __init__(self, src_dir: str, pattern_matcher: CompiledPatternMatcher, exclude_dirs: List[str] = [],
+                 debounce: float = 0.3, poll_interval: float = 1.0, max_delay: float = 5.0):
+        self.src_dir = src_dir
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        matcher = pattern_matcher.copy()
+        for exclude_dir in exclude_dirs:
+            relative_path = os.path.relpath(os.path.abspath(exclude_dir), os.path.abspath(src_dir))
+            if not relative_path.startswith(".."):
+                matcher.add_pattern_str("/" + relative_path.replace(os.sep, "/") + "/")
+        self.matcher = matcher # The pattern matcher with exclude_dirs added
+
+        try:
+            self._backend = _InotifyBackend(src_dir, matcher)
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"inotify not available ({e}), polling for changes every {poll_interval}s")
+            self._backend = _PollingBackend(src_dir, matcher, poll_interval)
+
+
+    def _read_changes(self, timeout: Optional[float]) -> Optional[Set[str]]:
+        try:
+            return self._backend.read_changes(timeout)
+        except OSError as e:
+            # E.g. the inotify watch limit reached for a new directory, events may have been lost
+            if isinstance(self._backend, _PollingBackend):
+                raise
+            print(f"Watching with inotify failed ({e}), polling for changes every {self.poll_interval}s")
+            self._backend.close()
+            self._backend = _PollingBackend(self.src_dir, self.matcher, self.poll_interval)
+            return None
+
+
+    def wait_for_changes(self) -> Optional[Set[str]]:
+        """
+        Block until something changes, then keep collecting until no change arrives for
+        `debounce` seconds, so a burst of saves results in a single regeneration.
+        Returns the changed paths, or None if everything has to be rescanned.
+        """
+        changes = set()
+        while len(changes) == 0:
+            changes = self._read_changes(None)
+            if changes is None:
+                return None
+
+        deadline = time.monotonic() + self.max_delay
+        while time.monotonic() < deadline:
+            more_changes = self._read_changes(self.debounce)
+            if more_changes is None:
+                return None
+            if len(more_changes) == 0:
+                break
+            changes.update(more_changes)
+
+        return changes
+
+
+    def close(self):
+        self._backend.close()
+
+
+def expand_changed_paths(changed_paths: Set[str], src_dir: str, tracked_files: Set[Tuple[str, str]],
+                         matcher: Optional[CompiledPatternMatcher] = None) -> List[Tuple[str, str]]:
+    """
+    Turn changed paths into (full_path, relative_path) file tuples for VmDocsGenerator.update_files.
+    A created directory expands to the files inside it, a removed one to the tracked files that were inside it
+
+    Args:
+        matcher: The rules relative to src_dir, excluded directories like a new node_modules/ are not walked
+    """
+    matcher = matcher or CompiledPatternMatcher()
+    changed_files = set()
+    for path in changed_paths:
+        if os.path.isdir(path):
+            relative_dir = os.path.relpath(path, src_dir).replace(os.sep, "/")
+            if relative_dir != "." and matcher.is_pruned_dir(relative_dir):
+                continue
+            dir_matcher = matcher if relative_dir == "." else _PrefixedMatcher(matcher, relative_dir + "/")
+            for file_path in walk_matching_files(path, dir_matcher):
+                changed_files.add((file_path, file_path.replace(src_dir, "")))
+        else:
+            changed_files.add((path, path.replace(src_dir, "")))
+            if not os.path.exists(path):
+                changed_files.update(tracked for tracked in tracked_files if tracked[0].startswith(path + os.sep))
+
+    return sorted(changed_files)
+
+
+def watch_and_regenerate(generator, src_dir: str, watcher: SourceWatcher, jobs: int = 1):
+    """Regenerate the outputs of changed files until interrupted"""
+    while True:
+        changed_paths = watcher.wait_for_changes()
+        if changed_paths is None:
+            print("Lost file events, rescanning everything")
+            generator.clear_files()
+            generator.add_files_in_dir(src_dir)
+            generator.generate(jobs=jobs)
+            continue
+
+        changed_files = expand_changed_paths(changed_paths, src_dir, generator.files, watcher.matcher)
+        regenerated_count = generator.update_files(changed_files, jobs=jobs)
+        print(f"{len(changed_files)} files changed, regenerated {regenerated_count}")